@@ -1,15 +1,27 @@
 """
 Aplicación principal FastAPI - Sistema SaaS Catastro
 """
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, PlainTextResponse
 from pathlib import Path
 
+from compression import CompressionMiddleware
 from config import settings
-from database import Base, engine
-from routers import auth, subscriptions, catastro
+from database import Base, engine, async_engine
+import metrics
+from routers import admin, auth, subscriptions, catastro
+from auth.utils import shutdown_password_executor
+from services.quota_reset_service import run_scheduler as run_quota_reset_scheduler
+from services.response_cache import cached_response
+from services.spatial_index_service import setup_spatial_index
+from services.stripe_service import stripe_service
+from services.stripe_event_service import run_consumer as run_stripe_event_consumer
+from services.usage_service import run_reconcile_scheduler as run_usage_reconcile_scheduler
+from static_assets import PrecompressedStaticFiles
 
 
 # ============================
@@ -19,10 +31,38 @@ from routers import auth, subscriptions, catastro
 Base.metadata.create_all(bind=engine)
 
 
+# ============================
+#   Ciclo de vida
+# ============================
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Índice GiST de bbox si la base de datos tiene PostGIS
+    await setup_spatial_index(async_engine)
+    # Consumidor de la bandeja de webhooks de Stripe
+    stripe_consumer = asyncio.create_task(run_stripe_event_consumer())
+    # Renovación mensual de cuotas (un solo worker por pasada: advisory lock)
+    quota_scheduler = asyncio.create_task(run_quota_reset_scheduler(async_engine))
+    # Contadores de uso recalculados desde queries (histórico y desvíos)
+    usage_reconciler = asyncio.create_task(run_usage_reconcile_scheduler())
+    # Volcado de métricas para /metrics con varios workers (METRICS_DIR)
+    metrics_flusher = asyncio.create_task(metrics.run_flusher())
+    yield
+    for task in (stripe_consumer, quota_scheduler, usage_reconciler, metrics_flusher):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    # Cerrar el pool de conexiones asíncronas al apagar el worker
+    await async_engine.dispose()
+    shutdown_password_executor()
+    stripe_service.shutdown()
+
+
 # ============================
 #   Crear Aplicación FastAPI
 # ============================
 app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,  # JSON con orjson
     title=settings.APP_NAME,
     description="Sistema SaaS para análisis catastral integral",
     version="1.0.0",
@@ -42,8 +82,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Paginación por cursor en /api/catastro/queries
 )
 
+# Compresión br/gzip de las respuestas JSON (no de streams ni de /static precomprimido)
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_BYTES)
+
+# Latencia por ruta para /metrics (el último añadido es el más externo)
+app.add_middleware(metrics.MetricsMiddleware)
+
 
 # ============================
 #   Routers
@@ -51,29 +98,34 @@ app.add_middleware(
 app.include_router(auth.router)
 app.include_router(subscriptions.router)
 app.include_router(catastro.router)
+app.include_router(admin.router)
 
 
 # ============================
 #   Archivos estáticos
 # ============================
+# Precomprimidos (gzip/br) en memoria al arrancar, con URLs con hash inmutables
 static_path = Path(__file__).parent / "static"
+static_files = None
 if static_path.exists():
-    app.mount("/static", StaticFiles(directory=str(static_path)), name="static")
+    static_files = PrecompressedStaticFiles(directory=str(static_path))
+    app.mount("/static", static_files, name="static")
 
 
 # ============================
 #   Templates (HTML)
 # ============================
 templates_path = Path(__file__).parent / "templates"
+landing_page = templates_path / "pages" / "landing.html"
 
 
 @app.get("/", response_class=HTMLResponse)
+@cached_response(media_type="text/html; charset=utf-8", watch_files=[landing_page])
 async def root():
-    """Página principal del SaaS"""
-    landing_page = templates_path / "pages" / "landing.html"
-
+    """Página principal del SaaS (cacheada en memoria; se relee al cambiar landing.html)"""
     if landing_page.exists():
-        return landing_page.read_text(encoding="utf-8")
+        html = landing_page.read_text(encoding="utf-8")
+        return static_files.rewrite_html(html) if static_files else html
 
     return """
     <html>
@@ -99,6 +151,16 @@ async def health_check():
     return {"status": "healthy", "version": "1.0.0"}
 
 
+# ============================
+#   Métricas (Prometheus)
+# ============================
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics_endpoint():
+    # Volcado y lectura de METRICS_DIR: E/S bloqueante fuera del event loop
+    body = await run_in_threadpool(metrics.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # ============================
 #   Ejecución directa
 # ============================
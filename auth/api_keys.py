@@ -0,0 +1,88 @@
+"""
+Claves de API (acceso programático, plan Enterprise)
+
+Formato: cs_<prefijo>_<secreto>. En BD solo se guardan el prefijo (indexado,
+para localizar la clave) y el HMAC-SHA256 de la clave completa. Validar una
+clave cuesta un HMAC y, con la caché de identidad, ni siquiera eso ni una
+consulta a BD: nada que ver con un verify de bcrypt.
+"""
+import dataclasses
+import hashlib
+import hmac
+import secrets
+from typing import Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from auth.identity import UserSnapshot, identity_cache
+from config import settings
+import models
+
+
+API_KEY_PREFIX = "cs"
+
+# Scopes que se pueden conceder a una clave. Las sesiones JWT tienen acceso
+# completo; la gestión de claves y suscripciones requiere sesión JWT.
+SCOPE_QUERIES_READ = "queries:read"
+SCOPE_QUERIES_WRITE = "queries:write"
+SCOPE_PROCESSING = "processing"
+API_KEY_SCOPES = (SCOPE_QUERIES_READ, SCOPE_QUERIES_WRITE, SCOPE_PROCESSING)
+
+
+def _digest(key: str) -> str:
+    """HMAC-SHA256 (hex) de la clave completa"""
+    secret = (settings.API_KEY_HMAC_SECRET or settings.SECRET_KEY).encode("utf-8")
+    return hmac.new(secret, key.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def is_api_key(credential: str) -> bool:
+    """La credencial tiene formato de clave de API (y no de JWT)"""
+    return credential.startswith(API_KEY_PREFIX + "_")
+
+
+def generate_api_key() -> Tuple[str, str, str]:
+    """Genera una clave nueva. Devuelve (clave, prefijo, digest)."""
+    prefix = secrets.token_hex(4)
+    key = f"{API_KEY_PREFIX}_{prefix}_{secrets.token_urlsafe(32)}"
+    return key, prefix, _digest(key)
+
+
+def _split_prefix(key: str) -> Optional[str]:
+    parts = key.split("_", 2)
+    if len(parts) != 3 or parts[0] != API_KEY_PREFIX or not parts[1] or not parts[2]:
+        return None
+    return parts[1]
+
+
+async def authenticate_api_key(db: AsyncSession, key: str) -> Optional[UserSnapshot]:
+    """
+    Identidad (con los scopes de la clave) para una clave de API, o None si no
+    es válida o está revocada. Los aciertos se sirven desde la caché de identidad.
+    """
+    cached = identity_cache.get(key)
+    if cached is not None:
+        return cached
+
+    prefix = _split_prefix(key)
+    if prefix is None:
+        return None
+
+    api_key = await db.scalar(
+        select(models.ApiKey)
+        .options(joinedload(models.ApiKey.user).joinedload(models.User.subscription))
+        .where(models.ApiKey.prefix == prefix, models.ApiKey.revoked_at.is_(None))
+    )
+    if api_key is None or not hmac.compare_digest(api_key.key_hash, _digest(key)):
+        return None
+
+    # Acceso por API: solo mientras el plan sea Enterprise
+    subscription = api_key.user.subscription
+    if subscription is None or subscription.plan_type != models.PlanType.ENTERPRISE:
+        return None
+
+    snapshot = dataclasses.replace(
+        UserSnapshot.from_model(api_key.user),
+        scopes=frozenset(api_key.scopes.split())
+    )
+    identity_cache.put(key, snapshot)
+    return snapshot
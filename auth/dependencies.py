@@ -1,22 +1,37 @@
 """
 Dependencias de autenticación para FastAPI
 """
+from typing import Optional
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import get_db
-from auth.jwt import verify_token
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from database import get_async_db
+from auth.api_keys import authenticate_api_key, is_api_key
+from auth.identity import UserSnapshot, identity_cache
+from auth.jwt import decode_token
+from services.quota_service import consume_queries, get_quota_state
 import models
 
-# OAuth2 scheme
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+# OAuth2 scheme (JWT) y cabecera de clave de API; sin auto_error: basta con una de las dos
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 
 async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> models.User:
-    """Obtener usuario actual desde token"""
+    token: Optional[str] = Depends(oauth2_scheme),
+    api_key: Optional[str] = Depends(api_key_header),
+    db: AsyncSession = Depends(get_async_db)
+) -> UserSnapshot:
+    """
+    Obtener usuario actual desde token JWT o clave de API
+    
+    La clave de API llega en X-API-Key (o como Bearer cs_...).
+    Devuelve una instantánea inmutable (UserSnapshot) cacheada por credencial
+    durante IDENTITY_CACHE_TTL_SECONDS: en un acierto no hay ni decodificación
+    del JWT ni consultas a BD (la sesión no llega a abrir conexión).
+    """
     
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -24,22 +39,50 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    email = verify_token(token)
+    if api_key is None and token is not None and is_api_key(token):
+        api_key = token
+    
+    if api_key is not None:
+        user = await authenticate_api_key(db, api_key)
+        if user is None:
+            raise credentials_exception
+        return user
     
-    if email is None:
+    if token is None:
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.email == email).first()
+    cached = identity_cache.get(token)
+    if cached is not None:
+        return cached
+    
+    payload = decode_token(token)
+    
+    if payload is None:
+        raise credentials_exception
+    
+    email = payload["sub"]
+    
+    # La suscripción se carga en la misma consulta: AsyncSession no admite
+    # cargas perezosas y casi todos los endpoints la necesitan después.
+    result = await db.execute(
+        select(models.User)
+        .options(joinedload(models.User.subscription))
+        .where(models.User.email == email)
+    )
+    user = result.scalars().first()
     
     if user is None:
         raise credentials_exception
     
-    return user
+    snapshot = UserSnapshot.from_model(user)
+    identity_cache.put(token, snapshot, payload.get("exp"))
+    
+    return snapshot
 
 
 async def get_current_active_user(
-    current_user: models.User = Depends(get_current_user)
-) -> models.User:
+    current_user: UserSnapshot = Depends(get_current_user)
+) -> UserSnapshot:
     """Verificar que el usuario esté activo"""
     
     if not current_user.is_active:
@@ -48,45 +91,72 @@ async def get_current_active_user(
     return current_user
 
 
-async def check_subscription_active(
-    current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-) -> models.User:
-    """Verificar que el usuario tenga suscripción activa"""
-    
-    subscription = db.query(models.Subscription).filter(
-        models.Subscription.user_id == current_user.id
-    ).first()
-    
-    if not subscription:
-        raise HTTPException(
-            status_code=403,
-            detail="No active subscription found"
-        )
-    
-    if subscription.status != models.SubscriptionStatus.ACTIVE:
-        raise HTTPException(
-            status_code=403,
-            detail="Subscription is not active"
-        )
+def require_scope(scope: str):
+    """
+    Dependencia que exige un scope a la credencial. Las sesiones JWT tienen
+    todos; las claves de API, los concedidos al crearlas.
+    Uso: @router.get(..., dependencies=[Depends(require_scope(SCOPE_QUERIES_READ))])
+    """
+    
+    async def dependency(current_user: UserSnapshot = Depends(get_current_active_user)) -> UserSnapshot:
+        if not current_user.has_scope(scope):
+            raise HTTPException(status_code=403, detail=f"API key lacks required scope: {scope}")
+        return current_user
+    
+    return dependency
+
+
+async def require_session(
+    current_user: UserSnapshot = Depends(get_current_active_user)
+) -> UserSnapshot:
+    """Exigir sesión JWT: gestión de claves y suscripciones no admite claves de API"""
+    
+    if current_user.scopes is not None:
+        raise HTTPException(status_code=403, detail="This operation requires a user session (not an API key)")
+    
+    return current_user
+
+
+async def require_admin(
+    current_user: UserSnapshot = Depends(require_session)
+) -> UserSnapshot:
+    """Exigir usuario administrador con sesión JWT"""
+    
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
     
     return current_user
 
 
-async def check_query_limit(
-    current_user: models.User = Depends(check_subscription_active),
-    db: Session = Depends(get_db)
-) -> models.User:
-    """Verificar que el usuario no haya excedido su límite de consultas"""
-    
-    subscription = db.query(models.Subscription).filter(
-        models.Subscription.user_id == current_user.id
-    ).first()
-    
-    if subscription.queries_used >= subscription.queries_limit:
-        raise HTTPException(
-            status_code=403,
-            detail=f"Query limit reached ({subscription.queries_limit}). Please upgrade your plan."
-        )
+async def raise_quota_error(db: AsyncSession, user_id: str, n: int = 1):
+    """Lanza el 403 adecuado cuando consume_queries rechaza la petición"""
+    
+    state = await get_quota_state(db, user_id)
+    
+    if state is None:
+        raise HTTPException(status_code=403, detail="No active subscription found")
+    
+    if state.status != models.SubscriptionStatus.ACTIVE:
+        raise HTTPException(status_code=403, detail="Subscription is not active")
+    
+    remaining = max(state.queries_limit - state.queries_used, 0)
+    if n == 1:
+        detail = f"Query limit reached ({state.queries_limit}). Please upgrade your plan."
+    else:
+        detail = f"Query limit reached: {n} queries requested, {remaining} remaining. Please upgrade your plan."
+    raise HTTPException(status_code=403, detail=detail)
+
+
+async def consume_query_quota(
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+) -> UserSnapshot:
+    """
+    Comprobar suscripción activa y consumir una consulta en una sola sentencia.
+    El consumo se confirma con el commit del endpoint (misma sesión).
+    """
+    
+    if await consume_queries(db, current_user.id, 1) is None:
+        await raise_quota_error(db, current_user.id, 1)
     
     return current_user
@@ -0,0 +1,154 @@
+"""
+Caché de identidad
+Instantáneas inmutables de usuario y suscripción por token, con TTL corto,
+para que las peticiones autenticadas no repitan el SELECT de usuario.
+Los cambios de suscripción (create, cancel, webhook) y el consumo de cuota
+invalidan las entradas del usuario en este proceso; en el resto de workers
+caducan con el TTL.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import FrozenSet, Optional
+from config import settings
+from metrics import cache_result
+import models
+
+
+@dataclass(frozen=True)
+class SubscriptionSnapshot:
+    """Copia inmutable de los campos de Subscription que usan los endpoints"""
+    id: str
+    user_id: str
+    plan_type: models.PlanType
+    status: models.SubscriptionStatus
+    queries_used: int
+    queries_limit: int
+    current_period_start: Optional[datetime]
+    current_period_end: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, subscription: models.Subscription) -> "SubscriptionSnapshot":
+        return cls(
+            id=subscription.id,
+            user_id=subscription.user_id,
+            plan_type=subscription.plan_type,
+            status=subscription.status,
+            queries_used=subscription.queries_used,
+            queries_limit=subscription.queries_limit,
+            current_period_start=subscription.current_period_start,
+            current_period_end=subscription.current_period_end
+        )
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Copia inmutable del usuario autenticado (con su suscripción)"""
+    id: str
+    email: str
+    full_name: Optional[str]
+    is_active: bool
+    is_verified: bool
+    created_at: Optional[datetime]
+    subscription: Optional[SubscriptionSnapshot]
+    is_admin: bool = False
+    # Scopes de la credencial: None = sesión JWT (acceso completo); clave de API = sus scopes
+    scopes: Optional[FrozenSet[str]] = None
+
+    def has_scope(self, scope: str) -> bool:
+        return self.scopes is None or scope in self.scopes
+
+    @classmethod
+    def from_model(cls, user: models.User) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            email=user.email,
+            full_name=user.full_name,
+            is_active=user.is_active,
+            is_verified=user.is_verified,
+            created_at=user.created_at,
+            subscription=SubscriptionSnapshot.from_model(user.subscription) if user.subscription else None,
+            is_admin=bool(user.is_admin)
+        )
+
+
+def _token_key(token: str) -> str:
+    """Clave de caché: hash del token (no se guardan tokens en claro)"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class IdentityCache:
+    """
+    Caché LRU con TTL de token -> UserSnapshot, con índice por usuario para
+    invalidar todas las sesiones de un usuario a la vez. Se usa solo desde el
+    event loop (sin bloqueos).
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expira, snapshot)
+        self._by_user = {}  # user_id -> {key}
+
+    def get(self, token: str) -> Optional[UserSnapshot]:
+        key = _token_key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            cache_result("identity", False)
+            return None
+        expires, snapshot = entry
+        if expires <= time.monotonic():
+            self._remove(key)
+            cache_result("identity", False)
+            return None
+        self._entries.move_to_end(key)
+        cache_result("identity", True)
+        return snapshot
+
+    def put(self, token: str, snapshot: UserSnapshot, token_exp: Optional[float] = None):
+        """
+        Guarda la instantánea. token_exp (epoch) limita la vida de la entrada
+        para no aceptar un token caducado desde la caché.
+        """
+        if self.ttl_seconds <= 0:
+            return
+        ttl = self.ttl_seconds
+        if token_exp is not None:
+            ttl = min(ttl, token_exp - time.time())
+            if ttl <= 0:
+                return
+
+        key = _token_key(token)
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, snapshot)
+        self._by_user.setdefault(snapshot.id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: str):
+        """Descarta todas las entradas de un usuario."""
+        for key in self._by_user.pop(user_id, ()):
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_user.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._by_user.get(entry[1].id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_user[entry[1].id]
+
+
+identity_cache = IdentityCache(settings.IDENTITY_CACHE_TTL_SECONDS, settings.IDENTITY_CACHE_MAX_ENTRIES)
+
+
+def invalidate_user(user_id: str):
+    """Invalidar la identidad cacheada de un usuario tras cambiar su suscripción o cuota"""
+    identity_cache.invalidate_user(user_id)
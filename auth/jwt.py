@@ -22,16 +22,21 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def verify_token(token: str) -> Optional[str]:
-    """Verificar y decodificar token JWT"""
+def decode_token(token: str) -> Optional[dict]:
+    """Verificar y decodificar token JWT. Devuelve el payload completo o None."""
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
         
-        if email is None:
+        if payload.get("sub") is None:
             return None
         
-        return email
+        return payload
     
     except JWTError:
         return None
+
+
+def verify_token(token: str) -> Optional[str]:
+    """Verificar y decodificar token JWT"""
+    payload = decode_token(token)
+    return payload["sub"] if payload else None
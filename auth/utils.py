@@ -1,10 +1,27 @@
 """
 Utilidades de autenticación
 """
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
+from config import settings
 
-# Contexto para hashing de contraseñas
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Contexto para hashing de contraseñas.
+# min_rounds = rounds: los hashes con un coste menor (p. ej. tras subir
+# BCRYPT_ROUNDS) se marcan para rehash y se actualizan en el siguiente login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS
+)
+
+# bcrypt consume ~250 ms de CPU por operación: se ejecuta en un pool propio y
+# acotado, fuera del event loop y sin ocupar el threadpool de la aplicación.
+_hash_executor = None
+_hash_pending = 0  # Operaciones en curso + en cola
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -15,3 +32,59 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     """Hashear contraseña"""
     return pwd_context.hash(password)
+
+
+def _get_executor():
+    global _hash_executor
+
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS,
+            thread_name_prefix="bcrypt"
+        )
+    return _hash_executor
+
+
+async def _run_hashing(func, *args):
+    """
+    Ejecuta una operación bcrypt en el pool acotado.
+    Con la cola llena responde 503 en lugar de acumular esperas.
+    """
+    global _hash_pending
+
+    if _hash_pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service busy. Please retry.",
+            headers={"Retry-After": "1"}
+        )
+
+    _hash_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), func, *args)
+    finally:
+        _hash_pending -= 1
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hashear contraseña fuera del event loop"""
+    return await _run_hashing(pwd_context.hash, password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verificar contraseña fuera del event loop.
+    Devuelve (válida, nuevo hash o None); hay nuevo hash si el guardado usa
+    parámetros obsoletos y debe reemplazarse.
+    """
+    return await _run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+def shutdown_password_executor():
+    """Liberar el pool de hashing al apagar el worker"""
+    global _hash_executor
+
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False, cancel_futures=True)
+        _hash_executor = None
@@ -0,0 +1,302 @@
+"""
+Benchmarks de las rutas geoespaciales calientes
+
+Casos (datos sintéticos de benchmarks.fixtures, sin red):
+- parse_kml_polygons: parcelas de 100 a 10 000 vértices, con huecos.
+- calcular_porcentaje_pixeles: rásters de 200x150 y 800x600 (el tamaño real).
+- compose_image_with_legend: con las descargas WMS sustituidas por rásters.
+- calcular_porcentajes_planeamiento: capas de 1k, 10k y 100k polígonos.
+- generar_mapa_urbanismo: ortofoto 1000x1000 + urbanismo + leyenda.
+- _create_pdf_bytes y _create_zip_for_queries: consultas en memoria.
+
+Resultados en JSON (--output) y comparación con una línea base guardada:
+el mínimo de cada caso no puede superar el de la línea base en más de
+--tolerance (25 % por defecto) y, a la vez, en más de --min-delta-ms (5 ms
+por defecto): en los casos de pocos milisegundos el 25 % es menor que la
+variación entre máquinas. Se compara el mínimo porque en una máquina
+compartida es la medida más estable (la mediana recoge las interferencias).
+Con --normalize los tiempos se escalan con un bucle de calibración, para
+comparar con una línea base de otra máquina (a costa de más ruido). Con
+regresiones termina con código 1.
+
+Uso (con las variables de entorno de la aplicación cargadas):
+    python -m benchmarks.bench_geospatial                  # compara con baseline_geospatial.json
+    python -m benchmarks.bench_geospatial --quick          # sin los casos pesados
+    python -m benchmarks.bench_geospatial -k planeamiento  # solo los casos que contienen el texto
+    python -m benchmarks.bench_geospatial --output out.json --update-baseline
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import warnings
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+from benchmarks import fixtures
+
+# tight_layout avisa en cada render con leyenda: ruido en la salida
+warnings.filterwarnings("ignore", message="This figure includes Axes that are not compatible with tight_layout")
+
+BASELINE_PATH = Path(__file__).parent / "baseline_geospatial.json"
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_MIN_DELTA_MS = 5.0
+
+# Por caso: repeticiones mínimas y presupuesto de tiempo (se para al cumplir ambos)
+MIN_RUNS = 3
+MAX_RUNS = 50
+TIME_BUDGET_SECONDS = 2.0
+
+CASES = {}
+
+
+def case(name, heavy=False):
+    """Registra un caso: la función prepara los datos y devuelve lo que se cronometra"""
+    def decorator(setup):
+        CASES[name] = {"setup": setup, "heavy": heavy}
+        return setup
+    return decorator
+
+
+# ============================================
+# CASOS
+# ============================================
+def _register_parse_cases():
+    from services.wms_service import parse_kml_polygons
+
+    for vertices, holes, heavy in ((100, 0, False), (1000, 5, False), (10000, 20, True)):
+        def setup(vertices=vertices, holes=holes):
+            kml = fixtures.parcel_kml(fixtures.make_parcel(vertices, holes))
+            return lambda: parse_kml_polygons(kml)
+        case(f"parse_kml_polygons[v={vertices},h={holes}]", heavy)(setup)
+
+
+_register_parse_cases()
+
+
+def _register_pixel_cases():
+    from services.wms_service import calcular_porcentaje_pixeles, get_bbox_from_polygons
+
+    for width, height, heavy in ((200, 150, False), (800, 600, True)):
+        def setup(width=width, height=height):
+            polygons = fixtures.make_parcel(100, holes=3)
+            bbox = get_bbox_from_polygons(polygons)
+            raster = fixtures.make_layer_raster(width, height)
+            return lambda: calcular_porcentaje_pixeles(polygons, raster, bbox, umbral=250)
+        case(f"calcular_porcentaje_pixeles[{width}x{height}]", heavy)(setup)
+
+
+_register_pixel_cases()
+
+
+@case("compose_image_with_legend[800x600]")
+def _compose():
+    from services import wms_service
+
+    polygons = fixtures.make_parcel(100, holes=3)
+    bbox = wms_service.get_bbox_from_polygons(polygons)
+    ortho = fixtures.make_ortho_raster(800, 600)
+    layer = fixtures.make_layer_raster(800, 600)
+    legend = fixtures.make_legend_raster()
+
+    def fake_download(base_url, layer_name, style, bbox, format_type="image/png", width=800, height=600):
+        return ortho if format_type == "image/jpeg" else layer
+
+    def run():
+        with mock.patch.object(wms_service, "download_wms_image", fake_download), \
+                mock.patch.object(wms_service, "download_wms_legend", lambda *a, **k: legend):
+            return wms_service.compose_image_with_legend("RedNatura2000", bbox, polygons)
+    return run
+
+
+def _register_planning_cases():
+    from services.urbanismo_service import calcular_porcentajes_planeamiento
+
+    for n, heavy in ((1000, False), (10000, False), (100000, True)):
+        def setup(n=n):
+            gdf_parcela = fixtures.parcel_gdf(fixtures.make_parcel(200, holes=2))
+            gdf_planeamiento = fixtures.make_planning_layer(n, gdf_parcela)
+            return lambda: calcular_porcentajes_planeamiento(gdf_parcela, gdf_planeamiento)
+        case(f"calcular_porcentajes_planeamiento[n={n}]", heavy)(setup)
+
+
+_register_planning_cases()
+
+
+@case("generar_mapa_urbanismo[1000x1000]")
+def _mapa_urbanismo():
+    from services.urbanismo_service import generar_mapa_urbanismo
+
+    gdf_parcela = fixtures.parcel_gdf(fixtures.make_parcel(200, holes=2))
+    minx, miny, maxx, maxy = gdf_parcela.to_crs(epsg=3857).total_bounds
+    bbox_3857 = (minx - (maxx - minx), miny - (maxy - miny), maxx + (maxx - minx), maxy + (maxy - miny))
+    ortofoto = fixtures.image_bytes(fixtures.make_ortho_raster(1000, 1000), "JPEG")
+    urbanismo = fixtures.image_bytes(fixtures.make_layer_raster(1000, 1000))
+    leyenda = fixtures.image_bytes(fixtures.make_legend_raster())
+    return lambda: generar_mapa_urbanismo(gdf_parcela, bbox_3857, ortofoto, urbanismo, leyenda)
+
+
+@case("_create_pdf_bytes")
+def _pdf():
+    from routers.catastro import _create_pdf_bytes
+
+    query = fixtures.make_query()
+    return lambda: _create_pdf_bytes(query)
+
+
+def _register_zip_cases():
+    from routers.catastro import _create_zip_for_queries
+
+    for n, heavy in ((10, False), (50, True)):
+        def setup(n=n):
+            queries = [fixtures.make_query(i) for i in range(n)]
+            return lambda: _create_zip_for_queries(queries)
+        case(f"_create_zip_for_queries[n={n}]", heavy)(setup)
+
+
+_register_zip_cases()
+
+
+# ============================================
+# EJECUCIÓN
+# ============================================
+def calibrate():
+    """Segundos de un bucle fijo de Python puro (mínimo de 5): escala de la máquina"""
+    def loop():
+        total = 0
+        for i in range(1_000_000):
+            total += i * i
+        return total
+
+    return min(_timed(loop) for _ in range(5))
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def measure(func):
+    """Un calentamiento y después repeticiones hasta MIN_RUNS y el presupuesto de tiempo"""
+    func()
+    runs = []
+    started = time.perf_counter()
+    while len(runs) < MIN_RUNS or (time.perf_counter() - started < TIME_BUDGET_SECONDS and len(runs) < MAX_RUNS):
+        runs.append(_timed(func))
+    return {
+        "median_s": statistics.median(runs),
+        "min_s": min(runs),
+        "max_s": max(runs),
+        "runs": len(runs)
+    }
+
+
+def run_suite(selected):
+    results = {}
+    for name in selected:
+        func = CASES[name]["setup"]()
+        results[name] = measure(func)
+        print(f"  {name:48} {results[name]['median_s'] * 1000:10.1f} ms  ({results[name]['runs']} runs)", file=sys.stderr)
+    return results
+
+
+def compare(report, baseline, tolerance, normalize=False, min_delta_s=DEFAULT_MIN_DELTA_MS / 1000):
+    """
+    Filas (caso, mínimo base, mínimo actual, ratio, estado) y si hay regresiones.
+    Es regresión si el mínimo supera el de la base en más de tolerance y en más
+    de min_delta_s segundos.
+    """
+    scale = report["calibration_seconds"] / baseline["calibration_seconds"] if normalize else 1
+    rows, failed = [], False
+    for name, current in report["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            rows.append((name, None, current["min_s"], None, "nuevo"))
+            continue
+        expected = base["min_s"] * scale
+        ratio = current["min_s"] / expected
+        status = "ok"
+        if ratio > 1 + tolerance and current["min_s"] - expected > min_delta_s:
+            status, failed = "REGRESIÓN", True
+        elif ratio < 1 - tolerance:
+            status = "mejora"
+        rows.append((name, base["min_s"], current["min_s"], ratio, status))
+    return rows, failed
+
+
+def print_comparison(rows, tolerance):
+    print(f"\n{'caso (mínimo)':48} {'base ms':>10} {'actual ms':>10} {'ratio':>7}  estado (tolerancia {tolerance:.0%})")
+    for name, base, current, ratio, status in rows:
+        base_ms = f"{base * 1000:10.1f}" if base is not None else f"{'-':>10}"
+        ratio_txt = f"{ratio:7.2f}" if ratio is not None else f"{'-':>7}"
+        print(f"{name:48} {base_ms} {current * 1000:10.1f} {ratio_txt}  {status}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de las rutas geoespaciales")
+    parser.add_argument("--quick", action="store_true", help="omitir los casos pesados")
+    parser.add_argument("-k", dest="filter", help="solo los casos cuyo nombre contiene este texto")
+    parser.add_argument("--output", help="guardar los resultados en este JSON")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help="línea base con la que comparar")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="empeoramiento admitido (0.25 = 25 %%)")
+    parser.add_argument(
+        "--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_MS,
+        help="empeoramiento absoluto mínimo para contar como regresión"
+    )
+    parser.add_argument("--normalize", action="store_true", help="escalar con la calibración (línea base de otra máquina)")
+    parser.add_argument("--update-baseline", action="store_true", help="guardar los resultados como línea base")
+    args = parser.parse_args(argv)
+
+    selected = [
+        name for name, spec in CASES.items()
+        if not (args.quick and spec["heavy"]) and (not args.filter or args.filter in name)
+    ]
+
+    print("Calibrando...", file=sys.stderr)
+    report = {
+        "suite": "geospatial",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "calibration_seconds": calibrate(),
+        "results": run_suite(selected)
+    }
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        if baseline_path.exists():
+            # Se conservan los casos no ejecutados esta vez (p. ej. con --quick)
+            previous = json.loads(baseline_path.read_text(encoding="utf-8"))
+            scale = report["calibration_seconds"] / previous["calibration_seconds"] if args.normalize else 1
+            for name, result in previous["results"].items():
+                if name not in report["results"]:
+                    report["results"][name] = {
+                        **result, **{k: result[k] * scale for k in ("median_s", "min_s", "max_s")}
+                    }
+        baseline_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Línea base guardada en {baseline_path}", file=sys.stderr)
+        return 0
+
+    if not baseline_path.exists():
+        print(f"Sin línea base ({baseline_path}): ejecutar con --update-baseline", file=sys.stderr)
+        return 0
+
+    rows, failed = compare(
+        report, json.loads(baseline_path.read_text(encoding="utf-8")),
+        args.tolerance, args.normalize, args.min_delta_ms / 1000
+    )
+    print_comparison(rows, args.tolerance)
+    if failed:
+        print("\nREGRESIONES respecto a la línea base", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Benchmark de tormenta de logins
+
+Lanza --concurrency clientes haciendo login sin pausa durante --seconds y,
+a la vez, sondea GET /health cada --probe-interval. Mide:
+- logins/s, p50/p99 de login y rechazos 503 (cola de bcrypt llena).
+- p50/p99 de /health en reposo y durante la tormenta: si bcrypt bloqueara
+  el event loop, el p99 de /health subiría hasta el coste de un hash.
+
+--on-loop ejecuta bcrypt en el event loop (el comportamiento anterior al
+pool acotado) para comparar.
+
+--stale-rounds N guarda antes la contraseña con coste N (como un hash de
+antes de subir BCRYPT_ROUNDS): el primer login debe reemplazarlo de forma
+transparente. El informe da el coste del hash guardado al terminar y el
+código de salida es 1 si no se ha actualizado.
+
+Todo en proceso (httpx + ASGITransport, sin red) contra la base de datos de
+DATABASE_URL: crea un usuario bench-login-<uuid>@example.com.
+
+Uso (con las variables de entorno de la aplicación cargadas):
+    python -m benchmarks.bench_login_storm --concurrency 16 --seconds 10
+    python -m benchmarks.bench_login_storm --on-loop --output storm.json
+    python -m benchmarks.bench_login_storm --fail-p99-ms 100   # código 1 si /health p99 lo supera
+    python -m benchmarks.bench_login_storm --stale-rounds 4    # rehash transparente en el login
+"""
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+import uuid
+from contextlib import nullcontext
+from unittest import mock
+import httpx
+from passlib.hash import bcrypt
+from sqlalchemy import select, update
+import models
+from app import app
+from auth import utils as auth_utils
+from config import settings
+from database import AsyncSessionLocal
+
+PASSWORD = "bench-password-123"
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def _summary(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else None
+    }
+
+
+async def _probe(client, stop, interval):
+    """
+    Latencias de /health hasta que se active stop, medidas desde el instante
+    en que tocaba enviar cada sonda: un event loop bloqueado retrasa el envío
+    y ese retraso cuenta (sin omisión coordinada).
+    """
+    latencies = []
+    scheduled = time.perf_counter()
+    while not stop.is_set():
+        await client.get("/health")
+        latencies.append(time.perf_counter() - scheduled)
+        scheduled += interval
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+    return latencies
+
+
+async def _login_worker(client, stop, email, stats):
+    while not stop.is_set():
+        start = time.perf_counter()
+        r = await client.post("/api/auth/login", data={"username": email, "password": PASSWORD})
+        elapsed = time.perf_counter() - start
+        if r.status_code == 200:
+            stats["ok"].append(elapsed)
+        elif r.status_code == 503:
+            stats["rejected"] += 1
+            await asyncio.sleep(float(r.headers.get("retry-after", 1)))
+        else:
+            stats["errors"] += 1
+
+
+def _hash_rounds(hashed_password):
+    """Coste de un hash bcrypt ($2b$<coste>$...)"""
+    return int(hashed_password.split("$")[2])
+
+
+async def _stored_hash(email):
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(models.User.hashed_password).where(models.User.email == email))
+
+
+async def _set_stale_hash(email, rounds):
+    """Sustituye el hash del usuario por uno con otro coste (parámetros obsoletos)"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(models.User)
+            .where(models.User.email == email)
+            .values(hashed_password=bcrypt.using(rounds=rounds).hash(PASSWORD))
+        )
+        await db.commit()
+
+
+async def run(concurrency, seconds, probe_interval, stale_rounds=None):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        email = f"bench-login-{uuid.uuid4().hex[:12]}@example.com"
+        r = await client.post("/api/auth/register", json={"email": email, "password": PASSWORD, "full_name": "Bench"})
+        r.raise_for_status()
+        if stale_rounds is not None:
+            await _set_stale_hash(email, stale_rounds)
+
+        # Reposo: solo la sonda
+        stop = asyncio.Event()
+        probe = asyncio.create_task(_probe(client, stop, probe_interval))
+        await asyncio.sleep(min(seconds, 3))
+        stop.set()
+        idle = await probe
+
+        # Tormenta: logins concurrentes + sonda
+        stop = asyncio.Event()
+        stats = {"ok": [], "rejected": 0, "errors": 0}
+        workers = [asyncio.create_task(_login_worker(client, stop, email, stats)) for _ in range(concurrency)]
+        probe = asyncio.create_task(_probe(client, stop, probe_interval))
+        started = time.perf_counter()
+        await asyncio.sleep(seconds)
+        stop.set()
+        storm = await probe
+        await asyncio.gather(*workers)
+        elapsed = time.perf_counter() - started
+
+    stored_rounds = _hash_rounds(await _stored_hash(email))
+    return {
+        "suite": "login_storm",
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "bcrypt_rounds": settings.BCRYPT_ROUNDS,
+        "hash_workers": settings.PASSWORD_HASH_WORKERS,
+        "max_pending": settings.PASSWORD_HASH_MAX_PENDING,
+        "logins_per_second": round(len(stats["ok"]) / elapsed, 2),
+        "login": _summary(stats["ok"]),
+        "rejected_503": stats["rejected"],
+        "errors": stats["errors"],
+        "health_idle": _summary(idle),
+        "health_during_storm": _summary(storm),
+        "rehash": {
+            "stale_rounds": stale_rounds,
+            "stored_rounds": stored_rounds,
+            "upgraded": stale_rounds is not None and stored_rounds == settings.BCRYPT_ROUNDS
+        }
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tormenta de logins y latencia de endpoints no relacionados")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--probe-interval", type=float, default=0.01, help="segundos entre sondas a /health")
+    parser.add_argument("--on-loop", action="store_true", help="bcrypt en el event loop (comparación)")
+    parser.add_argument("--output", help="guardar el informe en este JSON")
+    parser.add_argument("--fail-p99-ms", type=float, help="código 1 si el p99 de /health durante la tormenta lo supera")
+    parser.add_argument("--stale-rounds", type=int, help="guardar antes la contraseña con este coste bcrypt (4-31)")
+    args = parser.parse_args(argv)
+    if args.stale_rounds is not None and args.stale_rounds == settings.BCRYPT_ROUNDS:
+        parser.error(f"--stale-rounds debe ser distinto de BCRYPT_ROUNDS ({settings.BCRYPT_ROUNDS})")
+
+    async def on_loop(func, *func_args):
+        return func(*func_args)
+
+    with mock.patch.object(auth_utils, "_run_hashing", on_loop) if args.on_loop else nullcontext():
+        report = asyncio.run(run(args.concurrency, args.seconds, args.probe_interval, args.stale_rounds))
+    report["mode"] = "on_loop" if args.on_loop else "executor"
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+    if args.stale_rounds is not None and not report["rehash"]["upgraded"]:
+        print(f"ERROR: el hash con coste {args.stale_rounds} no se ha actualizado en el login", file=sys.stderr)
+        return 1
+    p99 = report["health_during_storm"]["p99_ms"]
+    if args.fail_p99_ms is not None and p99 is not None and p99 > args.fail_p99_ms:
+        print(f"REGRESIÓN: /health p99 {p99} ms > {args.fail_p99_ms} ms durante la tormenta", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Benchmark de paginación del historial (GET /api/catastro/queries)
+
+Crea un usuario con --pages x --page-size consultas y:
+- Recorre el historial entero por cursor (X-Next-Cursor) y comprueba que
+  páginas consecutivas devuelven filas distintas, que no se repite ni se
+  pierde ninguna y que el orden coincide con el de skip/limit. Parte de las
+  consultas comparten created_at para forzar el desempate por id.
+- Mide la página 1 y la página --pages con cursor y con skip/limit (mediana
+  de --repeat peticiones): el cursor debe costar lo mismo en ambas.
+
+Todo en proceso (httpx + ASGITransport, sin red) contra la base de datos de
+DATABASE_URL: crea un usuario bench-page-<uuid>@example.com.
+
+Uso (con las variables de entorno de la aplicación cargadas):
+    python -m benchmarks.bench_pagination
+    python -m benchmarks.bench_pagination --pages 500 --page-size 20 --output pagination.json
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+import httpx
+from sqlalchemy import insert, select
+import models
+from app import app
+from config import settings
+from database import AsyncSessionLocal
+
+PASSWORD = "bench-password-123"
+URL = "/api/catastro/queries"
+TIE_EVERY = 3  # Cada grupo de 3 consultas seguidas comparte created_at
+
+
+async def _create_user(client):
+    email = f"bench-page-{uuid.uuid4().hex[:12]}@example.com"
+    r = await client.post("/api/auth/register", json={"email": email, "password": PASSWORD, "full_name": "Bench"})
+    r.raise_for_status()
+    r = await client.post("/api/auth/login", data={"username": email, "password": PASSWORD})
+    r.raise_for_status()
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    async with AsyncSessionLocal() as db:
+        user_id = await db.scalar(select(models.User.id).where(models.User.email == email))
+    return user_id, headers
+
+
+async def _seed(user_id, total):
+    """
+    La mitad de las filas con el created_at por defecto del modelo y la otra
+    mitad en grupos con el mismo created_at (empates resueltos por id).
+    """
+    base = datetime.now(timezone.utc) - timedelta(days=1)
+    rows = []
+    for i in range(total):
+        row = {"user_id": user_id, "referencia_catastral": f"{i:07d}AB1234A0001XX"}
+        if i % 2:
+            row["created_at"] = base + timedelta(seconds=i // (2 * TIE_EVERY))
+        rows.append(row)
+    async with AsyncSessionLocal() as db:
+        for start in range(0, total, 1000):
+            await db.execute(insert(models.Query), rows[start:start + 1000])
+        await db.commit()
+
+
+async def _walk(client, headers, page_size):
+    """
+    Páginas por cursor hasta la última: [(ids, cursor con el que se pidió)].
+    Se detiene si una página repite la anterior (el cursor no avanza).
+    """
+    pages, cursor = [], None
+    while True:
+        params = {"limit": page_size, **({"cursor": cursor} if cursor else {})}
+        r = await client.get(URL, params=params, headers=headers)
+        r.raise_for_status()
+        pages.append(([q["id"] for q in r.json()], cursor))
+        cursor = r.headers.get("x-next-cursor")
+        if not cursor or (len(pages) > 1 and pages[-1][0] == pages[-2][0]):
+            return pages
+
+
+async def _check(client, headers, pages, total):
+    """Errores de consistencia del recorrido por cursor (lista vacía si es correcto)"""
+    errors = []
+    for n in range(1, len(pages)):
+        if set(pages[n - 1][0]) & set(pages[n][0]):
+            errors.append(f"las páginas {n} y {n + 1} comparten filas")
+    walked = [i for ids, _ in pages for i in ids]
+    if len(walked) != len(set(walked)):
+        errors.append(f"{len(walked) - len(set(walked))} filas repetidas en el recorrido")
+    if len(set(walked)) != total:
+        errors.append(f"el recorrido devuelve {len(set(walked))} filas distintas de {total}")
+    r = await client.get(URL, params={"limit": total + 1}, headers=headers)
+    r.raise_for_status()
+    if walked != [q["id"] for q in r.json()]:
+        errors.append("el orden por cursor no coincide con el de skip/limit")
+    return errors
+
+
+async def _median_ms(client, headers, params, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        r = await client.get(URL, params=params, headers=headers)
+        samples.append(time.perf_counter() - start)
+        r.raise_for_status()
+    return round(statistics.median(samples) * 1000, 2)
+
+
+async def run(pages, page_size, repeat):
+    total = pages * page_size
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        user_id, headers = await _create_user(client)
+        await _seed(user_id, total)
+
+        walked = await _walk(client, headers, page_size)
+        errors = await _check(client, headers, walked, total)
+
+        last_cursor = walked[pages - 1][1] if len(walked) >= pages else None
+        timings = {
+            "cursor_page_1_ms": await _median_ms(client, headers, {"limit": page_size}, repeat),
+            f"offset_page_{pages}_ms": await _median_ms(
+                client, headers, {"limit": page_size, "skip": (pages - 1) * page_size}, repeat
+            ),
+        }
+        if last_cursor:
+            timings[f"cursor_page_{pages}_ms"] = await _median_ms(
+                client, headers, {"limit": page_size, "cursor": last_cursor}, repeat
+            )
+
+    return {
+        "suite": "pagination",
+        "rows": total,
+        "page_size": page_size,
+        "pages_walked": len(walked),
+        "timings": timings,
+        "errors": errors
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consistencia y coste de la paginación del historial")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20, help="peticiones por medición (mediana)")
+    parser.add_argument("--output", help="guardar el informe en este JSON")
+    args = parser.parse_args(argv)
+
+    # 500 páginas seguidas superan el límite por usuario
+    with mock.patch.object(settings, "RATE_LIMIT_ENABLED", False):
+        report = asyncio.run(run(args.pages, args.page_size, args.repeat))
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+    if report["errors"]:
+        print("ERROR: paginación por cursor inconsistente", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
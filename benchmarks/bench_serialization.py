@@ -0,0 +1,78 @@
+"""
+Benchmark de serialización de una página de 100 consultas (GET /api/catastro/queries)
+
+Compara:
+- response_model: lo que hacía FastAPI (validación del valor devuelto +
+  jsonable_encoder + json.dumps)
+- orjson: validación única (TypeAdapter, from_attributes) + orjson
+y el tamaño en la red sin comprimir, con gzip y con brotli.
+
+Uso (con las variables de entorno de la aplicación cargadas):
+    python -m benchmarks.bench_serialization
+"""
+import asyncio
+import gzip
+import json
+import timeit
+from datetime import datetime, timedelta
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from typing import List
+import models
+import schemas
+from compression import brotli
+from config import settings
+from routers.catastro import _query_list_response
+
+PAGE_SIZE = 100
+REPEAT = 200
+
+
+def make_page():
+    now = datetime.utcnow()
+    return [
+        models.Query(
+            id=f"{i:08d}-0000-4000-8000-000000000000",
+            user_id="bench-user",
+            referencia_catastral=f"{i:07d}AB1234A0001XX",
+            has_climate_data=i % 2 == 0,
+            has_socioeconomic_data=i % 3 == 0,
+            has_pdf=True,
+            has_wms_maps=i % 4 == 0,
+            has_urbanismo=i % 5 == 0,
+            created_at=now - timedelta(minutes=i)
+        )
+        for i in range(PAGE_SIZE)
+    ]
+
+
+def main():
+    page = make_page()
+    field = create_model_field(name="Response", type_=List[schemas.QueryResponse], mode="serialization")
+    loop = asyncio.new_event_loop()
+
+    def response_model():
+        content = loop.run_until_complete(serialize_response(field=field, response_content=page, is_coroutine=True))
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def orjson_prevalidated():
+        return _query_list_response(page).body
+
+    print(f"Serialización ({PAGE_SIZE} filas, media de {REPEAT} repeticiones)")
+    for func in (response_model, orjson_prevalidated):
+        seconds = timeit.timeit(func, number=REPEAT) / REPEAT
+        print(f"  {func.__name__:22} {seconds * 1e6:9.0f} µs")
+    loop.close()
+
+    body = orjson_prevalidated()
+    print("Tamaño en la red")
+    print(f"  {'identity':22} {len(body):9} B")
+    print(f"  {'gzip':22} {len(gzip.compress(body, compresslevel=settings.COMPRESSION_GZIP_LEVEL)):9} B")
+    if brotli is not None:
+        print(f"  {'br':22} {len(brotli.compress(body, quality=settings.COMPRESSION_BROTLI_QUALITY)):9} B")
+    else:
+        print(f"  {'br':22} (Brotli no instalado)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Comprobación de concurrencia de la cuota de consultas
+
+Un usuario nuevo (plan gratuito, PLAN_FREE_QUERIES consultas) lanza a la vez
+--singles POST /api/catastro/query y --bulks POST /api/catastro/queries/bulk de
+--bulk-size items. Falla (código 1) si:
+- se crean más consultas que la cuota,
+- queries_used de la suscripción no coincide con las consultas creadas,
+- el historial no contiene exactamente las consultas creadas,
+- algún rechazo no es el 403 de cuota.
+
+Por defecto en proceso (httpx + ASGITransport) contra DATABASE_URL. Con --url
+ataca un servidor arrancado (p. ej. varios workers de uvicorn con PostgreSQL,
+donde las peticiones compiten de verdad); ese servidor debe tener
+RATE_LIMIT_ENABLED=false.
+
+Uso (con las variables de entorno de la aplicación cargadas):
+    python -m benchmarks.check_quota_race
+    python -m benchmarks.check_quota_race --singles 50 --bulks 10 --bulk-size 2
+    python -m benchmarks.check_quota_race --url http://localhost:8001
+"""
+import argparse
+import asyncio
+import json
+import sys
+import uuid
+from contextlib import nullcontext
+from unittest import mock
+import httpx
+
+PASSWORD = "bench-password-123"
+
+
+def _referencia(i):
+    return f"{i:07d}QR0001N0001XX"
+
+
+async def _create_user(client):
+    email = f"bench-quota-{uuid.uuid4().hex[:12]}@example.com"
+    r = await client.post("/api/auth/register", json={"email": email, "password": PASSWORD, "full_name": "Bench"})
+    r.raise_for_status()
+    r = await client.post("/api/auth/login", data={"username": email, "password": PASSWORD})
+    r.raise_for_status()
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+async def _single(client, headers, i):
+    r = await client.post("/api/catastro/query", json={"referencia_catastral": _referencia(i)}, headers=headers)
+    return r.status_code, 1 if r.status_code == 200 else 0
+
+
+async def _bulk(client, headers, i, size):
+    items = [{"referencia_catastral": _referencia(i * size + k)} for k in range(size)]
+    r = await client.post("/api/catastro/queries/bulk", json={"items": items}, headers=headers)
+    return r.status_code, r.json()["created"] if r.status_code == 200 else 0
+
+
+async def run(url, singles, bulks, bulk_size):
+    if url:
+        client = httpx.AsyncClient(base_url=url, timeout=60)
+    else:
+        from app import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None)
+
+    async with client:
+        headers = await _create_user(client)
+        r = await client.get("/api/auth/me", headers=headers)
+        r.raise_for_status()
+        limit = r.json()["subscription"]["queries_limit"]
+
+        requests = [_single(client, headers, i) for i in range(singles)]
+        requests += [_bulk(client, headers, 10_000 + i, bulk_size) for i in range(bulks)]
+        outcomes = await asyncio.gather(*requests)
+
+        r = await client.get("/api/auth/me", headers=headers)
+        queries_used = r.json()["subscription"]["queries_used"]
+        r = await client.get("/api/catastro/queries", params={"limit": singles + bulks * bulk_size + 1}, headers=headers)
+        stored = len(r.json())
+
+    created = sum(n for _, n in outcomes)
+    statuses = {}
+    for status, _ in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    errors = []
+    if created > limit:
+        errors.append(f"{created} consultas creadas con una cuota de {limit}")
+    if queries_used != created:
+        errors.append(f"queries_used = {queries_used}, consultas creadas = {created}")
+    if stored != created:
+        errors.append(f"el historial tiene {stored} consultas, creadas = {created}")
+    unexpected = set(statuses) - {"200", "403"}
+    if unexpected:
+        errors.append(f"respuestas inesperadas: {sorted(unexpected)}")
+
+    return {
+        "suite": "quota_race",
+        "target": url or "in-process",
+        "queries_limit": limit,
+        "requests": {"singles": singles, "bulks": bulks, "bulk_size": bulk_size},
+        "statuses": statuses,
+        "created": created,
+        "queries_used": queries_used,
+        "stored": stored,
+        "errors": errors
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="La cuota de consultas no se supera con peticiones concurrentes")
+    parser.add_argument("--url", help="servidor arrancado (por defecto, la app en proceso)")
+    parser.add_argument("--singles", type=int, default=20, help="altas individuales concurrentes")
+    parser.add_argument("--bulks", type=int, default=5, help="altas masivas concurrentes")
+    parser.add_argument("--bulk-size", type=int, default=2, help="items por alta masiva")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        patch = nullcontext()
+    else:
+        from config import settings
+        # Las peticiones simultáneas del mismo usuario superarían el límite por minuto
+        patch = mock.patch.object(settings, "RATE_LIMIT_ENABLED", False)
+    with patch:
+        report = asyncio.run(run(args.url, args.singles, args.bulks, args.bulk_size))
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if report["errors"]:
+        print("ERROR: la cuota de consultas se ha superado o no cuadra", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
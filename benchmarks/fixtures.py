@@ -0,0 +1,196 @@
+"""
+Generadores de datos sintéticos para los benchmarks (sin red, deterministas)
+
+- Parcelas con N vértices y huecos (anillos lon/lat como parse_kml_polygons), su KML y su GeoJSON.
+- Rásters WMS falsos: capa temática con manchas, ortofoto con ruido, leyenda.
+- Capas de planeamiento con N polígonos (EPSG:25830) con clasificacion/ambito.
+- Consultas (models.Query) en memoria para el PDF y el ZIP.
+"""
+import json
+import math
+import random
+from datetime import datetime
+from io import BytesIO
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Centro de las parcelas sintéticas (Murcia) y radio aproximado (~100 m)
+CENTER_LON, CENTER_LAT = -1.13, 37.98
+RADIUS_DEG = 0.001
+
+CLASIFICACIONES = ["Urbano", "Urbanizable", "No Urbanizable", "Sistema General"]
+AMBITOS = ["Común", "Protección Específica", "Inadecuado", None]
+
+
+# ============================================
+# PARCELAS
+# ============================================
+def _ring(n, cx, cy, radius, rng, jitter=0.25):
+    """Anillo cerrado de n vértices en estrella irregular (sentido antihorario)"""
+    points = []
+    for i in range(n):
+        angle = 2 * math.pi * i / n
+        r = radius * (1 + rng.uniform(-jitter, jitter))
+        points.append((cx + r * math.cos(angle), cy + r * math.sin(angle)))
+    points.append(points[0])
+    return points
+
+
+def make_parcel(vertices=100, holes=0, seed=0):
+    """
+    Parcela como lista de polígonos de anillos (lon, lat): un polígono con
+    `vertices` vértices en el exterior y `holes` huecos interiores.
+    """
+    rng = random.Random(seed)
+    rings = [_ring(vertices, CENTER_LON, CENTER_LAT, RADIUS_DEG, rng)]
+    for k in range(holes):
+        # Huecos pequeños repartidos en un círculo interior (no se solapan)
+        angle = 2 * math.pi * k / max(holes, 1)
+        cx = CENTER_LON + 0.4 * RADIUS_DEG * math.cos(angle)
+        cy = CENTER_LAT + 0.4 * RADIUS_DEG * math.sin(angle)
+        hole = _ring(max(vertices // 10, 4), cx, cy, RADIUS_DEG * min(0.15, 0.8 / max(holes, 1)), rng, jitter=0.1)
+        rings.append(hole[::-1])
+    return [rings]
+
+
+def parcel_kml(polygons):
+    """KML 2.2 con un Placemark por polígono (exterior + huecos)"""
+    def coords(ring):
+        return " ".join(f"{lon:.8f},{lat:.8f},0" for lon, lat in ring)
+
+    placemarks = []
+    for rings in polygons:
+        inner = "".join(
+            f"<innerBoundaryIs><LinearRing><coordinates>{coords(r)}</coordinates></LinearRing></innerBoundaryIs>"
+            for r in rings[1:]
+        )
+        placemarks.append(
+            "<Placemark><Polygon>"
+            f"<outerBoundaryIs><LinearRing><coordinates>{coords(rings[0])}</coordinates></LinearRing></outerBoundaryIs>"
+            f"{inner}</Polygon></Placemark>"
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+        + "".join(placemarks)
+        + "</Document></kml>"
+    )
+
+
+def parcel_geojson(polygons):
+    """FeatureCollection (lon/lat) con una feature por polígono, como la de urbanismo"""
+    features = [
+        {"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": rings}}
+        for rings in polygons
+    ]
+    return json.dumps({"type": "FeatureCollection", "features": features})
+
+
+def parcel_gdf(polygons):
+    """GeoDataFrame de la parcela en EPSG:25830 (como en urbanismo)"""
+    import geopandas as gpd
+    from services.wms_service import polygons_to_shapely
+
+    return gpd.GeoDataFrame(geometry=[polygons_to_shapely(polygons)], crs="EPSG:4326").to_crs(epsg=25830)
+
+
+# ============================================
+# RÁSTERS WMS
+# ============================================
+def make_layer_raster(width=800, height=600, blobs=12, seed=0):
+    """Capa temática: fondo blanco con manchas oscuras (píxeles afectados)"""
+    rng = random.Random(seed)
+    img = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+    for _ in range(blobs):
+        x, y = rng.uniform(0, width), rng.uniform(0, height)
+        r = rng.uniform(0.05, 0.25) * min(width, height)
+        shade = rng.randint(40, 200)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=(shade, shade // 2, shade, 200))
+    return img
+
+
+def make_ortho_raster(width=800, height=600, seed=0):
+    """Ortofoto: ruido de color (se comprime mal, como una foto real)"""
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), "RGB")
+
+
+def make_legend_raster(entries=6):
+    """Leyenda: cuadros de color con su etiqueta"""
+    img = Image.new("RGB", (160, 22 * entries + 8), "white")
+    draw = ImageDraw.Draw(img)
+    for i in range(entries):
+        y = 6 + 22 * i
+        draw.rectangle((6, y, 26, y + 14), fill=(40 * i % 256, 120, 255 - 30 * i % 256))
+        draw.text((34, y), f"Clase {i + 1}", fill="black")
+    return img
+
+
+def image_bytes(img, format="PNG"):
+    buf = BytesIO()
+    img.convert("RGB" if format == "JPEG" else img.mode).save(buf, format=format)
+    return buf.getvalue()
+
+
+# ============================================
+# PLANEAMIENTO
+# ============================================
+def make_planning_layer(n_polygons=1000, gdf_parcela=None, seed=0):
+    """
+    Capa de planeamiento de n_polygons celdas (EPSG:25830) que cubre el
+    entorno de la parcela, con las columnas clasificacion y ambito del WFS.
+    """
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    rng = random.Random(seed)
+    if gdf_parcela is not None:
+        minx, miny, maxx, maxy = gdf_parcela.total_bounds
+    else:
+        minx, miny, maxx, maxy = 660000, 4204000, 660200, 4204200
+    # Entorno 3x la parcela: parte de las celdas no la tocan
+    width, height = (maxx - minx) * 3, (maxy - miny) * 3
+    minx, miny = minx - width / 3, miny - height / 3
+
+    side = math.ceil(math.sqrt(n_polygons))
+    dx, dy = width / side, height / side
+    geoms, clases, ambitos = [], [], []
+    for k in range(n_polygons):
+        i, j = divmod(k, side)
+        geoms.append(box(minx + j * dx, miny + i * dy, minx + (j + 1) * dx, miny + (i + 1) * dy))
+        clases.append(rng.choice(CLASIFICACIONES))
+        ambitos.append(rng.choice(AMBITOS))
+    return gpd.GeoDataFrame({"clasificacion": clases, "ambito": ambitos}, geometry=geoms, crs="EPSG:25830")
+
+
+# ============================================
+# CONSULTAS
+# ============================================
+def make_query(index=0, polygons=None, with_wms=True):
+    """Consulta en memoria con resultados WMS y KML, como la lee la exportación"""
+    import models
+
+    polygons = polygons or make_parcel(vertices=50, seed=index)
+    affection = {
+        capa: {f"umbral_{u}": round(random.Random(index).uniform(0, 100), 2) for u in (250, 200, 150)}
+        for capa in ("MontesPublicos", "RedNatura2000", "ViasPecuarias")
+    }
+    query = models.Query(
+        id=f"{index:08d}-0000-4000-8000-000000000000",
+        user_id="bench-user",
+        referencia_catastral=f"{index:07d}AB1234A0001XX",
+        has_climate_data=index % 2 == 0,
+        has_socioeconomic_data=index % 3 == 0,
+        has_pdf=True,
+        has_wms_maps=with_wms,
+        has_urbanismo=False,  # Con urbanismo, el ZIP regenera imágenes contra los WMS reales
+        kml_content=parcel_kml(polygons),
+        geojson_content=None,
+        wms_affection_data=json.dumps(affection) if with_wms else None,
+        urbanismo_data=None,
+        geometry_wkb=None,
+        created_at=datetime(2026, 1, 1)
+    )
+    query.user = models.User(id="bench-user", email="bench@example.com", hashed_password="-")
+    return query
@@ -0,0 +1,373 @@
+"""
+Prueba de carga de extremo a extremo contra stubs locales de los servicios externos
+
+Arranca los stubs de PNOA, MAPAMA, CARM y Stripe (benchmarks.stubs) y la app
+con uvicorn apuntando a ellos por settings; con --target usa una app ya en
+marcha (configurada con las variables que imprime `python -m benchmarks.stubs`).
+Cada usuario virtual recorre:
+
+    register → login → subscribe → query → process-wms → process-urbanismo → download
+
+subscribe contrata --plan a través del stub de Stripe (--plan none lo omite y
+el usuario se queda con la cuota Free). --users usuarios en total, --concurrency
+a la vez y --queries-per-user consultas (query → process → download) por
+usuario. Cada consulta lleva una parcela distinta (también entre ejecuciones),
+así que la caché de resultados compartidos no interviene salvo con --same-parcel.
+
+Informe (JSON en stdout y en --output; tabla en stderr): por endpoint,
+peticiones, throughput, p50/p90/p99/máx de latencia, tasa de error y códigos
+de estado; flujos completos y peticiones servidas por cada stub (con los
+fallos inyectados). Los fallos de los servicios externos no siempre son
+errores HTTP: el procesamiento los guarda como error de capa y responde 200.
+--max-error-rate termina con código 1 si algún endpoint la supera.
+
+Con varios valores de --concurrency cada nivel se ejecuta por separado (app
+recién arrancada, al menos tantos usuarios como el nivel) y el informe añade
+la comparación de peticiones/s entre niveles: con la capa de datos asíncrona
+el throughput debe mantenerse al pasar de 50 a 200 clientes concurrentes.
+
+Uso (con las variables de entorno de la aplicación cargadas):
+    python -m benchmarks.loadtest --users 20 --concurrency 4
+    python -m benchmarks.loadtest --users 60 --concurrency 12 --workers 2 --error-rate 0.05
+    python -m benchmarks.loadtest --stub carm:latency_ms=3000 --output carga.json
+    python -m benchmarks.loadtest --concurrency 50 200 --users 400 --plan none --skip-urbanismo
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+import httpx
+from benchmarks import fixtures
+from benchmarks.stubs import Stubs, add_stub_arguments, behaviors_from_args
+
+ROOT = Path(__file__).resolve().parent.parent
+PASSWORD = "loadtest-password-123"
+
+# Endpoints del flujo, en orden (nombre del informe → ruta)
+ENDPOINTS = {
+    "register": "POST /api/auth/register",
+    "login": "POST /api/auth/login",
+    "subscribe": "POST /api/subscriptions/create",
+    "query": "POST /api/catastro/query",
+    "process-wms": "POST /api/catastro/query/{id}/process-wms",
+    "process-urbanismo": "POST /api/catastro/query/{id}/process-urbanismo",
+    "download": "GET /api/catastro/queries/{id}/download"
+}
+
+
+# ============================================
+# REGISTRO DE LATENCIAS
+# ============================================
+def _percentile(values, q):
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+class Recorder:
+    """Latencias y códigos de estado por endpoint"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    async def call(self, endpoint, request):
+        """Espera la petición y la anota; None si no hubo respuesta (error de red o timeout)"""
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            self.latencies[endpoint].append(time.perf_counter() - start)
+            self.statuses[endpoint][type(e).__name__] += 1
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        self.statuses[endpoint][str(response.status_code)] += 1
+        return response
+
+    def summary(self, elapsed):
+        report = {}
+        for endpoint in [e for e in ENDPOINTS if e in self.latencies]:
+            latencies = sorted(self.latencies[endpoint])
+            statuses = self.statuses[endpoint]
+            errors = sum(n for status, n in statuses.items() if not status.startswith("2"))
+            report[endpoint] = {
+                "route": ENDPOINTS[endpoint],
+                "requests": len(latencies),
+                "throughput_rps": round(len(latencies) / elapsed, 3),
+                "error_rate": round(errors / len(latencies), 4),
+                "statuses": dict(sorted(statuses.items())),
+                "latency_ms": {
+                    "p50": round(_percentile(latencies, 0.50) * 1000, 1),
+                    "p90": round(_percentile(latencies, 0.90) * 1000, 1),
+                    "p99": round(_percentile(latencies, 0.99) * 1000, 1),
+                    "max": round(latencies[-1] * 1000, 1)
+                }
+            }
+        return report
+
+
+def _ok(response):
+    return response is not None and response.is_success
+
+
+# ============================================
+# USUARIO VIRTUAL
+# ============================================
+async def user_flow(client, rec, run_id, index, args):
+    """Un usuario completo; True si terminó todas sus consultas sin errores HTTP"""
+    email = f"loadtest-{run_id}-{index}@example.com"
+    r = await rec.call("register", client.post(
+        "/api/auth/register", json={"email": email, "password": PASSWORD, "full_name": f"Load {index}"}
+    ))
+    if not _ok(r):
+        return False
+
+    r = await rec.call("login", client.post("/api/auth/login", data={"username": email, "password": PASSWORD}))
+    if not _ok(r):
+        return False
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    if args.plan != "none":
+        r = await rec.call("subscribe", client.post(
+            "/api/subscriptions/create", json={"plan_type": args.plan}, headers=headers
+        ))
+        if not _ok(r):
+            return False
+
+    completed = True
+    for q in range(args.queries_per_user):
+        # Semilla distinta también entre ejecuciones: la caché compartida es por geometría
+        seed = 0 if args.same_parcel else int(run_id, 16) + index * args.queries_per_user + q + 1
+        polygons = fixtures.make_parcel(args.vertices, holes=1, seed=seed)
+        r = await rec.call("query", client.post("/api/catastro/query", json={
+            "referencia_catastral": f"{seed % 10**7:07d}LT0001N0001XX",
+            "kml_content": fixtures.parcel_kml(polygons),
+            "geojson_content": fixtures.parcel_geojson(polygons)
+        }, headers=headers))
+        if not _ok(r):
+            completed = False
+            continue
+        query_id = r.json()["id"]
+
+        steps = [
+            ("process-wms", "POST", f"/api/catastro/query/{query_id}/process-wms"),
+            ("process-urbanismo", "POST", f"/api/catastro/query/{query_id}/process-urbanismo"),
+            ("download", "GET", f"/api/catastro/queries/{query_id}/download")
+        ]
+        for endpoint, method, path in steps:
+            if endpoint == "process-urbanismo" and args.skip_urbanismo:
+                continue
+            r = await rec.call(endpoint, client.request(method, path, headers=headers))
+            completed = completed and _ok(r)
+    return completed
+
+
+async def drive(base_url, args, users, concurrency):
+    """Lanza users usuarios, concurrency a la vez; (Recorder, flujos completos, segundos)"""
+    rec = Recorder()
+    run_id = uuid.uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        async def one(index):
+            async with semaphore:
+                return await user_flow(client, rec, run_id, index, args)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(users)))
+        elapsed = time.perf_counter() - started
+    return rec, sum(results), elapsed
+
+
+# ============================================
+# APLICACIÓN
+# ============================================
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(stub_env, args, log_file):
+    """uvicorn con los settings apuntando a los stubs; devuelve (proceso, url)"""
+    port = _free_port()
+    env = {**os.environ, **stub_env}
+    if not args.rate_limits:
+        env["RATE_LIMIT_ENABLED"] = "false"
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(args.workers), "--log-level", "warning"
+        ],
+        cwd=ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"La app terminó al arrancar (código {process.returncode}); ver {log_file.name}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).is_success:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"La app no respondió en {args.startup_timeout} s; ver {log_file.name}")
+
+
+def stop_app(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# ============================================
+# INFORME
+# ============================================
+def print_report(report):
+    out = sys.stderr
+    print(f"\n{'endpoint':18} {'reqs':>6} {'req/s':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'máx ms':>9} {'error':>7}  estados", file=out)
+    for endpoint, row in report["endpoints"].items():
+        lat = row["latency_ms"]
+        statuses = " ".join(f"{status}:{n}" for status, n in row["statuses"].items())
+        print(
+            f"{endpoint:18} {row['requests']:6d} {row['throughput_rps']:7.2f} {lat['p50']:9.1f} {lat['p90']:9.1f} "
+            f"{lat['p99']:9.1f} {lat['max']:9.1f} {row['error_rate']:7.1%}  {statuses}",
+            file=out
+        )
+    flows = report["flows"]
+    print(
+        f"\nflujos: {flows['completed']}/{flows['users']} completos en {report['seconds']} s "
+        f"({flows['per_second']} usuarios/s)",
+        file=out
+    )
+    for name, stats in report["stubs"].items():
+        print(f"stub {name:7} {stats['requests']:6d} peticiones, {stats['injected_errors']} 503, {stats['dropped']} cortadas", file=out)
+
+
+def print_comparison(levels):
+    out = sys.stderr
+    print(f"\n{'concurrencia':>12} {'usuarios':>9} {'reqs':>7} {'req/s':>8} {'p99 ms':>9} {'error':>7}", file=out)
+    for level in levels:
+        p99 = max((row["latency_ms"]["p99"] for row in level["endpoints"].values()), default=0)
+        print(
+            f"{level['concurrency']:12d} {level['users']:9d} {level['requests']:7d} "
+            f"{level['requests_per_second']:8.2f} {p99:9.1f} {level['error_rate']:7.1%}",
+            file=out
+        )
+
+
+def run_level(stubs, args, concurrency):
+    """Una ejecución completa con concurrency usuarios a la vez; informe del nivel"""
+    users = max(args.users, concurrency)
+    process = None
+    log_file = tempfile.NamedTemporaryFile("w+", prefix="loadtest-app-", suffix=".log", delete=False)
+    try:
+        if args.target:
+            base_url = args.target.rstrip("/")
+            print("App externa: debe usar estos settings\n" + "\n".join(
+                f"  {k}={v}" for k, v in stubs.settings_env().items()
+            ), file=sys.stderr)
+        else:
+            process, base_url = start_app(stubs.settings_env(), args, log_file)
+            print(f"App en {base_url} ({args.workers} workers, log en {log_file.name})", file=sys.stderr)
+
+        print(f"Concurrencia {concurrency}: {users} usuarios", file=sys.stderr)
+        rec, completed, elapsed = asyncio.run(drive(base_url, args, users, concurrency))
+    finally:
+        if process is not None:
+            stop_app(process)
+        log_file.close()
+
+    endpoints = rec.summary(elapsed)
+    requests = sum(row["requests"] for row in endpoints.values())
+    errors = sum(row["requests"] * row["error_rate"] for row in endpoints.values())
+    return {
+        "users": users,
+        "concurrency": concurrency,
+        "queries_per_user": args.queries_per_user,
+        "workers": None if args.target else args.workers,
+        "seconds": round(elapsed, 2),
+        "requests": requests,
+        "requests_per_second": round(requests / elapsed, 3),
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "flows": {
+            "users": users,
+            "completed": completed,
+            "per_second": round(completed / elapsed, 3)
+        },
+        "endpoints": endpoints
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga de extremo a extremo con stubs locales")
+    parser.add_argument("--users", type=int, default=20, help="usuarios virtuales en total (por nivel)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[4], help="usuarios a la vez; varios valores comparan niveles")
+    parser.add_argument("--queries-per-user", type=int, default=1)
+    parser.add_argument("--plan", choices=["pro", "enterprise", "none"], default="pro", help="plan contratado vía Stripe")
+    parser.add_argument("--vertices", type=int, default=200, help="vértices de cada parcela")
+    parser.add_argument("--same-parcel", action="store_true", help="misma parcela en todas las consultas (caché compartida)")
+    parser.add_argument("--skip-urbanismo", action="store_true")
+    parser.add_argument("--timeout", type=float, default=300, help="timeout por petición (s)")
+    parser.add_argument("--target", help="URL de una app ya en marcha (no se arranca uvicorn)")
+    parser.add_argument("--workers", type=int, default=1, help="workers de uvicorn")
+    parser.add_argument("--rate-limits", action="store_true", help="mantener los límites de tasa (por defecto se desactivan)")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--output", help="guardar el informe en este JSON")
+    parser.add_argument("--max-error-rate", type=float, help="código 1 si algún endpoint la supera (0.01 = 1 %%)")
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with Stubs(behaviors_from_args(args), args.wfs_features) as stubs:
+        levels = []
+        for concurrency in args.concurrency:
+            levels.append(run_level(stubs, args, concurrency))
+            print_report({**levels[-1], "stubs": stubs.stats()})
+        stub_stats = stubs.stats()
+
+    if len(levels) == 1:
+        report = {"suite": "loadtest", **levels[0]}
+    else:
+        report = {
+            "suite": "loadtest",
+            "levels": levels,
+            "comparison": {
+                str(level["concurrency"]): level["requests_per_second"] for level in levels
+            }
+        }
+        print_comparison(levels)
+    report["stubs"] = stub_stats
+    report["stub_behavior"] = {name: vars(b) for name, b in behaviors_from_args(args).items()}
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+
+    if args.max_error_rate is not None:
+        failing = sorted({
+            f"{e} (concurrencia {level['concurrency']})"
+            for level in levels for e, row in level["endpoints"].items()
+            if row["error_rate"] > args.max_error_rate
+        })
+        if failing:
+            print(f"Tasa de error por encima de {args.max_error_rate:.1%}: {', '.join(failing)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,422 @@
+"""
+Servidores stub de los servicios externos para pruebas de carga (sin red)
+
+- pnoa: WMS del IGN (ortofoto PNOA).
+- mapama: WMS de MAPAMA (Montes Públicos, Red Natura 2000, Vías Pecuarias).
+- carm: GeoServer de la CARM (WMS y WFS de planeamiento).
+- stripe: API de Stripe (precios, clientes y suscripciones).
+
+Cada stub es un ThreadingHTTPServer en 127.0.0.1 (puerto libre) con latencia
+inyectada (media ± jitter) y fallos: una fracción de respuestas 503 y otra de
+conexiones cerradas sin respuesta. Los rásters salen de benchmarks.fixtures y
+se cachean por capa y tamaño, para que el coste del stub no cuente en la
+medida. La app se apunta a ellos con los settings de settings_env().
+
+Uso suelto (arranca los stubs e imprime las variables de entorno para la app):
+    python -m benchmarks.stubs --latency-ms 200 --jitter-ms 100 --error-rate 0.02
+    python -m benchmarks.stubs --stub pnoa:latency_ms=800,drop_rate=0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from xml.sax.saxutils import escape
+from benchmarks import fixtures
+
+STUB_NAMES = ("pnoa", "mapama", "carm", "stripe")
+
+# Tamaño máximo de GetMap (un stub no debe poder agotar la memoria)
+MAX_MAP_SIDE = 4096
+
+# Extensión de la capa WFS: alrededor del centro de las parcelas sintéticas
+WFS_SPREAD_DEG = 0.005
+
+
+@dataclass
+class StubBehavior:
+    """Latencia y fallos inyectados en cada respuesta de un stub"""
+    latency_ms: float = 0
+    jitter_ms: float = 0
+    error_rate: float = 0  # fracción de respuestas 503
+    drop_rate: float = 0  # fracción de conexiones cerradas sin respuesta
+
+    def with_overrides(self, spec):
+        """Copia con los valores de 'clave=valor,clave=valor' sustituidos"""
+        values = {f.name: getattr(self, f.name) for f in fields(self)}
+        for item in filter(None, spec.split(",")):
+            key, _, value = item.partition("=")
+            if key not in values:
+                raise ValueError(f"Parámetro de stub desconocido: {key}")
+            values[key] = float(value)
+        return StubBehavior(**values)
+
+
+# ============================================
+# SERVIDOR BASE
+# ============================================
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como los servicios reales
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.stub.serve(self, "GET")
+
+    def do_POST(self):
+        self.server.stub.serve(self, "POST")
+
+    def do_DELETE(self):
+        self.server.stub.serve(self, "DELETE")
+
+
+class StubServer:
+    """Servidor HTTP en un hilo; las subclases implementan respond()"""
+    name = "stub"
+
+    def __init__(self, behavior=None, seed=0):
+        self.behavior = behavior or StubBehavior()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "injected_errors": 0, "dropped": 0}
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=f"stub-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _draw(self):
+        """(retardo en segundos, número aleatorio para los fallos)"""
+        b = self.behavior
+        with self._lock:
+            self.counts["requests"] += 1
+            delay = max(0.0, b.latency_ms + self._rng.uniform(-b.jitter_ms, b.jitter_ms)) / 1000
+            return delay, self._rng.random()
+
+    def serve(self, handler, method):
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        split = urlsplit(handler.path)
+        params = {k.lower(): v for k, v in parse_qsl(split.query, keep_blank_values=True)}
+        if method == "POST" and body:
+            params.update(parse_qsl(body.decode("utf-8", "replace"), keep_blank_values=True))
+
+        delay, roll = self._draw()
+        if delay:
+            time.sleep(delay)
+
+        b = self.behavior
+        if roll < b.drop_rate:
+            with self._lock:
+                self.counts["dropped"] += 1
+            handler.close_connection = True
+            return
+        if roll < b.drop_rate + b.error_rate:
+            with self._lock:
+                self.counts["injected_errors"] += 1
+            status, content_type, payload = self.error_response()
+        else:
+            try:
+                status, content_type, payload = self.respond(method, split.path, params, handler)
+            except Exception as e:
+                status, content_type, payload = 500, "text/plain", f"stub error: {e}".encode()
+
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def error_response(self):
+        return 503, "text/plain", b"Service Unavailable (injected)"
+
+    def respond(self, method, path, params, handler):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._lock:
+            return {"url": self.url, **self.counts}
+
+
+# ============================================
+# WMS / WFS
+# ============================================
+_CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+<WMS_Capabilities version="1.3.0" xmlns="http://www.opengis.net/wms" xmlns:xlink="http://www.w3.org/1999/xlink">
+<Service><Name>WMS</Name><Title>{title}</Title></Service>
+<Capability>
+<Request>
+<GetCapabilities><Format>text/xml</Format><DCPType><HTTP><Get><OnlineResource xlink:href="{href}"/></Get></HTTP></DCPType></GetCapabilities>
+<GetMap><Format>image/png</Format><Format>image/jpeg</Format><DCPType><HTTP><Get><OnlineResource xlink:href="{href}"/></Get></HTTP></DCPType></GetMap>
+</Request>
+<Exception><Format>XML</Format></Exception>
+<Layer><Title>{title}</Title><CRS>EPSG:4326</CRS><CRS>EPSG:3857</CRS>{layers}</Layer>
+</Capability>
+</WMS_Capabilities>
+"""
+
+
+class WmsStub(StubServer):
+    """
+    WMS 1.1/1.3 (GetCapabilities, GetMap, GetLegendGraphic) y, si hay capa
+    WFS, GetFeature con GeoJSON. Las rutas se ignoran: basta con el prefijo
+    que da settings_env().
+    """
+
+    def __init__(self, name, title, layers=(), ortho_layers=(), wfs_features=0, behavior=None, seed=0):
+        super().__init__(behavior, seed)
+        self.name = name
+        self.title = title
+        self.layers = list(layers)  # anunciadas en GetCapabilities
+        self.ortho_layers = set(ortho_layers)  # GetMap devuelve ortofoto
+        self.wfs_features = wfs_features
+        self._images = {}
+        self._legend = fixtures.image_bytes(fixtures.make_legend_raster())
+        self._wfs = self._build_wfs() if wfs_features else None
+
+    def _build_wfs(self):
+        """Capa de planeamiento en EPSG:4326 que cubre la zona de las parcelas"""
+        import geopandas as gpd
+        from shapely.geometry import box
+
+        area = gpd.GeoDataFrame(geometry=[box(
+            fixtures.CENTER_LON - WFS_SPREAD_DEG, fixtures.CENTER_LAT - WFS_SPREAD_DEG,
+            fixtures.CENTER_LON + WFS_SPREAD_DEG, fixtures.CENTER_LAT + WFS_SPREAD_DEG
+        )], crs="EPSG:4326").to_crs(epsg=25830)
+        layer = fixtures.make_planning_layer(self.wfs_features, area)
+        return layer.to_crs(epsg=4326).to_json().encode()
+
+    def _image(self, layer, fmt, width, height):
+        key = (layer, fmt, width, height)
+        with self._lock:
+            cached = self._images.get(key)
+        if cached is None:
+            seed = zlib.crc32(layer.encode())
+            if layer in self.ortho_layers or fmt == "image/jpeg":
+                img = fixtures.make_ortho_raster(width, height, seed=seed)
+            else:
+                img = fixtures.make_layer_raster(width, height, seed=seed)
+            cached = fixtures.image_bytes(img, "JPEG" if fmt == "image/jpeg" else "PNG")
+            with self._lock:
+                self._images[key] = cached
+        return cached
+
+    def respond(self, method, path, params, handler):
+        request = params.get("request", "").lower()
+        if request == "getcapabilities":
+            href = escape(f"http://{handler.headers.get('Host')}{path}?", {'"': "&quot;"})
+            layers = "".join(
+                f"<Layer queryable=\"0\"><Name>{escape(n)}</Name><Title>{escape(n)}</Title></Layer>"
+                for n in self.layers
+            )
+            return 200, "text/xml", _CAPABILITIES.format(title=escape(self.title), href=href, layers=layers).encode()
+        if request == "getmap":
+            width = min(int(params.get("width", 800)), MAX_MAP_SIDE)
+            height = min(int(params.get("height", 600)), MAX_MAP_SIDE)
+            fmt = params.get("format", "image/png")
+            return 200, fmt, self._image(params.get("layers", ""), fmt, width, height)
+        if request == "getlegendgraphic":
+            return 200, "image/png", self._legend
+        if request == "getfeature" and self._wfs is not None:
+            return 200, "application/json", self._wfs
+        return 400, "text/plain", f"Unsupported request: {request or '-'}".encode()
+
+
+# ============================================
+# STRIPE
+# ============================================
+class StripeStub(StubServer):
+    """
+    Lo que usa stripe_service: precios (por id o lookup_key), clientes y
+    suscripciones. Las claves de idempotencia devuelven el mismo objeto.
+    """
+    name = "stripe"
+
+    def __init__(self, behavior=None, seed=0):
+        super().__init__(behavior, seed)
+        self._sequence = 0
+        self._idempotent = {}
+
+    def error_response(self):
+        return 503, "application/json", json.dumps(
+            {"error": {"type": "api_error", "message": "Service Unavailable (injected)"}}
+        ).encode()
+
+    def _next_id(self, prefix):
+        with self._lock:
+            self._sequence += 1
+            return f"{prefix}_stub{self._sequence:08d}"
+
+    @staticmethod
+    def _price(price_id, lookup_key=None):
+        return {
+            "object": "price",
+            "id": price_id,
+            "lookup_key": lookup_key,
+            "active": True,
+            "currency": "eur",
+            "unit_amount": 1900,
+            "product": {"object": "product", "id": "prod_stub", "name": "Stub"}
+        }
+
+    @staticmethod
+    def _subscription(subscription_id, status="active"):
+        now = int(time.time())
+        return {
+            "object": "subscription",
+            "id": subscription_id,
+            "status": status,
+            "current_period_start": now,
+            "current_period_end": now + 30 * 86400
+        }
+
+    def _create(self, handler, prefix, build):
+        key = handler.headers.get("Idempotency-Key")
+        with self._lock:
+            if key and key in self._idempotent:
+                return self._idempotent[key]
+        obj = build(self._next_id(prefix))
+        if key:
+            with self._lock:
+                obj = self._idempotent.setdefault(key, obj)
+        return obj
+
+    def respond(self, method, path, params, handler):
+        match = re.fullmatch(r"/v1/(\w+)(?:/([\w-]+))?", path)
+        if not match:
+            return self._not_found(path)
+        resource, object_id = match.groups()
+
+        if resource == "prices" and method == "GET":
+            if object_id:
+                obj = self._price(object_id)
+            else:
+                key = params.get("lookup_keys[0]", "stub")
+                obj = {"object": "list", "url": "/v1/prices", "has_more": False, "data": [self._price(f"price_{key}", key)]}
+        elif resource == "customers" and method == "POST" and not object_id:
+            obj = self._create(handler, "cus", lambda i: {"object": "customer", "id": i, "email": params.get("email")})
+        elif resource == "subscriptions" and method == "POST" and not object_id:
+            obj = self._create(handler, "sub", self._subscription)
+        elif resource == "subscriptions" and object_id and method in ("GET", "DELETE"):
+            obj = self._subscription(object_id, "canceled" if method == "DELETE" else "active")
+        else:
+            return self._not_found(path)
+        return 200, "application/json", json.dumps(obj).encode()
+
+    @staticmethod
+    def _not_found(path):
+        return 404, "application/json", json.dumps(
+            {"error": {"type": "invalid_request_error", "message": f"Unrecognized request URL: {path}"}}
+        ).encode()
+
+
+# ============================================
+# CONJUNTO DE STUBS
+# ============================================
+class Stubs:
+    """Los cuatro stubs arrancados; settings_env() apunta la app a ellos"""
+
+    def __init__(self, behaviors=None, wfs_features=2000):
+        from services.urbanismo_service import WFS_PLANEAMIENTO_TYPENAME
+        from services.wms_service import CAPAS_WMS, ORTOFOTO_LAYER
+
+        behaviors = behaviors or {}
+        self.servers = {
+            "pnoa": WmsStub(
+                "pnoa", "IGN PNOA", [ORTOFOTO_LAYER], ortho_layers=[ORTOFOTO_LAYER],
+                behavior=behaviors.get("pnoa"), seed=1
+            ),
+            "mapama": WmsStub(
+                "mapama", "MAPAMA Biodiversidad", [layer for _, layer, _, _ in CAPAS_WMS.values()],
+                behavior=behaviors.get("mapama"), seed=2
+            ),
+            "carm": WmsStub(
+                "carm", "CARM SIT_USU_PLA_URB_CARM", [WFS_PLANEAMIENTO_TYPENAME],
+                wfs_features=wfs_features, behavior=behaviors.get("carm"), seed=3
+            ),
+            "stripe": StripeStub(behavior=behaviors.get("stripe"), seed=4)
+        }
+
+    def __enter__(self):
+        for server in self.servers.values():
+            server.start()
+        return self
+
+    def __exit__(self, *exc):
+        for server in self.servers.values():
+            server.stop()
+
+    def settings_env(self):
+        """Variables de entorno (settings) que apuntan la app a los stubs"""
+        s = self.servers
+        return {
+            "IGN_PNOA_WMS_URL": f"{s['pnoa'].url}/wms-inspire/pnoa-ma",
+            "MAPAMA_WMS_BASE_URL": f"{s['mapama'].url}/sig/Biodiversidad",
+            "CARM_GEOSERVER_URL": f"{s['carm'].url}/geoserver/SIT_USU_PLA_URB_CARM",
+            "STRIPE_API_BASE": s["stripe"].url
+        }
+
+    def stats(self):
+        return {name: server.stats() for name, server in self.servers.items()}
+
+
+def behaviors_from_args(args):
+    """StubBehavior por stub: el común de la línea de órdenes más los --stub nombre:k=v"""
+    common = StubBehavior(args.latency_ms, args.jitter_ms, args.error_rate, args.drop_rate)
+    behaviors = {name: common for name in STUB_NAMES}
+    for spec in args.stub or []:
+        name, _, overrides = spec.partition(":")
+        if name not in behaviors:
+            raise ValueError(f"Stub desconocido: {name} (válidos: {', '.join(STUB_NAMES)})")
+        behaviors[name] = behaviors[name].with_overrides(overrides)
+    return behaviors
+
+
+def add_stub_arguments(parser):
+    group = parser.add_argument_group("stubs")
+    group.add_argument("--latency-ms", type=float, default=150, help="latencia media de los stubs")
+    group.add_argument("--jitter-ms", type=float, default=50, help="variación uniforme de la latencia (±)")
+    group.add_argument("--error-rate", type=float, default=0, help="fracción de respuestas 503")
+    group.add_argument("--drop-rate", type=float, default=0, help="fracción de conexiones cerradas sin respuesta")
+    group.add_argument("--stub", action="append", metavar="NOMBRE:k=v,...",
+                       help="ajustes de un stub (pnoa, mapama, carm, stripe), p. ej. carm:latency_ms=2000,error_rate=0.1")
+    group.add_argument("--wfs-features", type=int, default=2000, help="polígonos de la capa WFS de planeamiento")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stubs locales de PNOA, MAPAMA, CARM y Stripe")
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with Stubs(behaviors_from_args(args), args.wfs_features) as stubs:
+        for key, value in stubs.settings_env().items():
+            print(f"export {key}={value}")
+        print("# Ctrl+C para parar", flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            print(json.dumps(stubs.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compresión de respuestas de la API
+Middleware ASGI que comprime con br (si está instalado Brotli) o gzip, según
+Accept-Encoding, las respuestas de un solo bloque (JSON de la API) a partir de
+un tamaño mínimo.
+
+No toca:
+- Respuestas en streaming (varios bloques): SSE debe llegar evento a evento
+  y los ZIP ya van comprimidos.
+- Respuestas que ya traen Content-Encoding (p. ej. /static precomprimido).
+- Tipos no comprimibles (imágenes, ZIP, PDF).
+"""
+import gzip
+from starlette.datastructures import Headers, MutableHeaders
+from config import settings
+from static_assets import COMPRESSIBLE_TYPES, accepted_encodings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _choose_encoding(header):
+    accepted = accepted_encodings(header)
+    candidates = ("br", "gzip") if brotli is not None else ("gzip",)
+    for encoding in candidates:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = _choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                media_type = headers.get("content-type", "")
+                if "content-encoding" in headers or not media_type.startswith(COMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Se retiene hasta ver el primer bloque del cuerpo
+                    start_message = message
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            if start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            streaming = message.get("more_body", False)
+
+            if streaming or len(body) < self.minimum_size:
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            compressed = _compress(body, encoding)
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if len(compressed) < len(body):
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(compressed))
+                # Otra representación: el ETag fuerte pasa a débil
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                body = compressed
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
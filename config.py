@@ -3,16 +3,38 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class Settings(BaseSettings):
     # Database
     DATABASE_URL: str
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
 
     # JWT
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
 
+    # Claves de API (HMAC-SHA256; por defecto con SECRET_KEY)
+    API_KEY_HMAC_SECRET: str | None = None
+    API_KEY_MAX_PER_USER: int = 20
+
+    # Contraseñas (bcrypt)
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 32
+
     # Stripe
     STRIPE_SECRET_KEY: str
     STRIPE_PUBLISHABLE_KEY: str
     STRIPE_WEBHOOK_SECRET: str
+    STRIPE_API_BASE: str | None = None  # p. ej. http://localhost:12111 (stripe-mock)
+    STRIPE_HTTP_WORKERS: int = 4
+    STRIPE_TIMEOUT_SECONDS: int = 30
+    STRIPE_MAX_NETWORK_RETRIES: int = 2
+    # Price ID (price_...) o lookup_key de cada plan; metadatos cacheados con TTL
+    STRIPE_PRICE_PRO: str | None = "price_pro_monthly"
+    STRIPE_PRICE_ENTERPRISE: str | None = "price_enterprise_monthly"
+    STRIPE_PRICE_CACHE_TTL_SECONDS: int = 3600
+    # Consumidor de la bandeja de webhooks
+    STRIPE_EVENT_POLL_SECONDS: int = 30
+    STRIPE_EVENT_MAX_ATTEMPTS: int = 10
 
     # Email
     MAIL_USERNAME: str | None = None
@@ -35,6 +57,56 @@ class Settings(BaseSettings):
     PLAN_PRO_QUERIES: int
     PLAN_PRO_PRICE: float
     PLAN_ENTERPRISE_PRICE: float
+    # Renovación mensual de cuota (segundos entre pasadas del planificador)
+    QUOTA_RESET_INTERVAL_SECONDS: int = 300
+    # Reconciliación de usage_counters con queries (al arrancar y cada N segundos)
+    USAGE_RECONCILE_INTERVAL_SECONDS: int = 86400
+
+    # Caché de identidad (usuario + suscripción por token)
+    IDENTITY_CACHE_TTL_SECONDS: int = 30
+    IDENTITY_CACHE_MAX_ENTRIES: int = 10000
+
+    # Consultas
+    BULK_QUERY_MAX_ITEMS: int = 1000
+
+    # Resultados compartidos entre usuarios (subir la versión al cambiar los datos de capa)
+    WMS_LAYERS_VERSION: str = "1"
+    URBANISMO_LAYERS_VERSION: str = "1"
+    SHARED_RESULT_TTL_HOURS: int = 168
+
+    # Límites de tasa por plan (peticiones/minuto; ráfaga = un minuto de fichas)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_FREE_PER_MINUTE: int = 60
+    RATE_LIMIT_PRO_PER_MINUTE: int = 300
+    RATE_LIMIT_ENTERPRISE_PER_MINUTE: int = 1200
+    RATE_LIMIT_FREE_HEAVY_PER_MINUTE: int = 5
+    RATE_LIMIT_PRO_HEAVY_PER_MINUTE: int = 30
+    RATE_LIMIT_ENTERPRISE_HEAVY_PER_MINUTE: int = 120
+    RATE_LIMIT_MAX_KEYS: int = 100000
+
+    # Control de admisión: trabajo pesado simultáneo por worker
+    HEAVY_CONCURRENCY_LIMIT: int = 8
+    HEAVY_RETRY_AFTER_SECONDS: int = 5
+
+    # Compresión de respuestas de la API (bytes mínimos y niveles)
+    COMPRESSION_MIN_BYTES: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+
+    # Métricas (/metrics): directorio compartido por los workers para sumar
+    # sus contadores (sin él, cada worker expone solo los suyos)
+    METRICS_DIR: str | None = None
+    METRICS_FLUSH_SECONDS: int = 5
+
+    # Servicios WMS/WFS externos (sustituibles por stubs locales en pruebas de carga)
+    IGN_PNOA_WMS_URL: str = "https://www.ign.es/wms-inspire/pnoa-ma"
+    MAPAMA_WMS_BASE_URL: str = "https://wms.mapama.gob.es/sig/Biodiversidad"
+    CARM_GEOSERVER_URL: str = "https://mapas-gis-inter.carm.es/geoserver/SIT_USU_PLA_URB_CARM"
+
+    # Búsqueda espacial sin PostGIS: usuarios con índice STRtree en memoria
+    SPATIAL_INDEX_MAX_USERS: int = 256
+    # Relectura completa del índice (filas confirmadas tarde, relleno de geometrías)
+    SPATIAL_INDEX_RESYNC_SECONDS: int = 300
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
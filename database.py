@@ -2,24 +2,63 @@
 Configuración de la base de datos
 """
 from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 from config import settings
+from metrics import instrument_pool
 
 # Asegurar que la URL usa el driver psycopg
 DATABASE_URL = settings.DATABASE_URL.replace(
     "postgresql://",
     "postgresql://")
 
-# Crear engine
+
+def _async_database_url(url: str) -> str:
+    """Traduce la URL síncrona al driver asíncrono equivalente"""
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+psycopg://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+
+ASYNC_DATABASE_URL = _async_database_url(settings.DATABASE_URL)
+
+# Crear engine (síncrono: create_all, scripts y tareas fuera del event loop)
 engine = create_engine(
     DATABASE_URL,
     pool_pre_ping=True,
     echo=False
 )
 
+# Engine asíncrono (psycopg3) usado por los endpoints
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_pre_ping=True,
+    echo=False,
+    **(
+        {"pool_size": settings.DB_POOL_SIZE, "max_overflow": settings.DB_MAX_OVERFLOW}
+        if ASYNC_DATABASE_URL.startswith("postgresql")
+        else {}
+    )
+)
+
+# Espera de checkout del pool de los endpoints en /metrics
+instrument_pool(async_engine)
+
 # Session local
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Sesiones asíncronas. expire_on_commit=False evita recargas implícitas
+# (no permitidas en AsyncSession) al leer atributos tras un commit.
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Base para modelos
 Base = declarative_base()
 
@@ -31,3 +70,16 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """Dependency para obtener sesión asíncrona de BD"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def dialect_insert(db, table):
+    """INSERT con ON CONFLICT del dialecto de la sesión (PostgreSQL; SQLite en desarrollo)"""
+    if db.bind.dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
@@ -0,0 +1,425 @@
+"""
+Métricas en formato Prometheus (sin dependencias)
+
+Registro mínimo de Counter, Gauge e Histogram con etiquetas, seguro entre
+hilos (los pipelines corren en el threadpool), expuesto en GET /metrics.
+
+Varios workers de uvicorn: con METRICS_DIR configurado, cada worker vuelca su
+estado a METRICS_DIR/<pid>-<arranque>.json cada METRICS_FLUSH_SECONDS y
+/metrics suma los volcados de todos (counters e histogramas siempre; gauges
+solo de los workers vivos). El arranque en el nombre evita que un PID
+reciclado pise los contadores de su antecesor. Los volcados de workers
+muertos se siguen sumando hasta que arranca otro worker, que los borra
+(Prometheus lo ve como un reinicio de contador). Sin METRICS_DIR, cada
+worker expone solo lo suyo.
+
+Tasa de aciertos de una caché (PromQL):
+    sum(rate(cache_requests_total{cache="identity",result="hit"}[5m]))
+      / sum(rate(cache_requests_total{cache="identity"}[5m]))
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlparse
+import requests
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event
+from config import settings
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+# ============================================
+# REGISTRO
+# ============================================
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [[list(k), v if not isinstance(v, list) else [list(v[0]), v[1], v[2]]] for k, v in self._values.items()]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None, merge="sum"):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback  # Sin etiquetas: valor calculado al exportar
+        self.merge = merge  # Entre workers: "sum" (en curso, en uso) o "max" (marcas de tiempo)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                self.set(self.callback())
+            except Exception:
+                pass
+        return super().samples()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)  # len(buckets) = +Inf
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+REGISTRY = {}
+
+
+# ============================================
+# MÉTRICAS DE LA APLICACIÓN
+# ============================================
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP por ruta",
+    ("method", "route", "status")
+)
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "Peticiones HTTP en curso")
+
+UPSTREAM_SECONDS = Histogram(
+    "upstream_request_duration_seconds", "Duración de las peticiones a servicios externos (WMS/WFS)",
+    ("host",)
+)
+UPSTREAM_REQUESTS = Counter(
+    "upstream_requests_total", "Peticiones a servicios externos por resultado (2xx, 4xx, 5xx, error)",
+    ("host", "outcome")
+)
+
+STAGE_SECONDS = Histogram(
+    "processing_stage_duration_seconds", "Duración de las etapas de los pipelines de procesamiento",
+    ("pipeline", "stage", "layer")
+)
+
+DB_POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Conexiones entregadas por el pool")
+DB_POOL_CONNECT_SECONDS = Histogram(
+    "db_pool_connect_seconds", "Tiempo para abrir una conexión nueva a la base de datos",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5, 30)
+)
+
+CACHE_REQUESTS = Counter("cache_requests_total", "Consultas a cachés por resultado (hit/miss)", ("cache", "result"))
+
+QUOTA_RESET_ROWS = Counter("quota_reset_rows_total", "Suscripciones con la cuota renovada")
+QUOTA_RESET_LAST_RUN = Gauge(
+    "quota_reset_last_run_timestamp_seconds", "Última pasada de renovación de cuotas (epoch)", merge="max"
+)
+
+
+def cache_result(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# ============================================
+# INSTRUMENTACIÓN
+# ============================================
+def _host(url):
+    return urlparse(url).hostname or "unknown"
+
+
+@contextmanager
+def track_upstream(url):
+    """
+    Cronometra una llamada a un servicio externo (p. ej. owslib).
+    El bloque puede fijar call["status"] (código HTTP) y call["bytes"].
+    """
+    from services.progress import record_upstream
+
+    host = _host(url)
+    call = {"status": None, "bytes": None}
+    outcome = "error"
+    start = time.perf_counter()
+    try:
+        yield call
+        status = call["status"]
+        outcome = f"{status // 100}xx" if status else "ok"
+    finally:
+        duration = time.perf_counter() - start
+        UPSTREAM_REQUESTS.inc(host=host, outcome=outcome)
+        UPSTREAM_SECONDS.observe(duration, host=host)
+        # Perfil de la consulta en proceso (etapa en curso de su ProgressTracker)
+        record_upstream(host, duration, outcome, call["bytes"])
+
+
+def upstream_get(url, **kwargs):
+    """requests.get instrumentado por host"""
+    with track_upstream(url) as call:
+        response = requests.get(url, **kwargs)
+        call["status"] = response.status_code
+        call["bytes"] = len(response.content)
+    return response
+
+
+def instrument_pool(engine):
+    """
+    Instrumenta el pool de un engine (síncrono o asíncrono) con eventos
+    públicos de SQLAlchemy: checkouts, tiempo de apertura de conexiones
+    nuevas (do_connect → connect) y, si el pool los tiene, conexiones en
+    uso, desbordamiento y tamaño (saturado cuando checked_out alcanza
+    size + DB_MAX_OVERFLOW).
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+    pool = sync_engine.pool
+
+    @event.listens_for(sync_engine, "do_connect")
+    def start_connect(dialect, connection_record, cargs, cparams):
+        connection_record.info["metrics_connect_started"] = time.perf_counter()
+
+    @event.listens_for(pool, "connect")
+    def connected(dbapi_connection, connection_record):
+        started = connection_record.info.pop("metrics_connect_started", None)
+        if started is not None:
+            DB_POOL_CONNECT_SECONDS.observe(time.perf_counter() - started)
+
+    @event.listens_for(pool, "checkout")
+    def checked_out(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKOUTS.inc()
+
+    if hasattr(pool, "checkedout"):
+        Gauge("db_pool_checked_out", "Conexiones del pool en uso", callback=pool.checkedout)
+        Gauge("db_pool_overflow", "Conexiones abiertas por encima del tamaño del pool", callback=pool.overflow)
+        Gauge("db_pool_size", "Tamaño del pool", callback=pool.size)
+
+
+class MetricsMiddleware:
+    """Latencia por plantilla de ruta (no por URL: cardinalidad acotada)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", None) or ("/static" if scope["path"].startswith("/static/") else "other"),
+                status=status["code"]
+            )
+
+
+# ============================================
+# EXPORTACIÓN (VARIOS WORKERS)
+# ============================================
+def _snapshot():
+    return {
+        name: {
+            "type": metric.type,
+            "help": metric.documentation,
+            "labelnames": list(metric.labelnames),
+            "buckets": list(getattr(metric, "buckets", ())),
+            "merge": getattr(metric, "merge", "sum"),
+            "samples": metric.samples()
+        }
+        for name, metric in REGISTRY.items()
+    }
+
+
+_worker = {"pid": None, "key": None}
+
+
+def _worker_key():
+    """<pid>-<arranque en ns> de este proceso (se recalcula tras un fork)"""
+    pid = os.getpid()
+    if _worker["pid"] != pid:
+        _worker.update(pid=pid, key=f"{pid}-{time.time_ns()}")
+    return _worker["key"]
+
+
+def _stale_before():
+    """mtime por debajo del cual un volcado es de un worker que ya no escribe"""
+    return time.time() - 3 * settings.METRICS_FLUSH_SECONDS
+
+
+def flush():
+    """Vuelca el estado de este worker a METRICS_DIR (escritura atómica)"""
+    if not settings.METRICS_DIR:
+        return
+    directory = Path(settings.METRICS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    tmp = directory / f".{_worker_key()}.json.tmp"
+    tmp.write_text(json.dumps(_snapshot()), encoding="utf-8")
+    os.replace(tmp, directory / f"{_worker_key()}.json")
+
+
+def prune_dumps():
+    """
+    Borra de METRICS_DIR los volcados (y temporales) de workers muertos: los
+    que llevan más de 3 intervalos de volcado sin actualizarse.
+    """
+    if not settings.METRICS_DIR:
+        return
+    stale_before = _stale_before()
+    for path in Path(settings.METRICS_DIR).glob("*.json*"):
+        try:
+            if path.stem != _worker_key() and path.stat().st_mtime < stale_before:
+                path.unlink()
+        except OSError:
+            continue
+
+
+async def run_flusher():
+    """
+    Tarea del ciclo de vida: limpieza de volcados antiguos al arrancar,
+    volcado periódico (en el threadpool) y uno final al cancelarla.
+    """
+    await run_in_threadpool(prune_dumps)
+    try:
+        while True:
+            await asyncio.sleep(settings.METRICS_FLUSH_SECONDS)
+            await run_in_threadpool(flush)
+    finally:
+        flush()
+
+
+def _merge(snapshots, live):
+    merged = {}
+    for snapshot, is_live in zip(snapshots, live):
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "samples": {}})
+            if metric["type"] == "gauge" and not is_live:
+                continue
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = value
+                elif metric["merge"] == "max":
+                    target["samples"][key] = max(current, value)
+                elif metric["type"] == "histogram":
+                    target["samples"][key] = [
+                        [a + b for a, b in zip(current[0], value[0])], current[1] + value[1], current[2] + value[2]
+                    ]
+                else:
+                    target["samples"][key] = current + value
+    return merged
+
+
+def _collect():
+    own = _snapshot()
+    if not settings.METRICS_DIR:
+        return _merge([own], [True])
+
+    flush()
+    snapshots, live = [own], [True]
+    stale_before = _stale_before()
+    for path in Path(settings.METRICS_DIR).glob("*.json"):
+        if path.stem == _worker_key():
+            continue
+        try:
+            snapshots.append(json.loads(path.read_text(encoding="utf-8")))
+            live.append(path.stat().st_mtime >= stale_before)
+        except (OSError, ValueError):
+            continue
+    return _merge(snapshots, live)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render() -> str:
+    """
+    Texto de exposición de Prometheus (versión 0.0.4). Con METRICS_DIR lee
+    y escribe ficheros: desde un endpoint async, en el threadpool.
+    """
+    lines = []
+    for name, metric in sorted(_collect().items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        names = metric["labelnames"]
+        for labels, value in sorted(metric["samples"].items()):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_labels(names, labels)} {_number(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip([*metric["buckets"], float("inf")], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(names, labels, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(names, labels)} {count}")
+    return "\n".join(lines) + "\n"
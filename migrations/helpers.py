@@ -0,0 +1,52 @@
+"""
+Comprobaciones compartidas por las migraciones de migrations/versions/
+
+Base.metadata.create_all (al arrancar la app) crea las tablas que faltan pero
+no añade columnas ni índices a las existentes: cada migración comprueba si su
+paso ya está hecho, así sirve tanto para bases de datos antiguas como para las
+creadas por create_all. Sin conexión (alembic upgrade head --sql) no hay nada
+que inspeccionar y se emite todo.
+
+Uso (desde una migración):
+    from migrations.helpers import has_column, has_index
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+def _inspector():
+    return None if context.is_offline_mode() else sa.inspect(op.get_bind())
+
+
+def has_table(table):
+    inspector = _inspector()
+    return inspector is not None and inspector.has_table(table)
+
+
+def has_column(table, column):
+    inspector = _inspector()
+    return inspector is not None and column in {c["name"] for c in inspector.get_columns(table)}
+
+
+def has_index(table, name):
+    inspector = _inspector()
+    return inspector is not None and name in {i["name"] for i in inspector.get_indexes(table)}
+
+
+def foreign_key_columns(table):
+    """Columnas de table que ya tienen FK (create_all las nombra <tabla>_<columna>_fkey)"""
+    inspector = _inspector()
+    if inspector is None:
+        return set()
+    return {column for fk in inspector.get_foreign_keys(table) for column in fk["constrained_columns"]}
+
+
+def is_sqlite():
+    return op.get_context().dialect.name == "sqlite"
+
+
+def create_indexes(indexes):
+    """indexes: [(nombre, tabla, columnas, único)]; omite los que ya existen"""
+    for name, table, columns, unique in indexes:
+        if not has_index(table, name):
+            op.create_index(name, table, columns, unique=unique)
@@ -0,0 +1,108 @@
+"""Esquema de partida: el que creaba Base.metadata.create_all antes de las migraciones
+
+Tablas users, subscriptions, queries y payments tal y como estaban cuando la
+app pasó a la capa de datos asíncrona. Cada cambio de esquema posterior tiene
+su propia migración encadenada a esta.
+
+En una base de datos vacía crea las tablas; en una ya creada por create_all
+(antigua o actual) no hace nada, y las siguientes migraciones añaden solo lo
+que falte.
+
+Revision ID: 0026
+Revises:
+Create Date: 2026-10-19 18:50:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from migrations.helpers import has_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0026"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Enums de models con los nombres que genera SQLEnum (los de los miembros)
+PLAN_TYPE = sa.Enum("FREE", "PRO", "ENTERPRISE", name="plantype")
+SUBSCRIPTION_STATUS = sa.Enum("ACTIVE", "CANCELLED", "EXPIRED", "PAST_DUE", name="subscriptionstatus")
+
+
+def upgrade() -> None:
+    if not has_table("users"):
+        op.create_table(
+            "users",
+            sa.Column("id", sa.String(), primary_key=True),
+            sa.Column("email", sa.String(), nullable=False),
+            sa.Column("hashed_password", sa.String(), nullable=False),
+            sa.Column("full_name", sa.String()),
+            sa.Column("is_active", sa.Boolean()),
+            sa.Column("is_verified", sa.Boolean()),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True))
+        )
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    if not has_table("subscriptions"):
+        op.create_table(
+            "subscriptions",
+            sa.Column("id", sa.String(), primary_key=True),
+            sa.Column("user_id", sa.String(), sa.ForeignKey("users.id"), unique=True),
+            sa.Column("plan_type", PLAN_TYPE),
+            sa.Column("status", SUBSCRIPTION_STATUS),
+            sa.Column("stripe_customer_id", sa.String()),
+            sa.Column("stripe_subscription_id", sa.String()),
+            sa.Column("stripe_price_id", sa.String()),
+            sa.Column("queries_used", sa.Integer()),
+            sa.Column("queries_limit", sa.Integer()),
+            sa.Column("current_period_start", sa.DateTime(timezone=True)),
+            sa.Column("current_period_end", sa.DateTime(timezone=True)),
+            sa.Column("cancel_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("cancelled_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True))
+        )
+
+    if not has_table("queries"):
+        op.create_table(
+            "queries",
+            sa.Column("id", sa.String(), primary_key=True),
+            sa.Column("user_id", sa.String(), sa.ForeignKey("users.id")),
+            sa.Column("referencia_catastral", sa.String(), nullable=False),
+            sa.Column("has_climate_data", sa.Boolean()),
+            sa.Column("has_socioeconomic_data", sa.Boolean()),
+            sa.Column("has_pdf", sa.Boolean()),
+            sa.Column("has_wms_maps", sa.Boolean()),
+            sa.Column("has_urbanismo", sa.Boolean()),
+            sa.Column("kml_content", sa.String(), nullable=True),
+            sa.Column("geojson_content", sa.String(), nullable=True),
+            sa.Column("wms_affection_data", sa.String(), nullable=True),
+            sa.Column("urbanismo_data", sa.String(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now())
+        )
+
+    if not has_table("payments"):
+        op.create_table(
+            "payments",
+            sa.Column("id", sa.String(), primary_key=True),
+            sa.Column("user_id", sa.String(), sa.ForeignKey("users.id")),
+            sa.Column("stripe_payment_intent_id", sa.String()),
+            sa.Column("stripe_invoice_id", sa.String()),
+            sa.Column("amount", sa.Float()),
+            sa.Column("currency", sa.String()),
+            sa.Column("status", sa.String()),
+            sa.Column("description", sa.String()),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now())
+        )
+
+
+def downgrade() -> None:
+    for table in ("payments", "queries", "subscriptions", "users"):
+        op.drop_table(table)
+    if op.get_context().dialect.name == "postgresql":
+        op.execute("DROP TYPE IF EXISTS subscriptionstatus")
+        op.execute("DROP TYPE IF EXISTS plantype")
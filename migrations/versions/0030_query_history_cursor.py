@@ -0,0 +1,39 @@
+"""Índice del historial por cursor y created_at de SQLite con microsegundos
+
+- Índice (user_id, created_at, id) de queries: GET /api/catastro/queries pagina
+  por cursor (created_at, id) sin recorrer las páginas anteriores.
+- SQLite: las consultas creadas con server_default (CURRENT_TIMESTAMP) se
+  guardaron como 'YYYY-MM-DD HH:MM:SS', mientras que SQLAlchemy compara con
+  'YYYY-MM-DD HH:MM:SS.ffffff'. La comparación es de cadenas, así que el
+  cursor nunca avanzaba sobre esas filas. PostgreSQL no se ve afectado.
+
+Revision ID: 0030
+Revises: 0026
+Create Date: 2026-10-19 18:58:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from migrations.helpers import create_indexes, is_sqlite
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0030"
+down_revision: Union[str, None] = "0026"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    create_indexes([("ix_queries_user_created_id", "queries", ["user_id", "created_at", "id"], False)])
+    if is_sqlite():
+        op.execute(
+            "UPDATE queries SET created_at = created_at || '.000000' "
+            "WHERE length(created_at) = 19"
+        )
+
+
+def downgrade() -> None:
+    # Los valores con '.000000' siguen siendo válidos con el formato anterior
+    op.drop_index("ix_queries_user_created_id", table_name="queries")
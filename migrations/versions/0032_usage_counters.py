@@ -0,0 +1,41 @@
+"""Contadores de uso desnormalizados por usuario (usage_counters)
+
+Los rellena la reconciliación de usage_service al arrancar la app (y después
+cada USAGE_RECONCILE_INTERVAL_SECONDS); hasta entonces /stats cuenta sobre
+queries.
+
+Revision ID: 0032
+Revises: 0030
+Create Date: 2026-10-19 19:05:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from migrations.helpers import has_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0032"
+down_revision: Union[str, None] = "0030"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not has_table("usage_counters"):
+        op.create_table(
+            "usage_counters",
+            sa.Column("user_id", sa.String(), sa.ForeignKey("users.id"), primary_key=True),
+            sa.Column("total_queries", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("wms_processed", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("urbanismo_processed", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("month", sa.String(7)),
+            sa.Column("queries_this_month", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now())
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("usage_counters")
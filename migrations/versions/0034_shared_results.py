@@ -0,0 +1,67 @@
+"""Resultados de procesamiento compartidos entre consultas de la misma parcela
+
+- tabla shared_results (clave única kind, geometry_hash, layer_set, layer_version)
+- queries.wms_result_id y queries.urbanismo_result_id (FK shared_results.id)
+
+Revision ID: 0034
+Revises: 0032
+Create Date: 2026-10-19 19:12:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from migrations.helpers import foreign_key_columns, has_column, has_table, is_sqlite
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0034"
+down_revision: Union[str, None] = "0032"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (nombre de la FK, columna de queries)
+QUERY_FOREIGN_KEYS = [
+    ("fk_queries_wms_result_id", "wms_result_id"),
+    ("fk_queries_urbanismo_result_id", "urbanismo_result_id")
+]
+
+
+def upgrade() -> None:
+    if not has_table("shared_results"):
+        op.create_table(
+            "shared_results",
+            sa.Column("id", sa.String(), primary_key=True),
+            sa.Column("kind", sa.String(), nullable=False),
+            sa.Column("geometry_hash", sa.String(64), nullable=False),
+            sa.Column("layer_set", sa.String(), nullable=False),
+            sa.Column("layer_version", sa.String(), nullable=False),
+            sa.Column("referencia_catastral", sa.String()),
+            sa.Column("summary", sa.String(), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+            sa.UniqueConstraint("kind", "geometry_hash", "layer_set", "layer_version", name="uq_shared_results_key")
+        )
+
+    for _, column in QUERY_FOREIGN_KEYS:
+        if not has_column("queries", column):
+            op.add_column("queries", sa.Column(column, sa.String(), nullable=True))
+
+    # SQLite no añade restricciones a una tabla existente (haría falta recrearla):
+    # allí las columnas quedan sin FK, como NULL o id de shared_results
+    if not is_sqlite():
+        # Por columna y no por nombre: create_all las nombra queries_<columna>_fkey
+        existing = foreign_key_columns("queries")
+        for name, column in QUERY_FOREIGN_KEYS:
+            if column not in existing:
+                op.create_foreign_key(name, "queries", "shared_results", [column], ["id"])
+
+
+def downgrade() -> None:
+    # DROP COLUMN se lleva también las FK
+    with op.batch_alter_table("queries") as batch:
+        for _, column in reversed(QUERY_FOREIGN_KEYS):
+            batch.drop_column(column)
+    op.drop_table("shared_results")
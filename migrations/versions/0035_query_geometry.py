@@ -0,0 +1,61 @@
+"""Geometría normalizada de cada consulta (EPSG:25830)
+
+Columnas de queries calculadas al crear la consulta: geometry_wkb, bbox_minx/
+miny/maxx/maxy (con índice), area_m2, vertex_count y geometry_hash (con
+índice). Las consultas anteriores se rellenan con
+`python -m services.geometry_service`.
+
+Revision ID: 0035
+Revises: 0034
+Create Date: 2026-10-19 19:16:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from migrations.helpers import create_indexes, has_column
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0035"
+down_revision: Union[str, None] = "0034"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (nombre, tipo); todas admiten NULL
+QUERY_COLUMNS = [
+    ("geometry_wkb", sa.LargeBinary()),
+    ("bbox_minx", sa.Float()),
+    ("bbox_miny", sa.Float()),
+    ("bbox_maxx", sa.Float()),
+    ("bbox_maxy", sa.Float()),
+    ("area_m2", sa.Float()),
+    ("vertex_count", sa.Integer()),
+    ("geometry_hash", sa.String(64))
+]
+
+# (nombre, tabla, columnas, único)
+INDEXES = [
+    ("ix_queries_bbox_minx", "queries", ["bbox_minx"], False),
+    ("ix_queries_bbox_miny", "queries", ["bbox_miny"], False),
+    ("ix_queries_bbox_maxx", "queries", ["bbox_maxx"], False),
+    ("ix_queries_bbox_maxy", "queries", ["bbox_maxy"], False),
+    ("ix_queries_geometry_hash", "queries", ["geometry_hash"], False)
+]
+
+
+def upgrade() -> None:
+    for name, type_ in QUERY_COLUMNS:
+        if not has_column("queries", name):
+            op.add_column("queries", sa.Column(name, type_, nullable=True))
+    create_indexes(INDEXES)
+
+
+def downgrade() -> None:
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+    with op.batch_alter_table("queries") as batch:
+        for name, _ in reversed(QUERY_COLUMNS):
+            batch.drop_column(name)
@@ -0,0 +1,45 @@
+"""Claves de API por usuario (api_keys)
+
+Solo se guarda el HMAC de la clave; prefix (único) localiza la fila al
+autenticar.
+
+Revision ID: 0039
+Revises: 0035
+Create Date: 2026-10-19 19:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from migrations.helpers import create_indexes, has_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0039"
+down_revision: Union[str, None] = "0035"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not has_table("api_keys"):
+        op.create_table(
+            "api_keys",
+            sa.Column("id", sa.String(), primary_key=True),
+            sa.Column("user_id", sa.String(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("prefix", sa.String(16), nullable=False),
+            sa.Column("key_hash", sa.String(64), nullable=False),
+            sa.Column("scopes", sa.String(), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("revoked_at", sa.DateTime(timezone=True), nullable=True)
+        )
+    create_indexes([
+        ("ix_api_keys_user_id", "api_keys", ["user_id"], False),
+        ("ix_api_keys_prefix", "api_keys", ["prefix"], True)
+    ])
+
+
+def downgrade() -> None:
+    op.drop_table("api_keys")
@@ -0,0 +1,60 @@
+"""Bandeja de eventos de Stripe (stripe_events) y orden de eventos por suscripción
+
+- tabla stripe_events (id del evento como clave primaria: los reintentos del
+  webhook no se duplican) con índices de pendientes y de objeto
+- subscriptions.stripe_event_created: created del último evento aplicado
+- índices de subscriptions.stripe_customer_id / stripe_subscription_id
+
+Revision ID: 0041
+Revises: 0039
+Create Date: 2026-10-19 19:38:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from migrations.helpers import create_indexes, has_column, has_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0041"
+down_revision: Union[str, None] = "0039"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (nombre, tabla, columnas, único)
+INDEXES = [
+    ("ix_subscriptions_stripe_customer_id", "subscriptions", ["stripe_customer_id"], False),
+    ("ix_subscriptions_stripe_subscription_id", "subscriptions", ["stripe_subscription_id"], False),
+    ("ix_stripe_events_stripe_object_id", "stripe_events", ["stripe_object_id"], False),
+    ("ix_stripe_events_pending", "stripe_events", ["processed_at", "created"], False)
+]
+
+
+def upgrade() -> None:
+    if not has_table("stripe_events"):
+        op.create_table(
+            "stripe_events",
+            sa.Column("id", sa.String(), primary_key=True),
+            sa.Column("type", sa.String(), nullable=False),
+            sa.Column("stripe_object_id", sa.String()),
+            sa.Column("created", sa.Integer(), nullable=False),
+            sa.Column("payload", sa.String(), nullable=False),
+            sa.Column("received_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("processed_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("last_error", sa.String(), nullable=True)
+        )
+    if not has_column("subscriptions", "stripe_event_created"):
+        op.add_column("subscriptions", sa.Column("stripe_event_created", sa.Integer(), nullable=True))
+    create_indexes(INDEXES)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_subscriptions_stripe_subscription_id", table_name="subscriptions")
+    op.drop_index("ix_subscriptions_stripe_customer_id", table_name="subscriptions")
+    with op.batch_alter_table("subscriptions") as batch:
+        batch.drop_column("stripe_event_created")
+    op.drop_table("stripe_events")
@@ -0,0 +1,38 @@
+"""Administradores y perfiles de procesamiento
+
+- users.is_admin
+- queries.processing_profile
+
+Cada paso comprueba si ya está hecho (ver migrations/helpers.py).
+
+Revision ID: 0048
+Revises: 0041
+Create Date: 2026-10-19 20:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from migrations.helpers import has_column
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0048"
+down_revision: Union[str, None] = "0041"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not has_column("users", "is_admin"):
+        op.add_column("users", sa.Column("is_admin", sa.Boolean(), server_default=sa.false()))
+    if not has_column("queries", "processing_profile"):
+        op.add_column("queries", sa.Column("processing_profile", sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("queries") as batch:
+        batch.drop_column("processing_profile")
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("is_admin")
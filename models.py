@@ -1,10 +1,11 @@
 """
 Modelos de base de datos
 """
-from sqlalchemy import Boolean, Column, Integer, String, Float, DateTime, ForeignKey, Enum as SQLEnum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, Integer, String, Float, DateTime, LargeBinary, ForeignKey, Index, UniqueConstraint, Enum as SQLEnum
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 from database import Base
+from datetime import datetime, timezone
 import enum
 import uuid
 
@@ -13,6 +14,16 @@ def generate_uuid():
     return str(uuid.uuid4())
 
 
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+# Grupo de columnas pesadas de Query (geometrías y resultados). Se cargan solo
+# bajo demanda con undefer()/undefer_group(); acceder a ellas sin cargarlas
+# lanza un error en lugar de disparar un SELECT por fila.
+QUERY_PAYLOAD_GROUP = "payload"
+
+
 class PlanType(str, enum.Enum):
     """Tipos de plan"""
     FREE = "free"
@@ -38,6 +49,7 @@ class User(Base):
     full_name = Column(String)
     is_active = Column(Boolean, default=True)
     is_verified = Column(Boolean, default=False)
+    is_admin = Column(Boolean, default=False)  # Acceso a /api/admin
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
@@ -45,6 +57,7 @@ class User(Base):
     subscription = relationship("Subscription", back_populates="user", uselist=False)
     queries = relationship("Query", back_populates="user")
     payments = relationship("Payment", back_populates="user")
+    api_keys = relationship("ApiKey", back_populates="user")
 
 
 class Subscription(Base):
@@ -56,10 +69,12 @@ class Subscription(Base):
     plan_type = Column(SQLEnum(PlanType), default=PlanType.FREE)
     status = Column(SQLEnum(SubscriptionStatus), default=SubscriptionStatus.ACTIVE)
     
-    # Stripe
-    stripe_customer_id = Column(String)
-    stripe_subscription_id = Column(String)
+    # Stripe (indexados: el consumidor de webhooks busca por ellos)
+    stripe_customer_id = Column(String, index=True)
+    stripe_subscription_id = Column(String, index=True)
     stripe_price_id = Column(String)
+    # created (epoch) del último evento de Stripe aplicado: descarta eventos atrasados
+    stripe_event_created = Column(Integer, nullable=True)
     
     # Límites
     queries_used = Column(Integer, default=0)
@@ -92,17 +107,105 @@ class Query(Base):
     has_wms_maps = Column(Boolean, default=False)
     has_urbanismo = Column(Boolean, default=False)  # Análisis de planeamiento
     
-    # KML y datos espaciales
-    kml_content = Column(String, nullable=True)
-    geojson_content = Column(String, nullable=True)  # GeoJSON para urbanismo
-    wms_affection_data = Column(String, nullable=True)
-    urbanismo_data = Column(String, nullable=True)  # JSON con datos de planeamiento urbano
+    # KML y datos espaciales (diferidos: los listados no los cargan)
+    kml_content = deferred(Column(String, nullable=True), group=QUERY_PAYLOAD_GROUP, raiseload=True)
+    geojson_content = deferred(Column(String, nullable=True), group=QUERY_PAYLOAD_GROUP, raiseload=True)  # GeoJSON para urbanismo
+    wms_affection_data = deferred(Column(String, nullable=True), group=QUERY_PAYLOAD_GROUP, raiseload=True)
+    urbanismo_data = deferred(Column(String, nullable=True), group=QUERY_PAYLOAD_GROUP, raiseload=True)  # JSON con datos de planeamiento urbano
+    
+    # Geometría normalizada (EPSG:25830), calculada una vez al crear la consulta
+    geometry_wkb = deferred(Column(LargeBinary, nullable=True), group=QUERY_PAYLOAD_GROUP, raiseload=True)
+    bbox_minx = Column(Float, nullable=True, index=True)
+    bbox_miny = Column(Float, nullable=True, index=True)
+    bbox_maxx = Column(Float, nullable=True, index=True)
+    bbox_maxy = Column(Float, nullable=True, index=True)
+    area_m2 = Column(Float, nullable=True)
+    vertex_count = Column(Integer, nullable=True)
+    geometry_hash = Column(String(64), nullable=True, index=True)  # SHA-256 del WKB
+    
+    # Resultados compartidos de los que proceden wms_affection_data / urbanismo_data
+    wms_result_id = Column(String, ForeignKey("shared_results.id"), nullable=True)
+    urbanismo_result_id = Column(String, ForeignKey("shared_results.id"), nullable=True)
+    
+    # Perfil del último procesamiento por pipeline (JSON {"wms": {...}, "urbanismo": {...}}):
+    # tiempos por etapa y capa, bytes y peticiones externas (ver ProgressTracker.profile)
+    processing_profile = deferred(Column(String, nullable=True), raiseload=True)
     
     # Metadata
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Valor desde Python y no server_default: en SQLite CURRENT_TIMESTAMP se guarda
+    # sin microsegundos ('YYYY-MM-DD HH:MM:SS') y los parámetros con ellos, y la
+    # comparación de cadenas del cursor (created_at, id) < (...) repetía la página
+    created_at = Column(DateTime(timezone=True), default=utc_now)
     
     # Relaciones
     user = relationship("User", back_populates="queries")
+    
+    __table_args__ = (
+        # Historial por usuario ordenado por fecha (paginación por cursor)
+        Index("ix_queries_user_created_id", "user_id", "created_at", "id"),
+    )
+
+
+class SharedResult(Base):
+    """Resultado de procesamiento compartido entre consultas de la misma parcela"""
+    __tablename__ = "shared_results"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    
+    # Clave: tipo (wms, urbanismo), huella de geometría, capas y versión de sus datos
+    kind = Column(String, nullable=False)
+    geometry_hash = Column(String(64), nullable=False)
+    layer_set = Column(String, nullable=False)
+    layer_version = Column(String, nullable=False)
+    
+    referencia_catastral = Column(String)  # Referencia de la consulta que lo calculó
+    summary = Column(String, nullable=False)  # JSON con el resumen guardado en las consultas
+    
+    # Frescura: caducado, se recalcula (cambios en las capas de origen)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint("kind", "geometry_hash", "layer_set", "layer_version", name="uq_shared_results_key"),
+    )
+
+
+class ApiKey(Base):
+    """Clave de API de un usuario (solo se guarda su HMAC)"""
+    __tablename__ = "api_keys"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False, index=True)
+    name = Column(String, nullable=False)
+    
+    # cs_<prefix>_<secreto>: el prefijo localiza la clave, el HMAC la valida
+    prefix = Column(String(16), nullable=False, unique=True, index=True)
+    key_hash = Column(String(64), nullable=False)
+    scopes = Column(String, nullable=False)  # Separados por espacios
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    revoked_at = Column(DateTime(timezone=True), nullable=True)
+    
+    # Relaciones
+    user = relationship("User", back_populates="api_keys")
+
+
+class UsageCounter(Base):
+    """Contadores de uso por usuario (desnormalizados para /stats)"""
+    __tablename__ = "usage_counters"
+    
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    
+    # Contadores acumulados
+    total_queries = Column(Integer, default=0, nullable=False)
+    wms_processed = Column(Integer, default=0, nullable=False)  # Consultas con WMS procesado
+    urbanismo_processed = Column(Integer, default=0, nullable=False)  # Consultas con urbanismo procesado
+    
+    # Contador mensual: se reinicia al cambiar de mes (YYYY-MM, UTC)
+    month = Column(String(7))
+    queries_this_month = Column(Integer, default=0, nullable=False)
+    
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 
 class Payment(Base):
@@ -127,3 +230,23 @@ class Payment(Base):
     
     # Relaciones
     user = relationship("User", back_populates="payments")
+
+
+class StripeEvent(Base):
+    """Bandeja de eventos de webhook de Stripe (verificados, pendientes de aplicar)"""
+    __tablename__ = "stripe_events"
+    __table_args__ = (
+        Index("ix_stripe_events_pending", "processed_at", "created"),
+    )
+    
+    id = Column(String, primary_key=True)  # Id del evento en Stripe (evt_...): deduplica reintentos
+    type = Column(String, nullable=False)
+    stripe_object_id = Column(String, index=True)  # data.object.id (p. ej. sub_...)
+    created = Column(Integer, nullable=False)  # Epoch de creación en Stripe: orden de aplicación
+    payload = Column(String, nullable=False)  # Cuerpo JSON tal como llegó
+    
+    # Procesamiento
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(String, nullable=True)
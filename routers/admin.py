@@ -0,0 +1,46 @@
+"""
+Router de administración
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db
+from auth.dependencies import require_admin
+from auth.identity import UserSnapshot
+from services.profile_service import summarize_profiles
+import models
+import schemas
+
+router = APIRouter(prefix="/api/admin", tags=["Admin"])
+
+# Columna que indica que la consulta pasó por cada pipeline
+PIPELINE_FLAGS = {
+    "wms": models.Query.has_wms_maps,
+    "urbanismo": models.Query.has_urbanismo
+}
+
+
+@router.get("/processing-profiles", response_model=schemas.ProcessingProfileReport)
+async def get_processing_profiles(
+    pipeline: str = "wms",
+    limit: int = 500,
+    current_user: UserSnapshot = Depends(require_admin),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Percentiles de tiempos y bytes por etapa (y capa) y por host externo
+    en las últimas `limit` consultas procesadas con el pipeline (wms o urbanismo).
+    """
+    if pipeline not in PIPELINE_FLAGS:
+        raise HTTPException(status_code=400, detail=f"Unknown pipeline: {pipeline}")
+    if not 1 <= limit <= 5000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 5000")
+
+    rows = await db.scalars(
+        select(models.Query.processing_profile)
+        .where(PIPELINE_FLAGS[pipeline].is_(True), models.Query.processing_profile.is_not(None))
+        .order_by(models.Query.created_at.desc())
+        .limit(limit)
+    )
+    return summarize_profiles(rows, pipeline)
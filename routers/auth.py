@@ -3,13 +3,18 @@ Router de autenticación
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import timedelta
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone
+from typing import List
 
-from database import get_db
-from auth.utils import verify_password, get_password_hash
+from database import get_async_db
+from auth.utils import get_password_hash_async, verify_and_update_password
 from auth.jwt import create_access_token
-from auth.dependencies import get_current_active_user
+from auth.api_keys import API_KEY_SCOPES, generate_api_key
+from auth.dependencies import get_current_active_user, require_session
+from auth.identity import UserSnapshot, invalidate_user
+from services.quota_reset_service import add_month
 import models
 import schemas
 from config import settings
@@ -18,11 +23,11 @@ router = APIRouter(prefix="/api/auth", tags=["Authentication"])
 
 
 @router.post("/register", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
-async def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Registrar nuevo usuario"""
     
     # Verificar si el email ya existe
-    existing_user = db.query(models.User).filter(models.User.email == user_data.email).first()
+    existing_user = await db.scalar(select(models.User).where(models.User.email == user_data.email))
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -30,7 +35,7 @@ async def register(user_data: schemas.UserCreate, db: Session = Depends(get_db))
         )
     
     # Crear usuario
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     new_user = models.User(
         email=user_data.email,
         full_name=user_data.full_name,
@@ -38,19 +43,23 @@ async def register(user_data: schemas.UserCreate, db: Session = Depends(get_db))
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.flush()
     
-    # Crear suscripción gratuita
+    # Crear suscripción gratuita (misma transacción que el usuario), con un
+    # periodo mensual desde hoy que el planificador de cuotas irá renovando
+    period_start = datetime.now(timezone.utc)
     subscription = models.Subscription(
         user_id=new_user.id,
         plan_type=models.PlanType.FREE,
         status=models.SubscriptionStatus.ACTIVE,
-        queries_limit=settings.PLAN_FREE_QUERIES
+        queries_limit=settings.PLAN_FREE_QUERIES,
+        current_period_start=period_start,
+        current_period_end=add_month(period_start)
     )
     
     db.add(subscription)
-    db.commit()
+    await db.commit()
+    await db.refresh(new_user)
     
     return new_user
 
@@ -58,20 +67,29 @@ async def register(user_data: schemas.UserCreate, db: Session = Depends(get_db))
 @router.post("/login", response_model=schemas.Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Login de usuario"""
     
     # Buscar usuario
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
+    user = await db.scalar(select(models.User).where(models.User.email == form_data.username))
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await verify_and_update_password(form_data.password, user.hashed_password)
+    
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Hash con parámetros obsoletos (p. ej. BCRYPT_ROUNDS subido): rehash transparente
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+    
     if not user.is_active:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -90,18 +108,118 @@ async def login(
 
 @router.get("/me", response_model=schemas.UserWithSubscription)
 async def get_me(
-    current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_active_user)
 ):
     """Obtener información del usuario actual"""
     
-    # Cargar suscripción
-    subscription = db.query(models.Subscription).filter(
-        models.Subscription.user_id == current_user.id
-    ).first()
+    # Instantánea (con suscripción) de get_current_user: sin consultas a BD
+    return schemas.UserWithSubscription.model_validate(current_user)
+
+
+# ============================================
+# CLAVES DE API
+# ============================================
+def _api_key_response(api_key: models.ApiKey) -> schemas.ApiKeyResponse:
+    return schemas.ApiKeyResponse(
+        id=api_key.id,
+        name=api_key.name,
+        prefix=api_key.prefix,
+        scopes=api_key.scopes.split(),
+        created_at=api_key.created_at,
+        revoked_at=api_key.revoked_at
+    )
+
+
+@router.post("/api-keys", response_model=schemas.ApiKeyCreated, status_code=status.HTTP_201_CREATED)
+async def create_api_key(
+    key_data: schemas.ApiKeyCreate,
+    current_user: UserSnapshot = Depends(require_session),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Crear clave de API (plan Enterprise)
+    
+    La clave completa solo se devuelve en esta respuesta; en BD se guarda su HMAC.
+    Enviarla en la cabecera X-API-Key (o Authorization: Bearer <clave>).
+    """
+    
+    subscription = current_user.subscription
+    if not subscription or subscription.plan_type != models.PlanType.ENTERPRISE:
+        raise HTTPException(status_code=403, detail="API access requires the Enterprise plan")
+    
+    scopes = key_data.scopes if key_data.scopes is not None else list(API_KEY_SCOPES)
+    invalid = sorted(set(scopes) - set(API_KEY_SCOPES))
+    if invalid or not scopes:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid scopes: {', '.join(invalid) or '(none)'}. Allowed: {', '.join(API_KEY_SCOPES)}"
+        )
+    
+    active_keys = await db.scalar(
+        select(func.count()).select_from(models.ApiKey).where(
+            models.ApiKey.user_id == current_user.id,
+            models.ApiKey.revoked_at.is_(None)
+        )
+    )
+    if active_keys >= settings.API_KEY_MAX_PER_USER:
+        raise HTTPException(
+            status_code=400,
+            detail=f"API key limit reached ({settings.API_KEY_MAX_PER_USER}). Revoke an existing key first."
+        )
+    
+    key, prefix, key_hash = generate_api_key()
+    api_key = models.ApiKey(
+        user_id=current_user.id,
+        name=key_data.name,
+        prefix=prefix,
+        key_hash=key_hash,
+        scopes=" ".join(dict.fromkeys(scopes))
+    )
+    
+    db.add(api_key)
+    await db.commit()
+    await db.refresh(api_key)
+    
+    return schemas.ApiKeyCreated(**_api_key_response(api_key).model_dump(), key=key)
+
+
+@router.get("/api-keys", response_model=List[schemas.ApiKeyResponse])
+async def list_api_keys(
+    current_user: UserSnapshot = Depends(require_session),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Listar las claves de API del usuario (sin el secreto)"""
+    
+    result = await db.scalars(
+        select(models.ApiKey)
+        .where(models.ApiKey.user_id == current_user.id)
+        .order_by(models.ApiKey.created_at.desc())
+    )
+    return [_api_key_response(k) for k in result.all()]
+
+
+@router.delete("/api-keys/{key_id}", response_model=schemas.ApiKeyResponse)
+async def revoke_api_key(
+    key_id: str,
+    current_user: UserSnapshot = Depends(require_session),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Revocar una clave de API"""
+    
+    api_key = await db.scalar(
+        select(models.ApiKey).where(
+            models.ApiKey.id == key_id,
+            models.ApiKey.user_id == current_user.id
+        )
+    )
+    
+    if not api_key:
+        raise HTTPException(status_code=404, detail="API key not found")
     
-    response = schemas.UserWithSubscription.from_orm(current_user)
-    if subscription:
-        response.subscription = schemas.SubscriptionResponse.from_orm(subscription)
+    if api_key.revoked_at is None:
+        api_key.revoked_at = datetime.now(timezone.utc)
+        await db.commit()
+        # La clave puede estar en la caché de identidad de este proceso
+        invalidate_user(current_user.id)
     
-    return response
+    return _api_key_response(api_key)
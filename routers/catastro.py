@@ -2,64 +2,113 @@
 Router de consultas catastrales
 """
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, undefer, undefer_group
+from contextlib import nullcontext
+from typing import List, Optional
+import asyncio
+import base64
 import io
 import zipfile
 import json
 from datetime import datetime
 
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import TypeAdapter
 
-from database import get_db
-from auth.dependencies import get_current_active_user, check_query_limit
+from database import get_async_db, AsyncSessionLocal
+from auth.api_keys import SCOPE_PROCESSING, SCOPE_QUERIES_READ, SCOPE_QUERIES_WRITE
+from auth.dependencies import get_current_active_user, consume_query_quota, raise_quota_error, require_scope
+from auth.identity import UserSnapshot, invalidate_user
+from config import settings
+from services.geometry_service import content_geometry_fields, geometry_from_geojson, geometry_from_kml, load_geometry, query_geometry_fields
+from services.profile_service import merge_profile
+from services.progress import ProgressTracker, format_sse
+from services.quota_service import consume_queries
+from services.rate_limiter import BUCKET_GENERAL, BUCKET_HEAVY, heavy_gate, heavy_work_slot, rate_limit
+from services.spatial_index_service import search_area, search_user_queries
+from services.shared_result_service import KIND_URBANISMO, KIND_WMS, get_shared_result, store_shared_result
+from services.usage_service import current_month, get_usage, record_usage
 import models
 import schemas
 
-router = APIRouter(prefix="/api/catastro", tags=["Catastro"])
+# Todas las rutas consumen del bucket general del plan; las pesadas, además,
+# del bucket heavy y de un hueco de trabajo pesado (heavy_gate)
+router = APIRouter(
+    prefix="/api/catastro",
+    tags=["Catastro"],
+    dependencies=[Depends(rate_limit(BUCKET_GENERAL))]
+)
+HEAVY_DEPENDENCIES = [Depends(rate_limit(BUCKET_HEAVY)), Depends(heavy_work_slot)]
 
+# Intervalo máximo sin datos en un stream SSE antes de enviar un keep-alive
+SSE_KEEPALIVE_SECONDS = 15
 
-@router.post("/query", response_model=schemas.QueryResponse)
+# Exportación: ids por SELECT ... IN (...) y filas con payload en memoria a la vez
+EXPORT_ID_CHUNK = 500
+EXPORT_YIELD_PER = 50
+
+# Búsqueda espacial: máximo de resultados por petición
+SEARCH_MAX_RESULTS = 1000
+
+# Listas de consultas: se validan una sola vez contra el esquema (from_attributes)
+# y se serializan con orjson, sin la segunda pasada de response_model + jsonable_encoder
+_QUERY_LIST = TypeAdapter(List[schemas.QueryResponse])
+
+
+def _query_list_response(queries, headers=None):
+    return ORJSONResponse(
+        _QUERY_LIST.dump_python(_QUERY_LIST.validate_python(queries, from_attributes=True), mode="json"),
+        headers=headers
+    )
+
+
+@router.post("/query", response_model=schemas.QueryResponse, dependencies=[Depends(require_scope(SCOPE_QUERIES_WRITE))])
 async def create_query(
     query_data: schemas.QueryCreate,
-    current_user: models.User = Depends(check_query_limit),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(consume_query_quota),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Crear nueva consulta catastral
     
     Este endpoint:
-    1. Verifica que el usuario tenga consultas disponibles
-    2. Crea el registro de consulta
-    3. Incrementa el contador de consultas usadas
+    1. Verifica y consume la cuota (un UPDATE condicional, en consume_query_quota)
+    2. Crea el registro de consulta en la misma transacción
+    3. Guarda la geometría normalizada (parseada una sola vez, aquí)
     4. Devuelve la información de la consulta
     
     NOTA: La lógica de procesamiento real (llamar al sistema catastral original)
     debe implementarse aquí o en un worker asíncrono.
     """
     
+    # Parsear la geometría una vez; el procesamiento usa la forma almacenada
+    geometry = await run_in_threadpool(
+        content_geometry_fields, query_data.kml_content, query_data.geojson_content
+    )
+    
     # Crear consulta
     new_query = models.Query(
         user_id=current_user.id,
         referencia_catastral=query_data.referencia_catastral,
         kml_content=query_data.kml_content,  # Guardar KML si se proporciona
+        geojson_content=query_data.geojson_content,  # Necesario para process-urbanismo
         has_climate_data=False,
         has_socioeconomic_data=False,
         has_pdf=False,
-        has_wms_maps=False
+        has_wms_maps=False,
+        **geometry
     )
     
     db.add(new_query)
+    await record_usage(db, current_user.id, queries=1)
     
-    # Incrementar contador de consultas
-    subscription = db.query(models.Subscription).filter(
-        models.Subscription.user_id == current_user.id
-    ).first()
-    
-    subscription.queries_used += 1
-    
-    db.commit()
-    db.refresh(new_query)
+    await db.commit()
+    await db.refresh(new_query)
+    # queries_used de la identidad cacheada ya no es válido
+    invalidate_user(current_user.id)
     
     # TODO: Aquí se debe llamar al sistema catastral original
     # para procesar la referencia y generar los datos
@@ -68,34 +117,217 @@ async def create_query(
     return new_query
 
 
-@router.get("/queries", response_model=List[schemas.QueryResponse])
+def _validate_query_item(item: schemas.QueryContent):
+    """
+    Valida un item de alta masiva parseando su geometría (una sola vez).
+    Devuelve (mensaje de error o None, columnas de geometría).
+    """
+    try:
+        schemas.normalize_referencia_catastral(item.referencia_catastral)
+    except ValueError as e:
+        return str(e), {}
+    
+    kml_geometry = geojson_geometry = None
+    if item.kml_content:
+        try:
+            kml_geometry = geometry_from_kml(item.kml_content)
+        except Exception as e:
+            return f"Invalid KML: {e}", {}
+    
+    if item.geojson_content:
+        try:
+            geojson_obj = json.loads(item.geojson_content)
+        except ValueError as e:
+            return f"Invalid GeoJSON: {e}", {}
+        if not isinstance(geojson_obj, dict) or not geojson_obj.get("features"):
+            return "Invalid GeoJSON: FeatureCollection without features", {}
+        try:
+            geojson_geometry = geometry_from_geojson(geojson_obj)
+        except Exception as e:
+            return f"Invalid GeoJSON: {e}", {}
+    
+    return None, query_geometry_fields(kml_geometry, geojson_geometry)
+
+
+def _validate_query_items(items):
+    """Valida todos los items de un alta masiva (trabajo de CPU: fuera del event loop)"""
+    return [_validate_query_item(item) for item in items]
+
+
+@router.post("/queries/bulk", response_model=schemas.BulkQueryResponse, dependencies=[Depends(require_scope(SCOPE_QUERIES_WRITE))])
+async def create_queries_bulk(
+    bulk_data: schemas.BulkQueryCreate,
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Crear consultas catastrales en bloque
+    
+    1. Valida todos los items a la vez (los inválidos se devuelven con su error)
+    2. Consume la cuota de todos los items válidos con un único UPDATE condicional
+       (todo o nada: si no hay cuota para el lote completo no se crea ninguno)
+    3. Inserta todas las consultas con un único INSERT en la misma transacción
+    """
+    if len(bulk_data.items) > settings.BULK_QUERY_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many items ({len(bulk_data.items)}). Maximum is {settings.BULK_QUERY_MAX_ITEMS}."
+        )
+    
+    validated = await run_in_threadpool(_validate_query_items, bulk_data.items)
+    
+    results = []
+    rows = []
+    for index, (item, (error, geometry)) in enumerate(zip(bulk_data.items, validated)):
+        result = schemas.BulkQueryItemResult(
+            index=index,
+            referencia_catastral=item.referencia_catastral,
+            error=error
+        )
+        if error is None:
+            # Ids generados aquí para poder devolverlos sin releer las filas
+            result.id = models.generate_uuid()
+            rows.append({
+                "id": result.id,
+                "user_id": current_user.id,
+                "referencia_catastral": schemas.normalize_referencia_catastral(item.referencia_catastral),
+                "kml_content": item.kml_content,
+                "geojson_content": item.geojson_content,
+                "has_climate_data": False,
+                "has_socioeconomic_data": False,
+                "has_pdf": False,
+                "has_wms_maps": False,
+                "has_urbanismo": False,
+                **geometry
+            })
+        results.append(result)
+    
+    if rows:
+        if await consume_queries(db, current_user.id, len(rows)) is None:
+            await raise_quota_error(db, current_user.id, len(rows))
+        
+        await db.execute(insert(models.Query), rows)
+        await record_usage(db, current_user.id, queries=len(rows))
+        await db.commit()
+        invalidate_user(current_user.id)
+    
+    return schemas.BulkQueryResponse(
+        created=len(rows),
+        failed=len(results) - len(rows),
+        results=results
+    )
+
+
+def _encode_cursor(query):
+    """Cursor opaco a partir de (created_at, id) de la última fila de la página"""
+    raw = json.dumps([query.created_at.isoformat(), query.id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor):
+    """Inversa de _encode_cursor. Lanza 400 si el cursor no es válido."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, query_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), str(query_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/queries", response_model=List[schemas.QueryResponse], dependencies=[Depends(require_scope(SCOPE_QUERIES_READ))])
 async def get_my_queries(
-    current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db),
     skip: int = 0,
-    limit: int = 100
+    limit: int = 100,
+    cursor: Optional[str] = None
 ):
-    """Obtener historial de consultas del usuario"""
+    """
+    Obtener historial de consultas del usuario (más recientes primero)
+    
+    Dos modos de paginación:
+    - cursor (recomendado): sin parámetros para la primera página y después el
+      valor de la cabecera X-Next-Cursor. Usa el índice (user_id, created_at, id)
+      y cuesta lo mismo en la página 1 que en la 500.
+    - skip/limit: se mantiene por compatibilidad; las páginas profundas recorren
+      y descartan todas las filas anteriores.
+    """
+    
+    stmt = (
+        select(models.Query)
+        .where(models.Query.user_id == current_user.id)
+        .order_by(models.Query.created_at.desc(), models.Query.id.desc())
+        .limit(limit)
+    )
+    
+    if cursor:
+        cursor_created_at, cursor_id = _decode_cursor(cursor)
+        stmt = stmt.where(
+            tuple_(models.Query.created_at, models.Query.id) < tuple_(cursor_created_at, cursor_id)
+        )
+    else:
+        stmt = stmt.offset(skip)
+    
+    result = await db.scalars(stmt)
+    queries = result.all()
     
-    queries = db.query(models.Query).filter(
-        models.Query.user_id == current_user.id
-    ).order_by(models.Query.created_at.desc()).offset(skip).limit(limit).all()
+    # Página completa: puede haber más resultados
+    headers = None
+    if queries and len(queries) == limit:
+        headers = {"X-Next-Cursor": _encode_cursor(queries[-1])}
     
-    return queries
+    return _query_list_response(queries, headers)
+
+
+def _parse_bbox(bbox):
+    """bbox "minLon,minLat,maxLon,maxLat" (EPSG:4326). Lanza 400 si no es válida."""
+    try:
+        minx, miny, maxx, maxy = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid bbox (expected minLon,minLat,maxLon,maxLat)")
+    if not (-180 <= minx < maxx <= 180 and -90 <= miny < maxy <= 90):
+        raise HTTPException(status_code=400, detail="Invalid bbox (expected minLon,minLat,maxLon,maxLat)")
+    return minx, miny, maxx, maxy
+
+
+@router.get("/queries/search", response_model=List[schemas.QueryResponse], dependencies=[Depends(require_scope(SCOPE_QUERIES_READ))])
+async def search_queries(
+    bbox: str,
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db),
+    limit: int = 100
+):
+    """
+    Consultas del usuario cuya parcela interseca un área (más recientes primero)
+    
+    bbox en lon/lat (EPSG:4326): minLon,minLat,maxLon,maxLat. Se recorta al
+    territorio en el que se guardan las geometrías (400 si queda fuera).
+    Candidatos por R-tree de bbox (GiST con PostGIS; STRtree en memoria si no)
+    y filtro exacto con la geometría almacenada. Las consultas sin geometría
+    (sin KML/GeoJSON) no aparecen.
+    """
+    try:
+        area = await run_in_threadpool(search_area, *_parse_bbox(bbox))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    matches = await search_user_queries(db, current_user.id, area, min(max(limit, 1), SEARCH_MAX_RESULTS))
+    return _query_list_response(matches)
 
 
-@router.get("/queries/{query_id}", response_model=schemas.QueryResponse)
+@router.get("/queries/{query_id}", response_model=schemas.QueryResponse, dependencies=[Depends(require_scope(SCOPE_QUERIES_READ))])
 async def get_query(
     query_id: str,
-    current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Obtener detalles de una consulta específica"""
     
-    query = db.query(models.Query).filter(
-        models.Query.id == query_id,
-        models.Query.user_id == current_user.id
-    ).first()
+    query = await db.scalar(
+        select(models.Query).where(
+            models.Query.id == query_id,
+            models.Query.user_id == current_user.id
+        )
+    )
     
     if not query:
         raise HTTPException(status_code=404, detail="Query not found")
@@ -103,23 +335,40 @@ async def get_query(
     return query
 
 
-@router.get("/stats")
+@router.get("/stats", dependencies=[Depends(require_scope(SCOPE_QUERIES_READ))])
 async def get_stats(
-    current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Obtener estadísticas de uso del usuario"""
+    """
+    Obtener estadísticas de uso del usuario
+    
+    Lee los contadores desnormalizados (usage_counters, por clave primaria);
+    la suscripción ya viene cargada con el usuario.
+    """
     
-    subscription = db.query(models.Subscription).filter(
-        models.Subscription.user_id == current_user.id
-    ).first()
+    subscription = current_user.subscription
+    usage = await get_usage(db, current_user.id)
     
-    total_queries = db.query(models.Query).filter(
-        models.Query.user_id == current_user.id
-    ).count()
+    if usage is None:
+        # Usuario sin contadores todavía (datos anteriores a usage_counters)
+        total_queries = await db.scalar(
+            select(func.count()).select_from(models.Query).where(
+                models.Query.user_id == current_user.id
+            )
+        )
+        queries_this_month = wms_processed = urbanismo_processed = None
+    else:
+        total_queries = usage.total_queries
+        queries_this_month = usage.queries_this_month if usage.month == current_month() else 0
+        wms_processed = usage.wms_processed
+        urbanismo_processed = usage.urbanismo_processed
     
     return {
         "total_queries": total_queries,
+        "queries_this_month": queries_this_month,
+        "wms_processed": wms_processed,
+        "urbanismo_processed": urbanismo_processed,
         "queries_used_this_period": subscription.queries_used if subscription else 0,
         "queries_limit": subscription.queries_limit if subscription else 0,
         "queries_remaining": (subscription.queries_limit - subscription.queries_used) if subscription else 0,
@@ -356,10 +605,15 @@ def _create_pdf_bytes(query):
             return f"Referencia: {query.referencia_catastral}\nCreado: {query.created_at}\n".encode('utf-8')
 
 
-def _create_zip_for_queries(queries):
-    """Crea un ZIP con PDFs mejorados, metadatos, imágenes WMS y datos de afección."""
+def _create_zip_for_queries(queries, zip_file=None):
+    """Crea un ZIP con PDFs mejorados, metadatos, imágenes WMS y datos de afección.
+
+    Con zip_file (un ZipFile ya abierto) añade las consultas a ese ZIP sin
+    cerrarlo y no devuelve nada: permite construir exportaciones por bloques.
+    """
     buf = io.BytesIO()
-    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+    target = nullcontext(zip_file) if zip_file is not None else zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED)
+    with target as z:
         for q in queries:
             folder = f"{q.referencia_catastral}_{q.id}"
             
@@ -405,7 +659,9 @@ def _create_zip_for_queries(queries):
                 try:
                     if q.geojson_content:
                         from services.urbanismo_service import procesar_consulta_urbanismo
-                        resultados_urb = procesar_consulta_urbanismo(q.geojson_content, q.referencia_catastral)
+                        resultados_urb = procesar_consulta_urbanismo(
+                            q.geojson_content, q.referencia_catastral, geometry=load_geometry(q.geometry_wkb)
+                        )
                         imgs = resultados_urb.get('imagenes', {}) or {}
                         urb_folder = f"{folder}/urbanismo_images"
                         if imgs.get('ortofoto'):
@@ -436,50 +692,294 @@ Contenido del paquete:
 Para más información, visite: https://example.com
 """)
 
+    if zip_file is not None:
+        return None
     buf.seek(0)
     return buf.getvalue()
 
-@router.get("/queries/{query_id}/download")
+
+async def _stream_user_queries(db, user_id, ids):
+    """
+    Recorre las consultas del usuario con esos ids, por bloques.
+    
+    - Los ids se consultan en trozos de EXPORT_ID_CHUNK (listas IN acotadas).
+    - Cada trozo se lee en streaming con yield_per: solo EXPORT_YIELD_PER filas
+      (con sus blobs) en memoria a la vez.
+    - El usuario llega en la misma sentencia (joinedload muchos-a-uno, compatible
+      con yield_per), así que no hay un SELECT extra por consulta ni por bloque.
+    """
+    unique_ids = list(dict.fromkeys(ids))
+    for start in range(0, len(unique_ids), EXPORT_ID_CHUNK):
+        chunk = unique_ids[start:start + EXPORT_ID_CHUNK]
+        result = await db.stream_scalars(
+            select(models.Query)
+            .options(joinedload(models.Query.user), undefer_group(models.QUERY_PAYLOAD_GROUP))
+            .where(models.Query.id.in_(chunk), models.Query.user_id == user_id)
+            .execution_options(yield_per=EXPORT_YIELD_PER)
+        )
+        async for partition in result.partitions():
+            yield partition
+
+@router.get("/queries/{query_id}/download", dependencies=[Depends(require_scope(SCOPE_QUERIES_READ)), *HEAVY_DEPENDENCIES])
 async def download_query_zip(
     query_id: str,
-    current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Generar y devolver un ZIP con los archivos asociados a una consulta"""
-    query = db.query(models.Query).filter(models.Query.id == query_id, models.Query.user_id == current_user.id).first()
+    query = await db.scalar(
+        select(models.Query)
+        .options(joinedload(models.Query.user), undefer_group(models.QUERY_PAYLOAD_GROUP))
+        .where(models.Query.id == query_id, models.Query.user_id == current_user.id)
+    )
     if not query:
         raise HTTPException(status_code=404, detail="Query not found")
 
-    zip_bytes = _create_zip_for_queries([query])
+    # PDF + ZIP (y posible regeneración de mapas) fuera del event loop
+    zip_bytes = await run_in_threadpool(_create_zip_for_queries, [query])
     filename = f"catastro_query_{query.referencia_catastral}_{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.zip"
     return StreamingResponse(io.BytesIO(zip_bytes), media_type='application/zip', headers={
         'Content-Disposition': f'attachment; filename="{filename}"'
     })
 
 
-@router.post("/queries/export")
+@router.post("/queries/export", dependencies=[Depends(require_scope(SCOPE_QUERIES_READ)), *HEAVY_DEPENDENCIES])
 async def export_queries(
     ids: List[str],
-    current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Exportar múltiples consultas (lista de ids) como un ZIP descargable"""
-    queries = db.query(models.Query).filter(models.Query.id.in_(ids), models.Query.user_id == current_user.id).all()
-    if not queries:
+    buf = io.BytesIO()
+    exported = 0
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        async for partition in _stream_user_queries(db, current_user.id, ids):
+            # PDFs y ZIP del bloque fuera del event loop
+            await run_in_threadpool(_create_zip_for_queries, partition, z)
+            exported += len(partition)
+            # Liberar los blobs del bloque ya escrito
+            for q in partition:
+                db.expunge(q)
+    
+    if not exported:
         raise HTTPException(status_code=404, detail="No queries found for given ids")
 
-    zip_bytes = _create_zip_for_queries(queries)
+    zip_bytes = buf.getvalue()
     filename = f"catastro_queries_export_{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.zip"
     return StreamingResponse(io.BytesIO(zip_bytes), media_type='application/zip', headers={
         'Content-Disposition': f'attachment; filename="{filename}"'
     })
 
 
-@router.post("/query/{query_id}/process-wms")
+async def _apply_wms_results(db, query, resultados, geometry_hash=None, shared=None):
+    """
+    Vuelca en la consulta los resultados WMS y devuelve el resumen de respuesta.
+    
+    shared: resultado compartido del que proceden los resultados (acierto de caché).
+    geometry_hash: si los resultados se han calculado y están completos (sin
+    errores), se publican como resultado compartido para esa geometría.
+    """
+    from services.wms_service import WMS_LAYER_SET
+    
+    capas = resultados.get('capas', {})
+    if shared is not None:
+        query.wms_result_id = shared.id
+    elif geometry_hash and capas and "error" not in resultados and not any("error" in c for c in capas.values()):
+        query.wms_result_id = await store_shared_result(
+            db, KIND_WMS, geometry_hash, WMS_LAYER_SET, query.referencia_catastral, capas
+        )
+    
+    if not query.has_wms_maps:
+        await record_usage(db, query.user_id, wms=1)
+    query.has_wms_maps = True
+    # Copia en la consulta: los clientes y la exportación leen wms_affection_data
+    query.wms_affection_data = json.dumps(capas, default=str, ensure_ascii=False)
+    
+    return {
+        "status": "success",
+        "query_id": query.id,
+        "referencia": query.referencia_catastral,
+        "capas_procesadas": list(capas.keys()),
+        "has_wms_maps": True,
+        "cached": shared is not None
+    }
+
+
+async def _apply_urbanismo_results(db, query, resultados, geometry_hash=None, shared=None):
+    """
+    Vuelca en la consulta los resultados de urbanismo y devuelve el resumen de respuesta.
+    shared y geometry_hash como en _apply_wms_results.
+    """
+    from services.urbanismo_service import URBANISMO_LAYER_SET
+    
+    # Guardar datos de planeamiento (porcentajes y áreas)
+    urbanismo_resumen = {
+        "area_total_m2": resultados.get("area_total_m2", 0),
+        "porcentajes": resultados.get("porcentajes", {}),
+        "errores": {k: v for k, v in resultados.items() if k.endswith("_error")}
+    }
+    if shared is not None:
+        query.urbanismo_result_id = shared.id
+    elif geometry_hash and "error" not in resultados and not urbanismo_resumen["errores"]:
+        query.urbanismo_result_id = await store_shared_result(
+            db, KIND_URBANISMO, geometry_hash, URBANISMO_LAYER_SET, query.referencia_catastral, urbanismo_resumen
+        )
+    
+    if not query.has_urbanismo:
+        await record_usage(db, query.user_id, urbanismo=1)
+    query.has_urbanismo = True
+    query.urbanismo_data = json.dumps(urbanismo_resumen, default=str, ensure_ascii=False)
+    
+    return {
+        "status": "success",
+        "query_id": query.id,
+        "referencia": query.referencia_catastral,
+        "area_total_m2": resultados.get("area_total_m2"),
+        "clases_suelo_encontradas": len(resultados.get("porcentajes", [])),
+        "has_urbanismo": True,
+        "cached": shared is not None
+    }
+
+
+async def _find_shared_wms(db, query):
+    """Huella de la geometría y resultado WMS compartido vigente (o None)"""
+    from services.wms_service import WMS_LAYER_SET
+    
+    # Consultas sin geometría almacenada (anteriores al relleno): sin caché
+    if query.geometry_hash is None:
+        return None, None
+    return query.geometry_hash, await get_shared_result(db, KIND_WMS, query.geometry_hash, WMS_LAYER_SET)
+
+
+async def _find_shared_urbanismo(db, query):
+    """Huella de la geometría y resultado de urbanismo compartido vigente (o None)"""
+    from services.urbanismo_service import URBANISMO_LAYER_SET
+    
+    if query.geometry_hash is None:
+        return None, None
+    return query.geometry_hash, await get_shared_result(db, KIND_URBANISMO, query.geometry_hash, URBANISMO_LAYER_SET)
+
+
+def _shared_wms_resultados(query, shared):
+    """Resultados WMS reconstruidos desde un resultado compartido"""
+    return {"referencia": query.referencia_catastral, "capas": json.loads(shared.summary), "imagenes": {}}
+
+
+def _shared_urbanismo_resultados(query, shared):
+    """Resultados de urbanismo reconstruidos desde un resultado compartido"""
+    return {"referencia": query.referencia_catastral, **json.loads(shared.summary), "imagenes": {}}
+
+
+def _cached_run(shared, resultados):
+    """Pipeline sustituto para un acierto de caché: un único evento cache_hit"""
+    def run(progress):
+        progress.emit("cache_hit", shared_result_id=shared.id, expires_at=shared.expires_at)
+        return resultados
+    return run
+
+
+async def _save_results(db, query, resultados, apply_results, progress):
+    """
+    Guarda los resultados y el perfil de procesamiento (processing_profile).
+    La etapa saved cubre el volcado y el flush (las escrituras SQL); el commit
+    queda fuera para que el perfil vaya en la misma transacción.
+    """
+    with progress.stage("saved"):
+        resumen = await apply_results(db, query, resultados)
+        await db.flush()
+    query.processing_profile = merge_profile(query.processing_profile, progress.profile())
+    await db.commit()
+    return resumen
+
+
+# Pipelines en streaming en curso: el event loop solo guarda referencias débiles
+# a las tareas, y deben sobrevivir a la respuesta si el cliente se desconecta
+_pipeline_tasks = set()
+
+
+async def _process_pipeline(query_id, run, apply_results, progress, release):
+    """
+    Ejecuta el pipeline en el threadpool y guarda sus resultados.
+    Es dueña del hueco de heavy_gate: lo libera al terminar, tanto si el
+    cliente sigue conectado como si no.
+    """
+    try:
+        resultados = await run_in_threadpool(run, progress)
+        # Sesión propia: la de la petición se cierra al emitir la respuesta
+        async with AsyncSessionLocal() as db:
+            query = await db.get(models.Query, query_id, options=[undefer(models.Query.processing_profile)])
+            return await _save_results(db, query, resultados, apply_results, progress)
+    finally:
+        release()
+
+
+def _stream_pipeline(pipeline, query_id, run, apply_results, release):
+    """
+    Lanza el procesamiento en una tarea y devuelve el stream SSE de su progreso.
+    
+    run(progress) ejecuta el pipeline y devuelve sus resultados;
+    apply_results(db, query, resultados) los guarda en la consulta y devuelve el resumen.
+    release libera el hueco de heavy_gate (la tarea lo llama al terminar).
+    
+    La tarea ejecuta y guarda aunque el cliente se desconecte; el stream solo
+    reenvía los eventos. Se envía un comentario keep-alive si no hay eventos
+    para que los proxies no corten la conexión mientras se espera a servicios
+    externos lentos.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    finished = object()
+    
+    def on_event(event):
+        loop.call_soon_threadsafe(queue.put_nowait, event)
+    
+    progress = ProgressTracker(on_event, pipeline=pipeline)
+    task = loop.create_task(_process_pipeline(query_id, run, apply_results, progress, release))
+    _pipeline_tasks.add(task)
+    task.add_done_callback(_pipeline_tasks.discard)
+    # Detrás de los eventos ya encolados (incluido saved)
+    task.add_done_callback(lambda _: loop.call_soon(queue.put_nowait, finished))
+    
+    async def events():
+        try:
+            yield format_sse({"stage": "started", "pipeline": pipeline, "query_id": query_id})
+            
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is finished:
+                    break
+                yield format_sse(event)
+            
+            try:
+                resumen = task.result()
+            except Exception as e:
+                yield format_sse({"stage": "error", "detail": str(e)})
+            else:
+                yield format_sse({"stage": "done", **resumen})
+        finally:
+            # Cliente desconectado: la tarea sigue, sin reenviar eventos
+            progress.callback = None
+    
+    return events()
+
+
+def _sse_response(events):
+    """StreamingResponse text/event-stream sin buffering en proxies"""
+    return StreamingResponse(events, media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
+@router.post("/query/{query_id}/process-wms", dependencies=[Depends(require_scope(SCOPE_PROCESSING)), *HEAVY_DEPENDENCIES])
 async def process_query_with_wms(
     query_id: str,
-    current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Procesa una consulta existente: obtiene KML, descarga mapas WMS y calcula afecciones.
@@ -488,10 +988,16 @@ async def process_query_with_wms(
     try:
         from services.wms_service import procesar_consulta_catastral
         
-        query = db.query(models.Query).filter(
-            models.Query.id == query_id,
-            models.Query.user_id == current_user.id
-        ).first()
+        query = await db.scalar(
+            select(models.Query).options(
+                undefer(models.Query.kml_content),
+                undefer(models.Query.geometry_wkb),
+                undefer(models.Query.processing_profile)
+            ).where(
+                models.Query.id == query_id,
+                models.Query.user_id == current_user.id
+            )
+        )
         
         if not query:
             raise HTTPException(status_code=404, detail="Query not found")
@@ -499,34 +1005,86 @@ async def process_query_with_wms(
         if not query.kml_content:
             raise HTTPException(status_code=400, detail="Query does not contain KML content")
         
-        # Procesar: parsear KML, descargar WMS, calcular afecciones
-        resultados = procesar_consulta_catastral(query.kml_content, query.referencia_catastral)
+        # Misma parcela y capas ya procesadas (por cualquier usuario): reutilizar
+        geometry_hash, shared = await _find_shared_wms(db, query)
+        progress = ProgressTracker(pipeline="wms")
         
-        # Actualizar query con resultados
-        query.has_wms_maps = True
-        query.wms_affection_data = json.dumps(resultados.get('capas', {}), default=str, ensure_ascii=False)
+        if shared is not None:
+            resultados = _cached_run(shared, _shared_wms_resultados(query, shared))(progress)
+        else:
+            # Procesar: parsear KML, descargar WMS, calcular afecciones
+            resultados = await run_in_threadpool(
+                procesar_consulta_catastral, query.kml_content, query.referencia_catastral,
+                progress=progress, geometry=load_geometry(query.geometry_wkb)
+            )
         
-        db.commit()
-        db.refresh(query)
-        
-        return {
-            "status": "success",
-            "query_id": query.id,
-            "referencia": query.referencia_catastral,
-            "capas_procesadas": list(resultados.get('capas', {}).keys()),
-            "has_wms_maps": True
-        }
+        # Actualizar query con resultados (y su perfil de procesamiento)
+        return await _save_results(
+            db, query, resultados,
+            lambda db, query, resultados: _apply_wms_results(db, query, resultados, geometry_hash, shared),
+            progress
+        )
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing WMS: {str(e)}")
 
 
-@router.post("/query/{query_id}/process-urbanismo")
+@router.post("/query/{query_id}/process-wms/stream", dependencies=[Depends(require_scope(SCOPE_PROCESSING)), Depends(rate_limit(BUCKET_HEAVY))])
+async def stream_query_with_wms(
+    query_id: str,
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Igual que process-wms, pero devuelve el progreso como Server-Sent Events:
+    parse, map_rendered / fetch_layer / affection por capa, layer_done con el
+    resultado parcial de cada capa, saved y done (mismo resumen que process-wms).
+    Con un resultado compartido vigente solo se emite cache_hit antes de saved.
+    """
+    from services.wms_service import procesar_consulta_catastral
+    
+    query = await db.scalar(
+        select(models.Query).options(
+            undefer(models.Query.kml_content), undefer(models.Query.geometry_wkb)
+        ).where(
+            models.Query.id == query_id,
+            models.Query.user_id == current_user.id
+        )
+    )
+    
+    if not query:
+        raise HTTPException(status_code=404, detail="Query not found")
+    
+    if not query.kml_content:
+        raise HTTPException(status_code=400, detail="Query does not contain KML content")
+    
+    kml_content, referencia, geometry_wkb = query.kml_content, query.referencia_catastral, query.geometry_wkb
+    geometry_hash, shared = await _find_shared_wms(db, query)
+    
+    if shared is not None:
+        run = _cached_run(shared, _shared_wms_resultados(query, shared))
+    else:
+        run = lambda progress: procesar_consulta_catastral(
+            kml_content, referencia, progress=progress, geometry=load_geometry(geometry_wkb)
+        )
+    
+    # El hueco de trabajo pesado lo libera la tarea de procesamiento al terminar
+    release = heavy_gate.admit()
+    return _sse_response(_stream_pipeline(
+        "wms",
+        query.id,
+        run,
+        lambda db, query, resultados: _apply_wms_results(db, query, resultados, geometry_hash, shared),
+        release
+    ))
+
+
+@router.post("/query/{query_id}/process-urbanismo", dependencies=[Depends(require_scope(SCOPE_PROCESSING)), *HEAVY_DEPENDENCIES])
 async def process_query_with_urbanismo(
     query_id: str,
-    current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Procesa una consulta existente: obtiene GeoJSON, descarga datos WFS de planeamiento urbano,
@@ -536,10 +1094,16 @@ async def process_query_with_urbanismo(
     try:
         from services.urbanismo_service import procesar_consulta_urbanismo
         
-        query = db.query(models.Query).filter(
-            models.Query.id == query_id,
-            models.Query.user_id == current_user.id
-        ).first()
+        query = await db.scalar(
+            select(models.Query).options(
+                undefer(models.Query.geojson_content),
+                undefer(models.Query.geometry_wkb),
+                undefer(models.Query.processing_profile)
+            ).where(
+                models.Query.id == query_id,
+                models.Query.user_id == current_user.id
+            )
+        )
         
         if not query:
             raise HTTPException(status_code=404, detail="Query not found")
@@ -547,36 +1111,78 @@ async def process_query_with_urbanismo(
         if not query.geojson_content:
             raise HTTPException(status_code=400, detail="Query does not contain GeoJSON content")
         
-        # Procesar: parsear GeoJSON, descargar WFS, calcular intersecciones
-        resultados = procesar_consulta_urbanismo(
-            query.geojson_content,
-            query.referencia_catastral
-        )
-        
-        # Actualizar query con resultados
-        query.has_urbanismo = True
-        
-        # Guardar datos de planeamiento (porcentajes y áreas)
-        urbanismo_resumen = {
-            "area_total_m2": resultados.get("area_total_m2", 0),
-            "porcentajes": resultados.get("porcentajes", {}),
-            "errores": {k: v for k, v in resultados.items() if k.endswith("_error")}
-        }
-        query.urbanismo_data = json.dumps(urbanismo_resumen, default=str, ensure_ascii=False)
+        # Misma parcela y capas ya procesadas (por cualquier usuario): reutilizar
+        geometry_hash, shared = await _find_shared_urbanismo(db, query)
+        progress = ProgressTracker(pipeline="urbanismo")
         
-        db.commit()
-        db.refresh(query)
+        if shared is not None:
+            resultados = _cached_run(shared, _shared_urbanismo_resultados(query, shared))(progress)
+        else:
+            # Procesar: parsear GeoJSON, descargar WFS, calcular intersecciones
+            resultados = await run_in_threadpool(
+                procesar_consulta_urbanismo,
+                query.geojson_content,
+                query.referencia_catastral,
+                progress=progress,
+                geometry=load_geometry(query.geometry_wkb)
+            )
         
-        return {
-            "status": "success",
-            "query_id": query.id,
-            "referencia": query.referencia_catastral,
-            "area_total_m2": resultados.get("area_total_m2"),
-            "clases_suelo_encontradas": len(resultados.get("porcentajes", [])),
-            "has_urbanismo": True
-        }
+        # Actualizar query con resultados (y su perfil de procesamiento)
+        return await _save_results(
+            db, query, resultados,
+            lambda db, query, resultados: _apply_urbanismo_results(db, query, resultados, geometry_hash, shared),
+            progress
+        )
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing urbanismo: {str(e)}")
 
+
+@router.post("/query/{query_id}/process-urbanismo/stream", dependencies=[Depends(require_scope(SCOPE_PROCESSING)), Depends(rate_limit(BUCKET_HEAVY))])
+async def stream_query_with_urbanismo(
+    query_id: str,
+    current_user: UserSnapshot = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Igual que process-urbanismo, pero devuelve el progreso como Server-Sent Events.
+    El evento layer_done de planeamiento_wfs trae los porcentajes antes de que
+    terminen de descargarse la ortofoto y los mapas.
+    """
+    from services.urbanismo_service import procesar_consulta_urbanismo
+    
+    query = await db.scalar(
+        select(models.Query).options(
+            undefer(models.Query.geojson_content), undefer(models.Query.geometry_wkb)
+        ).where(
+            models.Query.id == query_id,
+            models.Query.user_id == current_user.id
+        )
+    )
+    
+    if not query:
+        raise HTTPException(status_code=404, detail="Query not found")
+    
+    if not query.geojson_content:
+        raise HTTPException(status_code=400, detail="Query does not contain GeoJSON content")
+    
+    geojson_content, referencia, geometry_wkb = query.geojson_content, query.referencia_catastral, query.geometry_wkb
+    geometry_hash, shared = await _find_shared_urbanismo(db, query)
+    
+    if shared is not None:
+        run = _cached_run(shared, _shared_urbanismo_resultados(query, shared))
+    else:
+        run = lambda progress: procesar_consulta_urbanismo(
+            geojson_content, referencia, progress=progress, geometry=load_geometry(geometry_wkb)
+        )
+    
+    # El hueco de trabajo pesado lo libera la tarea de procesamiento al terminar
+    release = heavy_gate.admit()
+    return _sse_response(_stream_pipeline(
+        "urbanismo",
+        query.id,
+        run,
+        lambda db, query, resultados: _apply_urbanismo_results(db, query, resultados, geometry_hash, shared),
+        release
+    ))
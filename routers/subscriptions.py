@@ -1,13 +1,18 @@
 """
 Router de suscripciones
 """
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
-from typing import List
+from typing import List, Optional
+import uuid
 
-from database import get_db
-from auth.dependencies import get_current_active_user
+from database import get_async_db
+from auth.dependencies import require_session
+from auth.identity import UserSnapshot, invalidate_user
+from services.response_cache import cached_response
+from services.stripe_event_service import notify_consumer, store_event
 from services.stripe_service import stripe_service
 import models
 import schemas
@@ -17,8 +22,13 @@ router = APIRouter(prefix="/api/subscriptions", tags=["Subscriptions"])
 
 
 @router.get("/plans", response_model=List[schemas.PlanInfo])
+@cached_response(max_age=300, ttl_seconds=300)
 async def get_plans():
-    """Obtener planes disponibles"""
+    """
+    Obtener planes disponibles.
+    Respuesta cacheada (ETag, 304); se regenera al cambiar los settings o cada
+    5 minutos (los Price ID vienen de la caché de precios de Stripe).
+    """
     plans = [
         schemas.PlanInfo(
             name="Free",
@@ -42,7 +52,7 @@ async def get_plans():
                 "Informes PDF completos",
                 "Soporte prioritario"
             ],
-            stripe_price_id=stripe_service.get_price_id_for_plan(models.PlanType.PRO)
+            stripe_price_id=await stripe_service.get_price_id_for_plan(models.PlanType.PRO)
         ),
         schemas.PlanInfo(
             name="Enterprise",
@@ -56,7 +66,7 @@ async def get_plans():
                 "Soporte dedicado",
                 "SLA garantizado"
             ],
-            stripe_price_id=stripe_service.get_price_id_for_plan(models.PlanType.ENTERPRISE)
+            stripe_price_id=await stripe_service.get_price_id_for_plan(models.PlanType.ENTERPRISE)
         )
     ]
     return plans
@@ -65,42 +75,52 @@ async def get_plans():
 @router.post("/create", response_model=schemas.SubscriptionResponse)
 async def create_subscription(
     subscription_data: schemas.SubscriptionCreate,
-    current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(require_session),
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    """Crear o actualizar suscripción"""
+    """
+    Crear o actualizar suscripción.
+    Idempotency-Key (opcional): al reintentar la petición con la misma clave
+    Stripe devuelve la suscripción ya creada en lugar de crear otra.
+    """
     
     # Verificar que no sea plan gratuito
     if subscription_data.plan_type == models.PlanType.FREE:
         raise HTTPException(status_code=400, detail="Cannot create free subscription")
     
     # Obtener suscripción actual
-    subscription = db.query(models.Subscription).filter(
-        models.Subscription.user_id == current_user.id
-    ).first()
+    subscription = await db.scalar(
+        select(models.Subscription).where(models.Subscription.user_id == current_user.id)
+    )
     
     if not subscription:
         raise HTTPException(status_code=404, detail="Subscription not found")
     
     # Crear cliente en Stripe si no existe
+    # (clave de idempotencia por usuario: un reintento no duplica el cliente;
+    # se guarda ya para no perderlo si falla la suscripción)
     if not subscription.stripe_customer_id:
-        stripe_customer_id = stripe_service.create_customer(
+        stripe_customer_id = await stripe_service.create_customer(
             email=current_user.email,
-            name=current_user.full_name
+            name=current_user.full_name,
+            idempotency_key=f"customer-{current_user.id}"
         )
         subscription.stripe_customer_id = stripe_customer_id
+        await db.commit()
     
-    # Obtener Price ID de Stripe
-    price_id = stripe_service.get_price_id_for_plan(subscription_data.plan_type)
+    # Obtener Price ID de Stripe (cacheado)
+    price_id = await stripe_service.get_price_id_for_plan(subscription_data.plan_type)
     if not price_id:
         raise HTTPException(status_code=400, detail="Invalid plan type")
     
     # Crear suscripción en Stripe
     try:
-        stripe_subscription = stripe_service.create_subscription(
+        stripe_subscription = await stripe_service.create_subscription(
             customer_id=subscription.stripe_customer_id,
             price_id=price_id,
-            payment_method_id=subscription_data.payment_method_id
+            payment_method_id=subscription_data.payment_method_id,
+            idempotency_key=f"subscription-{current_user.id}-{idempotency_key or uuid.uuid4()}"
         )
         
         # Actualizar en BD
@@ -123,8 +143,9 @@ async def create_subscription(
             stripe_subscription.current_period_end
         )
         
-        db.commit()
-        db.refresh(subscription)
+        await db.commit()
+        await db.refresh(subscription)
+        invalidate_user(current_user.id)
         
         return subscription
     
@@ -134,27 +155,28 @@ async def create_subscription(
 
 @router.post("/cancel")
 async def cancel_subscription(
-    current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(require_session),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Cancelar suscripción"""
     
-    subscription = db.query(models.Subscription).filter(
-        models.Subscription.user_id == current_user.id
-    ).first()
+    subscription = await db.scalar(
+        select(models.Subscription).where(models.Subscription.user_id == current_user.id)
+    )
     
     if not subscription or not subscription.stripe_subscription_id:
         raise HTTPException(status_code=404, detail="No active subscription found")
     
     try:
         # Cancelar en Stripe
-        stripe_service.cancel_subscription(subscription.stripe_subscription_id)
+        await stripe_service.cancel_subscription(subscription.stripe_subscription_id)
         
         # Actualizar en BD
         subscription.status = models.SubscriptionStatus.CANCELLED
         subscription.cancelled_at = datetime.utcnow()
         
-        db.commit()
+        await db.commit()
+        invalidate_user(current_user.id)
         
         return {"message": "Subscription cancelled successfully"}
     
@@ -163,43 +185,22 @@ async def cancel_subscription(
 
 
 @router.post("/webhook")
-async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
-    """Webhook de Stripe para eventos de suscripción"""
+async def stripe_webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Webhook de Stripe para eventos de suscripción.
+    Solo verifica la firma y guarda el evento en la bandeja (los reintentos de
+    Stripe se descartan por id); el consumidor en segundo plano lo aplica.
+    """
     
     payload = await request.body()
     sig_header = request.headers.get("stripe-signature")
     
     try:
-        event = stripe_service.construct_webhook_event(payload, sig_header)
+        stripe_service.construct_webhook_event(payload, sig_header)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
-    # Manejar eventos
-    if event.type == "customer.subscription.updated":
-        subscription_data = event.data.object
-        
-        # Buscar suscripción en BD
-        subscription = db.query(models.Subscription).filter(
-            models.Subscription.stripe_subscription_id == subscription_data.id
-        ).first()
-        
-        if subscription:
-            # Actualizar estado
-            subscription.status = models.SubscriptionStatus(subscription_data.status)
-            subscription.current_period_end = datetime.fromtimestamp(
-                subscription_data.current_period_end
-            )
-            db.commit()
-    
-    elif event.type == "customer.subscription.deleted":
-        subscription_data = event.data.object
-        
-        subscription = db.query(models.Subscription).filter(
-            models.Subscription.stripe_subscription_id == subscription_data.id
-        ).first()
-        
-        if subscription:
-            subscription.status = models.SubscriptionStatus.CANCELLED
-            db.commit()
+    if await store_event(db, payload):
+        notify_consumer()
     
     return {"status": "success"}
@@ -1,12 +1,25 @@
 """
 Schemas de Pydantic para validación
 """
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from typing import Optional
 from datetime import datetime
+import re
 from models import PlanType, SubscriptionStatus
 
 
+# Referencia catastral: 14 caracteres (parcela) o 20 (inmueble)
+REFERENCIA_CATASTRAL_RE = re.compile(r"[0-9A-Z]{14}([0-9A-Z]{6})?")
+
+
+def normalize_referencia_catastral(value: str) -> str:
+    """Referencia sin espacios y en mayúsculas. Lanza ValueError si no es válida."""
+    referencia = value.strip().upper()
+    if not REFERENCIA_CATASTRAL_RE.fullmatch(referencia):
+        raise ValueError("Invalid referencia_catastral (expected 14 or 20 alphanumeric characters)")
+    return referencia
+
+
 # User Schemas
 class UserBase(BaseModel):
     email: EmailStr
@@ -46,6 +59,25 @@ class TokenData(BaseModel):
     email: Optional[str] = None
 
 
+# API Key Schemas
+class ApiKeyCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    scopes: Optional[list[str]] = None  # Por defecto, todos los scopes de clave
+
+
+class ApiKeyResponse(BaseModel):
+    id: str
+    name: str
+    prefix: str
+    scopes: list[str]
+    created_at: datetime
+    revoked_at: Optional[datetime] = None
+
+
+class ApiKeyCreated(ApiKeyResponse):
+    key: str  # Solo se devuelve al crearla
+
+
 # Subscription Schemas
 class SubscriptionBase(BaseModel):
     plan_type: PlanType
@@ -68,12 +100,38 @@ class SubscriptionCreate(BaseModel):
 
 
 # Query Schemas
-class QueryCreate(BaseModel):
+class QueryContent(BaseModel):
     referencia_catastral: str
     kml_content: Optional[str] = None  # KML en formato string o base64
     geojson_content: Optional[str] = None  # GeoJSON para análisis urbano
 
 
+class QueryCreate(QueryContent):
+    @field_validator("referencia_catastral")
+    @classmethod
+    def _normalize_referencia(cls, value: str) -> str:
+        return normalize_referencia_catastral(value)
+
+
+class BulkQueryCreate(BaseModel):
+    # Sin validar la referencia aquí: los items inválidos se devuelven con su
+    # error (normalize_referencia_catastral) en lugar de rechazar el lote
+    items: list[QueryContent] = Field(..., min_length=1)
+
+
+class BulkQueryItemResult(BaseModel):
+    index: int  # Posición del item en la petición
+    referencia_catastral: str
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BulkQueryResponse(BaseModel):
+    created: int
+    failed: int
+    results: list[BulkQueryItemResult]
+
+
 class QueryResponse(BaseModel):
     id: str
     referencia_catastral: str
@@ -101,6 +159,39 @@ class PaymentResponse(BaseModel):
         from_attributes = True
 
 
+# Admin Schemas
+class PercentileSummary(BaseModel):
+    count: int
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+
+class StageProfileStats(BaseModel):
+    stage: str
+    layer: Optional[str] = None
+    duration_ms: PercentileSummary
+    bytes: Optional[PercentileSummary] = None
+    errors: int
+
+
+class UpstreamProfileStats(BaseModel):
+    host: str
+    duration_ms: PercentileSummary
+    bytes: Optional[PercentileSummary] = None
+    errors: int  # Resultado distinto de 2xx
+
+
+class ProcessingProfileReport(BaseModel):
+    pipeline: str
+    queries: int  # Consultas con perfil de este pipeline en la muestra
+    cached: int  # De ellas, servidas desde un resultado compartido
+    total_ms: Optional[PercentileSummary] = None
+    stages: list[StageProfileStats]
+    upstream: list[UpstreamProfileStats]
+
+
 # Plan Schemas
 class PlanInfo(BaseModel):
     name: str
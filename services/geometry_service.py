@@ -0,0 +1,214 @@
+"""
+Servicio de geometrías
+Geometría normalizada de las consultas: se parsea una vez al crear la consulta
+(KML o GeoJSON) y se guarda en EPSG:25830 como WKB junto con su bbox, área,
+número de vértices y huella. Los servicios de procesamiento y la exportación
+usan esa forma almacenada en lugar de volver a parsear el texto.
+
+Rellenar la geometría de consultas antiguas:
+    python -m services.geometry_service
+
+(los workers en marcha releen su índice espacial en memoria en la siguiente
+sincronización completa, cada SPATIAL_INDEX_RESYNC_SECONDS)
+"""
+import asyncio
+import hashlib
+import json
+from functools import lru_cache
+import numpy as np
+import shapely
+from pyproj import Transformer
+from shapely.geometry import MultiPolygon, Polygon, shape
+from shapely.ops import unary_union
+
+
+# CRS de almacenamiento: UTM 30N (metros), el mismo de los cálculos de área
+STORED_EPSG = 25830
+
+# Rejilla de redondeo en metros: 1 cm
+GEOMETRY_GRID_SIZE = 0.01
+
+# Distancia máxima (Hausdorff, metros) entre el KML y el GeoJSON de una misma
+# consulta para considerarlos la misma parcela (redondeos de cada formato)
+GEOMETRY_MATCH_TOLERANCE = 0.5
+
+
+# ============================================
+# LECTURA DE GEOMETRÍAS (EPSG:4326)
+# ============================================
+def geometry_from_kml(kml_content):
+    """
+    Geometría Shapely (lon/lat) de los polígonos de un KML.
+    Lanza ValueError si el KML no es válido; None si no tiene polígonos.
+    """
+    from services.wms_service import parse_kml_polygons, polygons_to_shapely
+
+    return polygons_to_shapely(parse_kml_polygons(kml_content))
+
+
+def geometry_from_geojson(geojson_content):
+    """
+    Geometría Shapely (lon/lat) con la unión de las features de un GeoJSON
+    (texto o dict ya cargado). None si no tiene geometrías.
+    """
+    if isinstance(geojson_content, str):
+        geojson_content = json.loads(geojson_content)
+
+    geoms = [
+        shape(feature["geometry"])
+        for feature in geojson_content.get("features", [])
+        if feature.get("geometry")
+    ]
+    return unary_union(geoms) if geoms else None
+
+
+# ============================================
+# PROYECCIÓN Y NORMALIZACIÓN
+# ============================================
+@lru_cache(maxsize=None)
+def _transformer(src_epsg, dst_epsg):
+    """Transformer reutilizable (crearlo es mucho más caro que usarlo)"""
+    return Transformer.from_crs(src_epsg, dst_epsg, always_xy=True)
+
+
+def project(geom, src_epsg=4326, dst_epsg=STORED_EPSG):
+    """Reproyecta una geometría Shapely (coordenadas x/y, lon/lat en 4326)."""
+    transformer = _transformer(src_epsg, dst_epsg)
+    return shapely.transform(geom, lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])))
+
+
+def to_wgs84(geom):
+    """Geometría almacenada (EPSG:25830) en lon/lat (EPSG:4326)."""
+    return project(geom, STORED_EPSG, 4326)
+
+
+def normalize_geometry(geom):
+    """
+    Forma canónica en EPSG:25830: coordenadas ajustadas a la rejilla, anillos y
+    partes en orden normalizado, siempre MultiPolygon. Dos parcelas iguales
+    digitalizadas con otro punto de inicio, otro orden de polígonos o en otro
+    formato (KML, GeoJSON) quedan idénticas.
+    """
+    geom = shapely.set_precision(project(geom), GEOMETRY_GRID_SIZE)
+    if isinstance(geom, Polygon):
+        geom = MultiPolygon([geom])
+    return shapely.normalize(geom)
+
+
+def geometry_hash(geometry_wkb):
+    """Huella (SHA-256 hex) del WKB normalizado."""
+    return hashlib.sha256(geometry_wkb).hexdigest()
+
+
+def geometry_fields(geom):
+    """
+    Columnas de geometría de Query para una geometría en lon/lat.
+    Devuelve {} si no hay geometría.
+    """
+    if geom is None or geom.is_empty:
+        return {}
+
+    normalized = normalize_geometry(geom)
+    geometry_wkb = shapely.to_wkb(normalized)
+    minx, miny, maxx, maxy = normalized.bounds
+    return {
+        "geometry_wkb": geometry_wkb,
+        "bbox_minx": minx,
+        "bbox_miny": miny,
+        "bbox_maxx": maxx,
+        "bbox_maxy": maxy,
+        "area_m2": normalized.area,
+        "vertex_count": int(shapely.get_num_coordinates(normalized)),
+        "geometry_hash": geometry_hash(geometry_wkb)
+    }
+
+
+def query_geometry_fields(kml_geom=None, geojson_geom=None):
+    """
+    Columnas de geometría de una consulta con KML, GeoJSON o ambos (lon/lat).
+
+    WMS procesa la parcela del KML y urbanismo la del GeoJSON, y los dos usan la
+    geometría almacenada: con ambos formatos solo se guarda si describen la
+    misma parcela (a menos de GEOMETRY_MATCH_TOLERANCE). Si no, la consulta se
+    queda sin geometría y cada procesamiento parsea su propio texto.
+    """
+    geoms = [g for g in (kml_geom, geojson_geom) if g is not None and not g.is_empty]
+    if not geoms:
+        return {}
+    if len(geoms) == 2:
+        kml_normalized, geojson_normalized = (normalize_geometry(g) for g in geoms)
+        if kml_normalized.hausdorff_distance(geojson_normalized) > GEOMETRY_MATCH_TOLERANCE:
+            return {}
+    return geometry_fields(geoms[0])
+
+
+def content_geometry_fields(kml_content=None, geojson_content=None):
+    """
+    Columnas de geometría a partir del texto de la consulta (ver
+    query_geometry_fields). Para altas sin validación previa: un contenido
+    ilegible deja la consulta sin geometría en lugar de fallar.
+    """
+    try:
+        return query_geometry_fields(
+            geometry_from_kml(kml_content) if kml_content else None,
+            geometry_from_geojson(geojson_content) if geojson_content else None
+        )
+    except Exception:
+        return {}
+
+
+def load_geometry(geometry_wkb):
+    """Geometría almacenada (EPSG:25830) desde su WKB, o None."""
+    return shapely.from_wkb(geometry_wkb) if geometry_wkb else None
+
+
+# ============================================
+# RELLENO DE CONSULTAS ANTIGUAS
+# ============================================
+async def backfill_query_geometries(db, batch_size=500) -> int:
+    """
+    Calcula la geometría de las consultas que no la tienen y descarta el índice
+    espacial en memoria de sus usuarios en este proceso. Devuelve las actualizadas.
+    """
+    from sqlalchemy import select, update
+    from services.spatial_index_service import invalidate_user_index
+    import models
+
+    updated = 0
+    users = set()
+    last_id = ""
+    while True:
+        rows = (await db.execute(
+            select(models.Query.id, models.Query.user_id, models.Query.kml_content, models.Query.geojson_content)
+            .where(models.Query.geometry_wkb.is_(None), models.Query.id > last_id)
+            .order_by(models.Query.id)
+            .limit(batch_size)
+        )).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        for row in rows:
+            fields = content_geometry_fields(row.kml_content, row.geojson_content)
+            if fields:
+                await db.execute(update(models.Query).where(models.Query.id == row.id).values(**fields))
+                users.add(row.user_id)
+                updated += 1
+        await db.commit()
+
+    for user_id in users:
+        invalidate_user_index(user_id)
+    return updated
+
+
+async def _main():
+    from database import AsyncSessionLocal, async_engine
+
+    async with AsyncSessionLocal() as db:
+        rows = await backfill_query_geometries(db)
+    await async_engine.dispose()
+    print(f"Geometrías calculadas: {rows}")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
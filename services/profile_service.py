@@ -0,0 +1,85 @@
+"""
+Servicio de perfiles de procesamiento
+Cada consulta guarda en processing_profile el perfil de su último
+procesamiento por pipeline (ver ProgressTracker.profile). Aquí se combinan
+con lo ya guardado y se agregan en percentiles para /api/admin.
+"""
+import json
+import math
+from collections import defaultdict
+from typing import Iterable, Optional
+
+
+def merge_profile(current: Optional[str], profile: dict) -> str:
+    """JSON de processing_profile con el perfil del pipeline sustituido"""
+    profiles = json.loads(current) if current else {}
+    profiles[profile["pipeline"]] = profile
+    return json.dumps(profiles, default=str, ensure_ascii=False)
+
+
+def _percentiles(values) -> Optional[dict]:
+    """Percentiles por rango más cercano (None si no hay valores)"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+
+    def rank(q):
+        return values[max(0, math.ceil(q * len(values)) - 1)]
+
+    return {"count": len(values), "p50": rank(0.50), "p90": rank(0.90), "p99": rank(0.99), "max": values[-1]}
+
+
+def summarize_profiles(rows: Iterable[Optional[str]], pipeline: str) -> dict:
+    """
+    Agrega los perfiles de un pipeline: duración total, cada etapa (por capa)
+    y cada host externo, con p50/p90/p99/máx de tiempos y bytes.
+    """
+    totals = []
+    cached = 0
+    stages = defaultdict(lambda: {"duration_ms": [], "bytes": [], "errors": 0})
+    upstream = defaultdict(lambda: {"duration_ms": [], "bytes": [], "errors": 0})
+
+    for row in rows:
+        profile = json.loads(row).get(pipeline) if row else None
+        if profile is None:
+            continue
+        totals.append(profile["total_ms"])
+        cached += bool(profile.get("cached"))
+
+        for stage in profile.get("stages", []):
+            entry = stages[(stage["stage"], stage.get("layer"))]
+            entry["duration_ms"].append(stage["duration_ms"])
+            entry["bytes"].append(stage.get("bytes"))
+            entry["errors"] += "error" in stage
+
+        for request in profile.get("upstream", []):
+            entry = upstream[request["host"]]
+            entry["duration_ms"].append(request["duration_ms"])
+            entry["bytes"].append(request.get("bytes"))
+            entry["errors"] += request["outcome"] != "2xx"
+
+    return {
+        "pipeline": pipeline,
+        "queries": len(totals),
+        "cached": cached,
+        "total_ms": _percentiles(totals),
+        "stages": [
+            {
+                "stage": stage,
+                "layer": layer,
+                "duration_ms": _percentiles(entry["duration_ms"]),
+                "bytes": _percentiles(entry["bytes"]),
+                "errors": entry["errors"]
+            }
+            for (stage, layer), entry in stages.items()
+        ],
+        "upstream": [
+            {
+                "host": host,
+                "duration_ms": _percentiles(entry["duration_ms"]),
+                "bytes": _percentiles(entry["bytes"]),
+                "errors": entry["errors"]
+            }
+            for host, entry in sorted(upstream.items())
+        ]
+    }
@@ -0,0 +1,115 @@
+"""
+Seguimiento de progreso de los pipelines de procesamiento
+Eventos por etapa (parseo, descargas, afecciones, mapas) con tiempos, para
+notificar al cliente (SSE) mientras la consulta se procesa, y perfil
+persistible de cada ejecución (etapas, bytes y peticiones externas)
+"""
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from metrics import STAGE_SECONDS
+
+
+# Campos de un evento que se guardan en el perfil (sin resultados parciales)
+PROFILE_FIELDS = ("stage", "layer", "duration_ms", "bytes", "features", "polygons", "error")
+
+# Etapa en curso en este hilo: (tracker, etapa, capa). Las peticiones externas
+# (metrics.track_upstream) se anotan en ella.
+_active_stage = ContextVar("active_stage", default=None)
+
+
+def record_upstream(host, duration, outcome, nbytes=None):
+    """Anota una petición a un servicio externo en la etapa en curso (si la hay)"""
+    active = _active_stage.get()
+    if active is None:
+        return
+    tracker, stage, layer = active
+    tracker.requests.append({
+        "host": host,
+        "stage": stage,
+        "layer": layer,
+        "outcome": outcome,
+        "bytes": nbytes,
+        "duration_ms": round(duration * 1000, 1)
+    })
+
+
+class ProgressTracker:
+    """
+    Registra las etapas de un pipeline y notifica cada evento a un callback.
+    Cada evento es un dict con "stage", "elapsed_ms" (desde el inicio) y los
+    datos propios de la etapa; las etapas cronometradas añaden "duration_ms".
+    Las etapas cronometradas se registran también en las métricas, por
+    pipeline (lo fija el propio pipeline al empezar), etapa y capa.
+    """
+
+    def __init__(self, callback=None, pipeline=None):
+        self.callback = callback
+        self.pipeline = pipeline
+        self.started = time.perf_counter()
+        self.events = []
+        self.requests = []  # Peticiones externas (ver record_upstream)
+
+    def emit(self, stage, **data):
+        """Registra un evento y lo envía al callback (si existe)."""
+        event = {
+            "stage": stage,
+            "elapsed_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            **data
+        }
+        self.events.append(event)
+        if self.callback is not None:
+            try:
+                self.callback(event)
+            except Exception:
+                # Un consumidor caído no debe romper el procesamiento
+                pass
+        return event
+
+    @contextmanager
+    def stage(self, stage, **data):
+        """
+        Cronometra un bloque y emite el evento al terminar.
+        El bloque puede añadir resultados parciales al dict devuelto.
+        """
+        info = dict(data)
+        t0 = time.perf_counter()
+        token = _active_stage.set((self, stage, data.get("layer")))
+        try:
+            yield info
+        except Exception as e:
+            info["error"] = str(e)
+            raise
+        finally:
+            _active_stage.reset(token)
+            duration = time.perf_counter() - t0
+            info["duration_ms"] = round(duration * 1000, 1)
+            STAGE_SECONDS.observe(duration, pipeline=self.pipeline or "", stage=stage, layer=data.get("layer", ""))
+            self.emit(stage, **info)
+
+    def profile(self):
+        """
+        Perfil de la ejecución para guardar con la consulta: duración total,
+        etapas cronometradas (capa, bytes, error) y peticiones externas.
+        """
+        return {
+            "pipeline": self.pipeline,
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "cached": any(event["stage"] == "cache_hit" for event in self.events),
+            "stages": [
+                {field: event[field] for field in PROFILE_FIELDS if field in event}
+                for event in self.events
+                if "duration_ms" in event
+            ],
+            "upstream": list(self.requests)
+        }
+
+
+def format_sse(event, name=None):
+    """Serializa un evento en formato Server-Sent Events."""
+    name = name or event.get("stage", "message")
+    payload = json.dumps(event, default=str, ensure_ascii=False)
+    return f"event: {name}\ndata: {payload}\n\n"
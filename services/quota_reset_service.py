@@ -0,0 +1,188 @@
+"""
+Servicio de renovación mensual de cuota
+Las suscripciones activas cuyo periodo ha terminado (current_period_end < now)
+avanzan un mes y vuelven a queries_used = 0. Todo en SQL, por lotes:
+
+    UPDATE subscriptions
+       SET queries_used = 0,
+           current_period_start = current_period_end,
+           current_period_end = current_period_end + interval '1 month'
+     WHERE id IN (SELECT id FROM subscriptions
+                   WHERE status = 'active' AND current_period_end < now()
+                   LIMIT :chunk FOR UPDATE SKIP LOCKED)
+    RETURNING user_id
+
+Las suscripciones sin periodo (gratuitas anteriores a este servicio) reciben
+uno que empieza ahora. Un periodo atrasado varios meses avanza un mes por
+pasada hasta alcanzar la fecha actual.
+
+El planificador corre en cada worker, pero con PostgreSQL solo ejecuta la
+renovación quien obtiene el advisory lock; el resto se salta esa pasada.
+El lock es de sesión (hay un commit por lote, pg_try_advisory_xact_lock se
+soltaría en el primero): si la pasada falla se hace rollback antes del
+unlock y, si ni así se libera, la conexión se descarta del pool para que
+el lock no sobreviva en ella.
+
+Ejecutar manualmente:
+    python -m services.quota_reset_service
+"""
+import asyncio
+import calendar
+import logging
+import time
+from datetime import datetime, timezone
+from sqlalchemy import func, literal_column, select, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from auth.identity import invalidate_user
+from config import settings
+from metrics import QUOTA_RESET_LAST_RUN, QUOTA_RESET_ROWS
+import models
+
+
+logger = logging.getLogger(__name__)
+
+# Suscripciones por UPDATE (y por transacción)
+RESET_CHUNK = 1000
+
+# Clave del advisory lock de PostgreSQL (constante arbitraria de la aplicación)
+QUOTA_RESET_LOCK_KEY = 0x51_0A_2E_5E
+
+# Resultado de la última ejecución en este worker
+last_run = {
+    "started_at": None,
+    "duration_seconds": None,
+    "rows_reset": 0,
+    "periods_initialized": 0,
+    "skipped_locked": False
+}
+
+
+def add_month(dt: datetime) -> datetime:
+    """Mismo día del mes siguiente (o el último día si no existe)"""
+    year, month = (dt.year + 1, 1) if dt.month == 12 else (dt.year, dt.month + 1)
+    return dt.replace(year=year, month=month, day=min(dt.day, calendar.monthrange(year, month)[1]))
+
+
+def _plus_one_month(conn: AsyncConnection, value):
+    """Expresión SQL value + 1 mes en el dialecto en uso"""
+    if conn.dialect.name == "sqlite":
+        return func.datetime(value, "+1 month")
+    return value + literal_column("interval '1 month'")
+
+
+async def _update_in_chunks(conn: AsyncConnection, where, values) -> int:
+    """
+    UPDATE por lotes de RESET_CHUNK (commit por lote) hasta que no quede
+    ninguna fila. Devuelve cuántas suscripciones distintas han cambiado.
+    """
+    s = models.Subscription
+    changed = set()
+    while True:
+        ids = (
+            select(s.id)
+            .where(*where)
+            .limit(RESET_CHUNK)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        user_ids = (await conn.execute(
+            update(s).where(s.id.in_(ids)).values(**values).returning(s.user_id)
+        )).scalars().all()
+        await conn.commit()
+
+        for user_id in user_ids:
+            invalidate_user(user_id)
+        changed.update(user_ids)
+        if not user_ids:
+            return len(changed)
+
+
+async def _reset(conn: AsyncConnection):
+    s = models.Subscription
+    active = s.status == models.SubscriptionStatus.ACTIVE
+
+    last_run["periods_initialized"] = await _update_in_chunks(
+        conn,
+        [active, s.current_period_end.is_(None)],
+        {"current_period_start": func.now(), "current_period_end": _plus_one_month(conn, func.now())}
+    )
+    last_run["rows_reset"] = await _update_in_chunks(
+        conn,
+        [active, s.current_period_end < func.now()],
+        {
+            "queries_used": 0,
+            "current_period_start": s.current_period_end,
+            "current_period_end": _plus_one_month(conn, s.current_period_end)
+        }
+    )
+
+
+async def _release_lock(conn: AsyncConnection):
+    """
+    Suelta el advisory lock de sesión. La transacción puede haber quedado
+    abortada por un error de _reset, así que primero rollback; si el unlock
+    falla igualmente, se invalida la conexión (al cerrarse la sesión en
+    PostgreSQL el lock se libera) en lugar de devolverla al pool con él.
+    """
+    try:
+        await conn.rollback()
+        await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": QUOTA_RESET_LOCK_KEY})
+        await conn.commit()
+    except Exception:
+        logger.exception("No se pudo liberar el advisory lock de renovación; se descarta la conexión")
+        await conn.invalidate()
+
+
+async def reset_expired_periods(engine: AsyncEngine) -> bool:
+    """
+    Renueva los periodos vencidos. Devuelve False si otro worker tiene el
+    advisory lock (no se hace nada).
+    """
+    started = time.monotonic()
+    last_run["started_at"] = datetime.now(timezone.utc)
+
+    async with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            locked = await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": QUOTA_RESET_LOCK_KEY})
+            await conn.commit()
+            last_run["skipped_locked"] = not locked
+            if not locked:
+                return False
+            try:
+                await _reset(conn)
+            finally:
+                await _release_lock(conn)
+        else:
+            await _reset(conn)
+
+    last_run["duration_seconds"] = time.monotonic() - started
+    QUOTA_RESET_ROWS.inc(last_run["rows_reset"])
+    QUOTA_RESET_LAST_RUN.set(time.time())
+    if last_run["rows_reset"] or last_run["periods_initialized"]:
+        logger.info(
+            "Cuotas renovadas: %s, periodos iniciados: %s (%.2f s)",
+            last_run["rows_reset"], last_run["periods_initialized"], last_run["duration_seconds"]
+        )
+    return True
+
+
+async def run_scheduler(engine: AsyncEngine):
+    """Bucle del planificador: una pasada cada QUOTA_RESET_INTERVAL_SECONDS."""
+    while True:
+        try:
+            await reset_expired_periods(engine)
+        except Exception:
+            logger.exception("Error renovando cuotas")
+        await asyncio.sleep(settings.QUOTA_RESET_INTERVAL_SECONDS)
+
+
+async def _main():
+    from database import async_engine
+
+    await reset_expired_periods(async_engine)
+    await async_engine.dispose()
+    print(f"Renovación de cuotas: {last_run}")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
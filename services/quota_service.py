@@ -0,0 +1,50 @@
+"""
+Servicio de cuotas de consultas
+Comprobación y consumo de cuota en una única sentencia atómica
+"""
+from typing import Optional
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+
+
+async def consume_queries(db: AsyncSession, user_id: str, n: int = 1) -> Optional[tuple[int, int]]:
+    """
+    Consume n consultas de la cuota del usuario con un UPDATE condicional:
+
+        UPDATE subscriptions SET queries_used = queries_used + :n
+        WHERE user_id = :u AND status = 'active'
+          AND queries_used + :n <= queries_limit
+        RETURNING queries_used, queries_limit
+
+    La comprobación y el incremento son la misma sentencia, así que dos
+    peticiones concurrentes no pueden superar el límite. El cambio queda en la
+    transacción de la sesión: si la petición falla antes del commit, la cuota
+    no se consume.
+    Devuelve (queries_used, queries_limit) tras consumir, o None si no hay
+    suscripción activa o cuota suficiente.
+    """
+    result = await db.execute(
+        update(models.Subscription)
+        .where(
+            models.Subscription.user_id == user_id,
+            models.Subscription.status == models.SubscriptionStatus.ACTIVE,
+            models.Subscription.queries_used + n <= models.Subscription.queries_limit
+        )
+        .values(queries_used=models.Subscription.queries_used + n)
+        .returning(models.Subscription.queries_used, models.Subscription.queries_limit)
+    )
+    row = result.first()
+    return (row.queries_used, row.queries_limit) if row else None
+
+
+async def get_quota_state(db: AsyncSession, user_id: str):
+    """Estado actual (status, queries_used, queries_limit) para explicar un rechazo."""
+    result = await db.execute(
+        select(
+            models.Subscription.status,
+            models.Subscription.queries_used,
+            models.Subscription.queries_limit
+        ).where(models.Subscription.user_id == user_id)
+    )
+    return result.first()
@@ -0,0 +1,162 @@
+"""
+Limitación de tasa y control de admisión
+- Token bucket por usuario y plan (models.PlanType), con un bucket general
+  para todas las rutas y otro para las rutas pesadas (procesamiento, exportación).
+- Límite global de trabajo pesado concurrente por proceso.
+- Al superar un límite: 429 con Retry-After.
+
+Los buckets viven en un backend intercambiable (set_backend); por defecto en
+memoria del proceso, así que con varios workers cada uno aplica su límite.
+"""
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from fastapi import Depends, HTTPException
+from config import settings
+from auth.dependencies import get_current_active_user
+from auth.identity import UserSnapshot
+import models
+
+
+BUCKET_GENERAL = "general"
+BUCKET_HEAVY = "heavy"
+
+
+def plan_rate_per_minute(plan_type: models.PlanType, bucket: str) -> int:
+    """Peticiones por minuto permitidas para un plan y tipo de bucket"""
+    limits = {
+        (models.PlanType.FREE, BUCKET_GENERAL): settings.RATE_LIMIT_FREE_PER_MINUTE,
+        (models.PlanType.PRO, BUCKET_GENERAL): settings.RATE_LIMIT_PRO_PER_MINUTE,
+        (models.PlanType.ENTERPRISE, BUCKET_GENERAL): settings.RATE_LIMIT_ENTERPRISE_PER_MINUTE,
+        (models.PlanType.FREE, BUCKET_HEAVY): settings.RATE_LIMIT_FREE_HEAVY_PER_MINUTE,
+        (models.PlanType.PRO, BUCKET_HEAVY): settings.RATE_LIMIT_PRO_HEAVY_PER_MINUTE,
+        (models.PlanType.ENTERPRISE, BUCKET_HEAVY): settings.RATE_LIMIT_ENTERPRISE_HEAVY_PER_MINUTE,
+    }
+    return limits[(plan_type, bucket)]
+
+
+# ============================================
+# BACKENDS
+# ============================================
+class RateLimitBackend(ABC):
+    """
+    Interfaz de almacenamiento de buckets. Un backend compartido (p. ej. Redis)
+    debe implementar take() de forma atómica.
+    """
+
+    @abstractmethod
+    async def take(self, key: str, capacity: float, refill_per_second: float, cost: float = 1) -> float:
+        """
+        Consume cost fichas del bucket key. Devuelve 0 si se permite, o los
+        segundos hasta que haya fichas suficientes (sin consumir nada).
+        """
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Buckets en un dict del proceso (LRU acotado). Solo desde el event loop."""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (fichas, última actualización)
+
+    async def take(self, key, capacity, refill_per_second, cost=1):
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill_per_second)
+
+        if tokens >= cost:
+            tokens -= cost
+            wait = 0.0
+        else:
+            wait = (cost - tokens) / refill_per_second
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+_backend: RateLimitBackend = InMemoryRateLimitBackend(settings.RATE_LIMIT_MAX_KEYS)
+
+
+def set_backend(backend: RateLimitBackend):
+    """Sustituir el backend de buckets (p. ej. uno compartido entre workers)"""
+    global _backend
+    _backend = backend
+
+
+def _too_many_requests(detail: str, retry_after: float):
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+# ============================================
+# DEPENDENCIAS
+# ============================================
+def rate_limit(bucket: str):
+    """
+    Dependencia: consume una ficha del bucket del usuario según su plan.
+    Uso: dependencies=[Depends(rate_limit(BUCKET_HEAVY))]
+    """
+
+    async def dependency(current_user: UserSnapshot = Depends(get_current_active_user)):
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+        plan_type = current_user.subscription.plan_type if current_user.subscription else models.PlanType.FREE
+        per_minute = plan_rate_per_minute(plan_type, bucket)
+        wait = await _backend.take(f"{bucket}:{current_user.id}", per_minute, per_minute / 60)
+        if wait > 0:
+            raise _too_many_requests(
+                f"Rate limit exceeded ({per_minute} {bucket} requests/minute for plan {plan_type.value})",
+                wait
+            )
+
+    return dependency
+
+
+class HeavyWorkGate:
+    """Límite de trabajo pesado concurrente en el proceso (sin cola: se rechaza)"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+
+    def admit(self):
+        """
+        Reserva un hueco o lanza 429. Devuelve la función que lo libera
+        (idempotente: se puede llamar desde el endpoint y desde una tarea de fondo).
+        """
+        if self.in_flight >= self.limit:
+            raise _too_many_requests("Server is busy processing other requests", settings.HEAVY_RETRY_AFTER_SECONDS)
+        self.in_flight += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.in_flight -= 1
+
+        return release
+
+
+heavy_gate = HeavyWorkGate(settings.HEAVY_CONCURRENCY_LIMIT)
+
+
+async def heavy_work_slot():
+    """
+    Dependencia: ocupa un hueco de trabajo pesado durante el endpoint.
+    Los endpoints en streaming no pueden usarla (las dependencias con yield
+    terminan antes de enviar el cuerpo): llaman a heavy_gate.admit() y el
+    hueco lo libera la tarea que procesa, al terminar.
+    """
+    release = heavy_gate.admit()
+    try:
+        yield
+    finally:
+        release()
@@ -0,0 +1,123 @@
+"""
+Caché de respuestas HTTP
+Para endpoints sin parámetros cuyo contenido solo cambia con la configuración,
+ficheros de plantilla o, como mucho, cada pocos minutos (/, /plans):
+
+- El cuerpo se genera una vez y se sirve desde memoria con ETag y Cache-Control.
+- If-None-Match con el ETag vigente → 304 sin volver a generar nada.
+- Se regenera al cambiar los settings, el mtime de algún fichero vigilado o
+  al cumplirse ttl_seconds.
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import time
+from typing import Iterable, Optional
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from config import settings
+from metrics import cache_result
+
+
+# Frecuencia máxima de comprobación de mtimes y settings por endpoint
+CHECK_INTERVAL_SECONDS = 1.0
+
+
+def _settings_fingerprint() -> str:
+    return hashlib.sha256(settings.model_dump_json().encode("utf-8")).hexdigest()
+
+
+def _mtime(path) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class _Entry:
+    __slots__ = ("body", "etag", "version", "built_at", "checked_at")
+
+    def __init__(self, body: bytes, version, now: float):
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.version = version
+        self.built_at = now
+        self.checked_at = now
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Comparación débil (RFC 9110): se ignora el prefijo W/
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def cached_response(
+    media_type: str = "application/json",
+    max_age: int = 0,
+    ttl_seconds: Optional[float] = None,
+    watch_files: Iterable = ()
+):
+    """
+    Decorador para endpoints sin parámetros. El endpoint devuelve el contenido
+    (str para HTML/texto; dict, lista o modelos para JSON) y el decorador
+    construye la respuesta cacheada.
+
+    max_age: Cache-Control para el cliente (0 = no-cache: revalidar siempre con ETag).
+    ttl_seconds: vida máxima en el servidor (contenido que depende de servicios externos).
+    watch_files: rutas cuyo mtime invalida la caché.
+    """
+    watch_files = tuple(watch_files)
+    cache_control = f"public, max-age={max_age}" if max_age else "no-cache"
+
+    def decorator(func):
+        assert not inspect.signature(func).parameters, "cached_response: el endpoint no admite parámetros"
+        state = {"entry": None}
+        cache_name = f"response_{func.__name__}"
+
+        def current_version():
+            return (_settings_fingerprint(), tuple(_mtime(p) for p in watch_files))
+
+        async def get_entry() -> _Entry:
+            now = time.monotonic()
+            entry = state["entry"]
+            if entry is not None:
+                expired = ttl_seconds is not None and now - entry.built_at >= ttl_seconds
+                if not expired and now - entry.checked_at < CHECK_INTERVAL_SECONDS:
+                    cache_result(cache_name, True)
+                    return entry
+                if not expired and entry.version == current_version():
+                    entry.checked_at = now
+                    cache_result(cache_name, True)
+                    return entry
+
+            cache_result(cache_name, False)
+            version = current_version()
+            content = await func() if inspect.iscoroutinefunction(func) else func()
+            if isinstance(content, str):
+                body = content.encode("utf-8")
+            else:
+                body = json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            entry = state["entry"] = _Entry(body, version, now)
+            return entry
+
+        @functools.wraps(func)
+        async def endpoint(request: Request):
+            entry = await get_entry()
+            headers = {"ETag": entry.etag, "Cache-Control": cache_control}
+            if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+                return Response(status_code=304, headers=headers)
+            return Response(content=entry.body, media_type=media_type, headers=headers)
+
+        # FastAPI lee la firma: el endpoint solo recibe la petición
+        endpoint.__signature__ = inspect.Signature([
+            inspect.Parameter("request", inspect.Parameter.POSITIONAL_OR_KEYWORD, annotation=Request)
+        ])
+        endpoint.invalidate = lambda: state.update(entry=None)
+        return endpoint
+
+    return decorator
@@ -0,0 +1,84 @@
+"""
+Servicio de resultados compartidos
+Caché global de resultados de procesamiento (afecciones WMS, planeamiento)
+por huella de geometría, conjunto de capas y versión de los datos de capa.
+Las consultas de distintos usuarios sobre la misma parcela reutilizan el
+resultado mientras no caduque.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
+from database import dialect_insert
+from metrics import cache_result
+import models
+
+
+KIND_WMS = "wms"
+KIND_URBANISMO = "urbanismo"
+
+
+def layer_version(kind: str) -> str:
+    """Versión configurada de los datos de capa para un tipo de resultado"""
+    if kind == KIND_WMS:
+        return settings.WMS_LAYERS_VERSION
+    return settings.URBANISMO_LAYERS_VERSION
+
+
+async def get_shared_result(
+    db: AsyncSession,
+    kind: str,
+    geometry_hash: str,
+    layer_set: str
+) -> Optional[models.SharedResult]:
+    """Resultado vigente (no caducado) para la clave, o None"""
+    result = models.SharedResult
+    shared = await db.scalar(
+        select(result).where(
+            result.kind == kind,
+            result.geometry_hash == geometry_hash,
+            result.layer_set == layer_set,
+            result.layer_version == layer_version(kind),
+            result.expires_at > datetime.now(timezone.utc)
+        )
+    )
+    cache_result(f"shared_result_{kind}", shared is not None)
+    return shared
+
+
+async def store_shared_result(
+    db: AsyncSession,
+    kind: str,
+    geometry_hash: str,
+    layer_set: str,
+    referencia_catastral: str,
+    summary: dict
+) -> str:
+    """
+    Guarda (o renueva) el resultado de la clave con un único upsert y devuelve su id.
+    No hace commit: el cambio va en la transacción del endpoint.
+    """
+    now = datetime.now(timezone.utc)
+    stmt = dialect_insert(db, models.SharedResult).values(
+        id=models.generate_uuid(),
+        kind=kind,
+        geometry_hash=geometry_hash,
+        layer_set=layer_set,
+        layer_version=layer_version(kind),
+        referencia_catastral=referencia_catastral,
+        summary=json.dumps(summary, default=str, ensure_ascii=False),
+        created_at=now,
+        expires_at=now + timedelta(hours=settings.SHARED_RESULT_TTL_HOURS)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["kind", "geometry_hash", "layer_set", "layer_version"],
+        set_={
+            "referencia_catastral": stmt.excluded.referencia_catastral,
+            "summary": stmt.excluded.summary,
+            "created_at": stmt.excluded.created_at,
+            "expires_at": stmt.excluded.expires_at
+        }
+    ).returning(models.SharedResult.id)
+    return (await db.execute(stmt)).scalar_one()
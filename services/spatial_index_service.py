@@ -0,0 +1,279 @@
+"""
+Servicio de índice espacial
+Búsqueda de las consultas de un usuario que intersecan un área:
+
+- PostgreSQL con PostGIS: todo en una sentencia. Candidatos por el índice GiST
+  sobre la envolvente de las columnas bbox_* (índice de expresión, creado al
+  arrancar), ST_Intersects con la geometría almacenada, orden y LIMIT.
+- Sin PostGIS (PostgreSQL sin la extensión, SQLite):
+  1. Candidatos por bbox en un STRtree en memoria por usuario, sincronizado de
+     forma incremental por created_at (índice compuesto user_id, created_at,
+     id), reconstruido por lotes y releído entero cada
+     SPATIAL_INDEX_RESYNC_SECONDS.
+  2. Refinado exacto con Shapely sobre la geometría almacenada (geometry_wkb),
+     de los candidatos más recientes a los más antiguos y por trozos, hasta
+     reunir limit; las consultas completas se leen después, solo las de la
+     página.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import timedelta
+import numpy as np
+import shapely
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, literal_column, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from config import settings
+from services.geometry_service import STORED_EPSG, project
+import models
+
+
+# Consultas nuevas que se revisan en lineal antes de reconstruir el STRtree
+REBUILD_PENDING = 1024
+
+# Candidatos por SELECT ... IN (...) al cargar geometrías para el refinado
+REFINE_ID_CHUNK = 500
+
+# Extensión (lon/lat) en la que se guardan geometrías en EPSG:25830: el área de
+# uso del CRS (6°O-0°) ampliada al territorio español (península, Baleares,
+# Canarias, Ceuta y Melilla). Fuera de ella UTM 30N no da coordenadas útiles.
+SEARCH_EXTENT = (-19.0, 27.0, 5.0, 44.5)
+
+# Longitud máxima (grados) de los lados de la bbox antes de reproyectarla:
+# en UTM los meridianos y paralelos son curvas, y proyectar solo las esquinas
+# recorta el área de búsqueda
+SEARCH_SEGMENT_DEG = 0.05
+
+# None: sin inicializar (se usa el STRtree); True/False tras setup_spatial_index
+_postgis_available = None
+
+
+# ============================================
+# POSTGIS
+# ============================================
+def _envelope():
+    """Envolvente de la consulta; misma expresión que el índice GiST"""
+    q = models.Query
+    return func.ST_MakeEnvelope(
+        q.bbox_minx, q.bbox_miny, q.bbox_maxx, q.bbox_maxy, literal_column(str(STORED_EPSG))
+    )
+
+
+async def setup_spatial_index(engine: AsyncEngine):
+    """
+    Detecta PostGIS y crea el índice GiST de envolventes si no existe.
+    Se llama al arrancar la aplicación; sin PostGIS no hace nada.
+    """
+    global _postgis_available
+
+    if engine.dialect.name != "postgresql":
+        _postgis_available = False
+        return
+
+    async with engine.begin() as conn:
+        _postgis_available = bool(await conn.scalar(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'postgis'")
+        ))
+        if _postgis_available:
+            await conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_queries_bbox_gist ON queries USING gist "
+                f"(ST_MakeEnvelope(bbox_minx, bbox_miny, bbox_maxx, bbox_maxy, {STORED_EPSG}))"
+            ))
+
+
+# ============================================
+# STRTREE EN MEMORIA
+# ============================================
+class UserSpatialIndex:
+    """
+    R-tree (STRtree) de las bbox de las consultas de un usuario.
+
+    El STRtree es inmutable: las consultas nuevas se acumulan en una lista
+    pendiente que se revisa en lineal, y el árbol se reconstruye cuando esa
+    lista supera REBUILD_PENDING.
+
+    La sincronización incremental lee por created_at con una ventana solapada.
+    No ve las filas que aparecen con un created_at anterior: las que se
+    confirman más tarde que la ventana o las que gana geometría el relleno
+    (python -m services.geometry_service, en otro proceso), ni las borradas.
+    Por eso el índice se relee entero cada SPATIAL_INDEX_RESYNC_SECONDS.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lock = asyncio.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.ids = []
+        self.created = {}  # id → created_at, para ordenar los candidatos
+        self.bounds = np.empty((0, 4))
+        self.tree = None
+        self.indexed = 0  # Filas de ids/bounds incluidas en el árbol
+        self.synced_until = None  # created_at de la última consulta sincronizada
+        self.full_sync_at = None  # time.monotonic() de la última lectura completa
+
+    async def sync(self, db: AsyncSession):
+        """Añade las consultas creadas desde la última sincronización (o relee todas)."""
+        full = (
+            self.full_sync_at is None
+            or time.monotonic() - self.full_sync_at > settings.SPATIAL_INDEX_RESYNC_SECONDS
+        )
+        q = models.Query
+        stmt = (
+            select(q.id, q.created_at, q.bbox_minx, q.bbox_miny, q.bbox_maxx, q.bbox_maxy)
+            .where(q.user_id == self.user_id, q.bbox_minx.isnot(None))
+            .order_by(q.created_at, q.id)
+        )
+        if not full:
+            # Ventana solapada de 1 s: consultas del mismo instante aún no vistas.
+            # Las ya conocidas se descartan.
+            stmt = stmt.where(q.created_at >= self.synced_until - timedelta(seconds=1))
+
+        rows = (await db.execute(stmt)).all()
+        if full:
+            self._reset()
+            self.full_sync_at = time.monotonic()
+        else:
+            rows = [r for r in rows if r.id not in self.created]
+        if not rows:
+            return
+
+        self.ids.extend(r.id for r in rows)
+        self.created.update((r.id, r.created_at) for r in rows)
+        self.bounds = np.vstack([
+            self.bounds,
+            np.array([(r.bbox_minx, r.bbox_miny, r.bbox_maxx, r.bbox_maxy) for r in rows], dtype=float)
+        ])
+        self.synced_until = max(self.synced_until or rows[-1].created_at, rows[-1].created_at)
+
+        if len(self.ids) - self.indexed > REBUILD_PENDING:
+            await run_in_threadpool(self._rebuild)
+
+    def _rebuild(self):
+        b = self.bounds
+        self.tree = shapely.STRtree(shapely.box(b[:, 0], b[:, 1], b[:, 2], b[:, 3]))
+        self.indexed = len(b)
+
+    def query(self, minx, miny, maxx, maxy):
+        """Ids cuya bbox interseca la bbox dada (árbol + pendientes), más recientes primero."""
+        hits = []
+        if self.tree is not None:
+            hits.extend(self.tree.query(shapely.box(minx, miny, maxx, maxy)).tolist())
+
+        pending = self.bounds[self.indexed:]
+        if len(pending):
+            mask = (
+                (pending[:, 0] <= maxx) & (pending[:, 2] >= minx)
+                & (pending[:, 1] <= maxy) & (pending[:, 3] >= miny)
+            )
+            hits.extend((np.nonzero(mask)[0] + self.indexed).tolist())
+
+        ids = [self.ids[i] for i in hits]
+        ids.sort(key=lambda i: (self.created[i], i), reverse=True)
+        return ids
+
+
+# Índices por usuario (LRU acotado por SPATIAL_INDEX_MAX_USERS)
+_user_indexes = OrderedDict()
+
+
+def _get_user_index(user_id):
+    index = _user_indexes.get(user_id)
+    if index is None:
+        index = _user_indexes[user_id] = UserSpatialIndex(user_id)
+        while len(_user_indexes) > settings.SPATIAL_INDEX_MAX_USERS:
+            _user_indexes.popitem(last=False)
+    else:
+        _user_indexes.move_to_end(user_id)
+    return index
+
+
+def invalidate_user_index(user_id):
+    """
+    Descarta el índice en memoria de un usuario (p. ej. tras rellenar geometrías).
+    Solo afecta al proceso que lo llama: los demás lo releen en la siguiente
+    sincronización completa.
+    """
+    _user_indexes.pop(user_id, None)
+
+
+# ============================================
+# BÚSQUEDA
+# ============================================
+def search_area(minx, miny, maxx, maxy):
+    """
+    Polígono de búsqueda en EPSG:25830 a partir de una bbox lon/lat, recortada
+    a SEARCH_EXTENT y densificada antes de reproyectar.
+    Lanza ValueError si la bbox queda fuera de SEARCH_EXTENT.
+    """
+    ext_minx, ext_miny, ext_maxx, ext_maxy = SEARCH_EXTENT
+    minx, miny = max(minx, ext_minx), max(miny, ext_miny)
+    maxx, maxy = min(maxx, ext_maxx), min(maxy, ext_maxy)
+    if minx >= maxx or miny >= maxy:
+        raise ValueError("bbox outside the supported area")
+    return project(shapely.segmentize(shapely.box(minx, miny, maxx, maxy), SEARCH_SEGMENT_DEG))
+
+
+def _refine(rows, area):
+    """Filtro exacto: filas (id, geometry_wkb) cuya geometría interseca el área."""
+    geoms = shapely.from_wkb([r.geometry_wkb for r in rows])
+    mask = shapely.intersects(geoms, area)
+    return [r for r, hit in zip(rows, mask) if hit]
+
+
+async def _search_postgis(db: AsyncSession, user_id: str, area, limit: int):
+    """Candidatos por GiST, ST_Intersects, orden y LIMIT en una sola sentencia."""
+    q = models.Query
+    minx, miny, maxx, maxy = area.bounds
+    envelope = func.ST_MakeEnvelope(minx, miny, maxx, maxy, literal_column(str(STORED_EPSG)))
+    area_geom = func.ST_GeomFromWKB(shapely.to_wkb(area), literal_column(str(STORED_EPSG)))
+    return (await db.scalars(
+        select(q)
+        .where(
+            q.user_id == user_id,
+            _envelope().op("&&")(envelope),
+            func.ST_Intersects(func.ST_GeomFromWKB(q.geometry_wkb, literal_column(str(STORED_EPSG))), area_geom)
+        )
+        .order_by(q.created_at.desc(), q.id.desc())
+        .limit(limit)
+    )).all()
+
+
+async def search_user_queries(db: AsyncSession, user_id: str, area, limit: int):
+    """
+    Consultas del usuario que intersecan el área (EPSG:25830), más recientes
+    primero, hasta limit.
+    """
+    if _postgis_available:
+        return await _search_postgis(db, user_id, area, limit)
+
+    q = models.Query
+    index = _get_user_index(user_id)
+    async with index.lock:
+        await index.sync(db)
+        ids = index.query(*area.bounds)
+
+    # Geometrías por trozos, de los candidatos más recientes a los más
+    # antiguos: se deja de leer al completar la página
+    page_ids = []
+    for start in range(0, len(ids), REFINE_ID_CHUNK):
+        chunk = ids[start:start + REFINE_ID_CHUNK]
+        rows = (await db.execute(select(q.id, q.geometry_wkb).where(q.id.in_(chunk)))).all()
+        if not rows:
+            continue
+        hits = {r.id for r in await run_in_threadpool(_refine, rows, area)}
+        page_ids.extend(i for i in chunk if i in hits)
+        if len(page_ids) >= limit:
+            break
+    page_ids = page_ids[:limit]
+    if not page_ids:
+        return []
+
+    # Solo las consultas de la página, en el orden del índice
+    queries = {
+        query.id: query
+        for query in (await db.scalars(select(q).where(q.id.in_(page_ids)))).all()
+    }
+    return [queries[i] for i in page_ids if i in queries]
@@ -0,0 +1,194 @@
+"""
+Bandeja de eventos de Stripe
+El webhook solo verifica la firma y guarda el evento en stripe_events (clave
+primaria = id del evento, así que los reintentos de Stripe no se duplican) y
+responde 200. Un consumidor en segundo plano, arrancado en el ciclo de vida de
+la aplicación, aplica los eventos pendientes:
+
+- Uno por transacción, reclamado con SELECT ... FOR UPDATE SKIP LOCKED, de
+  modo que varios workers pueden consumir a la vez sin repetir eventos.
+- En orden de creación en Stripe. Como dos workers pueden aplicar eventos de
+  la misma suscripción a la vez, la suscripción guarda el created del último
+  evento aplicado y descarta los atrasados: el estado final es siempre el del
+  evento más reciente.
+- Los eventos que fallan se reintentan en la siguiente pasada, hasta
+  STRIPE_EVENT_MAX_ATTEMPTS (last_error guarda el motivo).
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from auth.identity import invalidate_user
+from config import settings
+from database import AsyncSessionLocal, dialect_insert
+import models
+
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_UPDATED = "customer.subscription.updated"
+SUBSCRIPTION_DELETED = "customer.subscription.deleted"
+
+# Estado de la suscripción en Stripe → models.SubscriptionStatus. Solo ACTIVE
+# permite consumir cuota: trialing da servicio y los estados con el pago
+# pendiente o fallido no. Un estado desconocido deja el actual (ver _apply_event).
+STRIPE_STATUS = {
+    "active": models.SubscriptionStatus.ACTIVE,
+    "trialing": models.SubscriptionStatus.ACTIVE,
+    "past_due": models.SubscriptionStatus.PAST_DUE,
+    "unpaid": models.SubscriptionStatus.PAST_DUE,
+    "incomplete": models.SubscriptionStatus.PAST_DUE,
+    "incomplete_expired": models.SubscriptionStatus.EXPIRED,
+    "paused": models.SubscriptionStatus.EXPIRED,
+    "canceled": models.SubscriptionStatus.CANCELLED
+}
+
+# Despierta al consumidor al llegar un evento nuevo (sin esperar al sondeo).
+# Se crea en run_consumer, dentro del event loop que lo usa.
+_wakeup = None
+
+
+async def store_event(db: AsyncSession, payload: bytes) -> bool:
+    """
+    Guarda un evento ya verificado. Devuelve False si ya estaba en la bandeja
+    (reintento de Stripe).
+    """
+    event = json.loads(payload)
+    result = await db.execute(
+        dialect_insert(db, models.StripeEvent)
+        .values(
+            id=event["id"],
+            type=event["type"],
+            stripe_object_id=event["data"]["object"].get("id"),
+            created=event["created"],
+            payload=payload.decode("utf-8")
+        )
+        .on_conflict_do_nothing(index_elements=["id"])
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+
+def notify_consumer():
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+# ============================================
+# APLICACIÓN DE EVENTOS
+# ============================================
+async def _apply_event(db: AsyncSession, event: models.StripeEvent) -> Optional[str]:
+    """Aplica un evento a su suscripción. Devuelve el user_id afectado o None."""
+    if event.type not in (SUBSCRIPTION_UPDATED, SUBSCRIPTION_DELETED):
+        return None
+
+    subscription_data = json.loads(event.payload)["data"]["object"]
+    subscription = await db.scalar(
+        select(models.Subscription)
+        .where(models.Subscription.stripe_subscription_id == subscription_data["id"])
+        .with_for_update()
+    )
+    if subscription is None:
+        return None
+
+    # Evento anterior al último aplicado (llegó o se procesó tarde): obsoleto
+    if subscription.stripe_event_created is not None and event.created < subscription.stripe_event_created:
+        return None
+
+    if event.type == SUBSCRIPTION_UPDATED:
+        status = STRIPE_STATUS.get(subscription_data["status"])
+        if status is None:
+            # Estado nuevo en la API de Stripe: no cambiar el acceso a ciegas
+            logger.warning(
+                "Estado de Stripe desconocido %r en el evento %s; se mantiene %s",
+                subscription_data["status"], event.id, subscription.status
+            )
+        else:
+            subscription.status = status
+        subscription.current_period_end = datetime.fromtimestamp(
+            subscription_data["current_period_end"], tz=timezone.utc
+        )
+    else:
+        subscription.status = models.SubscriptionStatus.CANCELLED
+
+    subscription.stripe_event_created = event.created
+    return subscription.user_id
+
+
+async def process_next_event(db: AsyncSession, skip_ids=()) -> Optional[str]:
+    """
+    Reclama y aplica el evento pendiente más antiguo (salvo skip_ids).
+    Devuelve su id, o None si no hay pendientes. Si falla, registra el error
+    y añade el id a skip_ids (si es un set) para no reintentarlo en la misma pasada.
+    """
+    stripe_event = models.StripeEvent
+    stmt = (
+        select(stripe_event)
+        .where(
+            stripe_event.processed_at.is_(None),
+            stripe_event.attempts < settings.STRIPE_EVENT_MAX_ATTEMPTS
+        )
+        .order_by(stripe_event.created, stripe_event.received_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    if skip_ids:
+        stmt = stmt.where(stripe_event.id.notin_(skip_ids))
+
+    event = await db.scalar(stmt)
+    if event is None:
+        await db.rollback()
+        return None
+
+    event_id = event.id
+    try:
+        user_id = await _apply_event(db, event)
+        event.processed_at = datetime.now(timezone.utc)
+        await db.commit()
+    except Exception as e:
+        logger.exception("Error aplicando el evento de Stripe %s", event_id)
+        await db.rollback()
+        await db.execute(
+            update(stripe_event)
+            .where(stripe_event.id == event_id)
+            .values(attempts=stripe_event.attempts + 1, last_error=str(e)[:1000])
+        )
+        await db.commit()
+        if isinstance(skip_ids, set):
+            skip_ids.add(event_id)
+        return event_id
+
+    if user_id:
+        invalidate_user(user_id)
+    return event_id
+
+
+async def drain_events() -> int:
+    """Aplica todos los eventos pendientes. Devuelve cuántos se han procesado."""
+    processed = 0
+    failed = set()
+    async with AsyncSessionLocal() as db:
+        while await process_next_event(db, failed) is not None:
+            processed += 1
+    return processed
+
+
+async def run_consumer():
+    """Bucle del consumidor: vacía la bandeja al recibir eventos o cada STRIPE_EVENT_POLL_SECONDS."""
+    global _wakeup
+
+    _wakeup = asyncio.Event()
+    while True:
+        _wakeup.clear()
+        try:
+            await drain_events()
+        except Exception:
+            logger.exception("Error aplicando eventos de Stripe")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.STRIPE_EVENT_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
@@ -1,96 +1,230 @@
 """
 Servicio de integración con Stripe
+
+Las llamadas al SDK son HTTPS síncronas: se ejecutan en un pool de hilos
+propio (fuera del event loop y del threadpool de la aplicación) con un
+StripeClient compartido, cuyo RequestsClient mantiene una sesión keep-alive
+por hilo. Las creaciones llevan clave de idempotencia, así que los reintentos
+(del SDK o del cliente) no duplican clientes ni suscripciones.
+
+STRIPE_API_BASE permite apuntar a un stripe-mock local en pruebas.
 """
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Optional
 import stripe
 from config import settings
-from typing import Optional
+from metrics import cache_result
 import models
 
-# Configurar Stripe
-stripe.api_key = settings.STRIPE_SECRET_KEY
+
+# Reintento de la consulta de precios tras un error de Stripe
+PRICE_RETRY_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class PlanPrice:
+    """Metadatos de un precio de Stripe (con su producto)"""
+    id: str
+    unit_amount: Optional[int]
+    currency: Optional[str]
+    product_name: Optional[str]
+    active: bool
 
 
 class StripeService:
     """Servicio para manejar pagos con Stripe"""
-    
-    @staticmethod
-    def create_customer(email: str, name: Optional[str] = None) -> str:
+
+    def __init__(self):
+        self._client = None
+        self._executor = None
+        self._price_cache = {}  # plan -> (expira, PlanPrice)
+        self._price_lock = None
+
+    # ============================================
+    # CLIENTE Y EJECUCIÓN FUERA DEL EVENT LOOP
+    # ============================================
+    def _get_client(self) -> stripe.StripeClient:
+        if self._client is None:
+            self._client = stripe.StripeClient(
+                settings.STRIPE_SECRET_KEY,
+                http_client=stripe.RequestsClient(timeout=settings.STRIPE_TIMEOUT_SECONDS),
+                max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+                base_addresses={"api": settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else {}
+            )
+        return self._client
+
+    async def _call(self, func, *args, **kwargs):
+        """Ejecuta una llamada al SDK en el pool de Stripe"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=settings.STRIPE_HTTP_WORKERS,
+                thread_name_prefix="stripe"
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        """Liberar el pool de hilos al apagar el worker"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    # ============================================
+    # CLIENTES Y SUSCRIPCIONES
+    # ============================================
+    async def create_customer(self, email: str, name: Optional[str] = None, idempotency_key: Optional[str] = None) -> str:
         """Crear cliente en Stripe"""
-        customer = stripe.Customer.create(
-            email=email,
-            name=name
+        customer = await self._call(
+            self._get_client().customers.create,
+            params={"email": email, "name": name},
+            options={"idempotency_key": idempotency_key} if idempotency_key else {}
         )
         return customer.id
-    
-    @staticmethod
-    def create_subscription(
+
+    async def create_subscription(
+        self,
         customer_id: str,
         price_id: str,
-        payment_method_id: Optional[str] = None
+        payment_method_id: Optional[str] = None,
+        idempotency_key: Optional[str] = None
     ):
         """Crear suscripción en Stripe"""
-        
+
         params = {
             "customer": customer_id,
             "items": [{"price": price_id}],
             "expand": ["latest_invoice.payment_intent"]
         }
-        
+
         if payment_method_id:
             params["default_payment_method"] = payment_method_id
-        
-        subscription = stripe.Subscription.create(**params)
-        return subscription
-    
-    @staticmethod
-    def cancel_subscription(subscription_id: str):
+
+        return await self._call(
+            self._get_client().subscriptions.create,
+            params=params,
+            options={"idempotency_key": idempotency_key} if idempotency_key else {}
+        )
+
+    async def cancel_subscription(self, subscription_id: str):
         """Cancelar suscripción en Stripe"""
-        return stripe.Subscription.delete(subscription_id)
-    
-    @staticmethod
-    def get_subscription(subscription_id: str):
+        return await self._call(self._get_client().subscriptions.cancel, subscription_id)
+
+    async def get_subscription(self, subscription_id: str):
         """Obtener información de suscripción"""
-        return stripe.Subscription.retrieve(subscription_id)
-    
-    @staticmethod
-    def create_checkout_session(
+        return await self._call(self._get_client().subscriptions.retrieve, subscription_id)
+
+    async def create_checkout_session(
+        self,
         customer_id: str,
         price_id: str,
         success_url: str,
         cancel_url: str
     ):
         """Crear sesión de checkout"""
-        session = stripe.checkout.Session.create(
-            customer=customer_id,
-            payment_method_types=["card"],
-            line_items=[{
-                "price": price_id,
-                "quantity": 1
-            }],
-            mode="subscription",
-            success_url=success_url,
-            cancel_url=cancel_url
+        return await self._call(
+            self._get_client().checkout.sessions.create,
+            params={
+                "customer": customer_id,
+                "payment_method_types": ["card"],
+                "line_items": [{
+                    "price": price_id,
+                    "quantity": 1
+                }],
+                "mode": "subscription",
+                "success_url": success_url,
+                "cancel_url": cancel_url
+            }
         )
-        return session
-    
+
     @staticmethod
     def construct_webhook_event(payload: bytes, sig_header: str):
-        """Construir evento de webhook"""
+        """Construir evento de webhook (solo verifica la firma: sin red)"""
         return stripe.Webhook.construct_event(
             payload,
             sig_header,
             settings.STRIPE_WEBHOOK_SECRET
         )
-    
+
+    # ============================================
+    # PRECIOS (CACHÉ CON TTL)
+    # ============================================
     @staticmethod
-    def get_price_id_for_plan(plan_type: models.PlanType) -> Optional[str]:
-        """Obtener Stripe Price ID según el plan"""
-        # TODO: Configurar estos IDs en Stripe Dashboard
-        price_ids = {
-            models.PlanType.PRO: "price_pro_monthly",  # Reemplazar con ID real
-            models.PlanType.ENTERPRISE: "price_enterprise_monthly"  # Reemplazar con ID real
-        }
-        return price_ids.get(plan_type)
+    def _configured_price(plan_type: models.PlanType) -> Optional[str]:
+        """Price ID o lookup_key configurado para el plan"""
+        return {
+            models.PlanType.PRO: settings.STRIPE_PRICE_PRO,
+            models.PlanType.ENTERPRISE: settings.STRIPE_PRICE_ENTERPRISE
+        }.get(plan_type)
+
+    def _fetch_price(self, configured: str) -> Optional[PlanPrice]:
+        client = self._get_client()
+        if configured.startswith("price_"):
+            price = client.prices.retrieve(configured, params={"expand": ["product"]})
+        else:
+            prices = client.prices.list(params={
+                "lookup_keys": [configured], "active": True, "expand": ["data.product"]
+            })
+            if not prices.data:
+                return None
+            price = prices.data[0]
+
+        product = price.product if not isinstance(price.product, str) else None
+        return PlanPrice(
+            id=price.id,
+            unit_amount=price.unit_amount,
+            currency=price.currency,
+            product_name=product.name if product else None,
+            active=price.active
+        )
+
+    async def get_plan_price(self, plan_type: models.PlanType) -> Optional[PlanPrice]:
+        """
+        Precio del plan según Stripe, cacheado STRIPE_PRICE_CACHE_TTL_SECONDS.
+        Si Stripe no responde se sirve la entrada caducada; sin ella, un
+        PlanPrice mínimo con el Price ID configurado.
+        """
+        configured = self._configured_price(plan_type)
+        if not configured:
+            return None
+
+        entry = self._price_cache.get(plan_type)
+        if entry is not None and entry[0] > time.monotonic():
+            cache_result("stripe_price", True)
+            return entry[1]
+
+        cache_result("stripe_price", False)
+        if self._price_lock is None:
+            self._price_lock = asyncio.Lock()
+        async with self._price_lock:
+            # Otra petición puede haberlo refrescado mientras esperábamos
+            entry = self._price_cache.get(plan_type)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+
+            try:
+                price = await self._call(self._fetch_price, configured)
+                ttl = settings.STRIPE_PRICE_CACHE_TTL_SECONDS
+            except stripe.StripeError:
+                if entry is not None:
+                    price = entry[1]
+                elif configured.startswith("price_"):
+                    price = PlanPrice(id=configured, unit_amount=None, currency=None, product_name=None, active=True)
+                else:
+                    price = None
+                # No reintentar en cada petición mientras Stripe no responda
+                ttl = PRICE_RETRY_SECONDS
+
+            self._price_cache[plan_type] = (time.monotonic() + ttl, price)
+            return price
+
+    async def get_price_id_for_plan(self, plan_type: models.PlanType) -> Optional[str]:
+        """Obtener Stripe Price ID según el plan (None si no hay precio activo)"""
+        price = await self.get_plan_price(plan_type)
+        return price.id if price and price.active else None
 
 
 stripe_service = StripeService()
@@ -3,7 +3,6 @@ Servicio de Urbanismo - Descarga WFS, análisis de planeamiento y cálculo de in
 Integración de lógica del script 16.py para análisis urbano completo
 """
 import geopandas as gpd
-import requests
 from io import BytesIO
 import json
 from datetime import date
@@ -11,6 +10,17 @@ import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 import numpy as np
 
+from config import settings
+from metrics import track_upstream, upstream_get
+from services.progress import ProgressTracker
+
+
+# Capa WFS de planeamiento por defecto (servidor en CARM_GEOSERVER_URL)
+WFS_PLANEAMIENTO_TYPENAME = "SIT_USU_PLA_URB_CARM:clases_plu_ze_37mun"
+
+# Identificador del conjunto de capas (clave de la caché de resultados compartidos)
+URBANISMO_LAYER_SET = WFS_PLANEAMIENTO_TYPENAME
+
 
 # ============================================
 # DESCARGA WFS (Web Feature Service)
@@ -29,7 +39,7 @@ def descargar_capa_wfs(base_url, typename, srs_name="EPSG:4326"):
         "srsName": srs_name
     }
     try:
-        r = requests.get(base_url, params=params, timeout=60)
+        r = upstream_get(base_url, params=params, timeout=60)
         if r.status_code == 200:
             gdf = gpd.read_file(BytesIO(r.content))
             gdf.columns = [c.lower() for c in gdf.columns]
@@ -118,27 +128,31 @@ def calcular_porcentajes_planeamiento(gdf_parcela, gdf_planeamiento):
 # ============================================
 # DESCARGA ORTOFOTO WMS (IGN PNOA)
 # ============================================
-def descargar_ortofoto_wms(bbox_epsg3857, wms_url="https://www.ign.es/wms-inspire/pnoa-ma"):
+def descargar_ortofoto_wms(bbox_epsg3857, wms_url=None):
     """
-    Descarga ortofoto desde IGN PNOA.
+    Descarga ortofoto desde IGN PNOA (IGN_PNOA_WMS_URL por defecto).
     bbox: (minx, miny, maxx, maxy) en EPSG:3857
     Retorna imagen como bytes PNG.
     """
+    wms_url = wms_url or settings.IGN_PNOA_WMS_URL
     try:
         from owslib.wms import WebMapService
         
-        wms = WebMapService(wms_url, version="1.3.0")
-        minx, miny, maxx, maxy = bbox_epsg3857
-        
-        img = wms.getmap(
-            layers=["OI.OrthoimageCoverage"],
-            srs="EPSG:3857",
-            bbox=(minx, miny, maxx, maxy),
-            size=(1000, 1000),
-            format="image/jpeg",
-            transparent=True
-        )
-        return img.read()
+        with track_upstream(wms_url) as call:
+            wms = WebMapService(wms_url, version="1.3.0")
+            minx, miny, maxx, maxy = bbox_epsg3857
+            
+            img = wms.getmap(
+                layers=["OI.OrthoimageCoverage"],
+                srs="EPSG:3857",
+                bbox=(minx, miny, maxx, maxy),
+                size=(1000, 1000),
+                format="image/jpeg",
+                transparent=True
+            )
+            data = img.read()
+            call["bytes"] = len(data)
+            return data
     except Exception as e:
         raise Exception(f"Error descargando ortofoto: {e}")
 
@@ -146,44 +160,44 @@ def descargar_ortofoto_wms(bbox_epsg3857, wms_url="https://www.ign.es/wms-inspir
 # ============================================
 # DESCARGA URBANISMO WMS (CARM Murcia)
 # ============================================
-def descargar_urbanismo_wms(
-    bbox_epsg3857,
-    wms_url="https://mapas-gis-inter.carm.es/geoserver/SIT_USU_PLA_URB_CARM/wms?"
-):
+def descargar_urbanismo_wms(bbox_epsg3857, wms_url=None):
     """
     Descarga capa de planeamiento urbanístico de CARM (Región de Murcia).
     bbox: (minx, miny, maxx, maxy) en EPSG:3857
     Retorna imagen como bytes PNG.
     """
+    wms_url = wms_url or f"{settings.CARM_GEOSERVER_URL}/wms?"
     try:
         from owslib.wms import WebMapService
         
-        wms = WebMapService(wms_url, version="1.3.0")
-        minx, miny, maxx, maxy = bbox_epsg3857
-        
-        img = wms.getmap(
-            layers=["SIT_USU_PLA_URB_CARM:clases_plu_ze_37mun"],
-            srs="EPSG:3857",
-            bbox=(minx, miny, maxx, maxy),
-            size=(1000, 1000),
-            format="image/png",
-            transparent=True
-        )
-        return img.read()
+        with track_upstream(wms_url) as call:
+            wms = WebMapService(wms_url, version="1.3.0")
+            minx, miny, maxx, maxy = bbox_epsg3857
+            
+            img = wms.getmap(
+                layers=["SIT_USU_PLA_URB_CARM:clases_plu_ze_37mun"],
+                srs="EPSG:3857",
+                bbox=(minx, miny, maxx, maxy),
+                size=(1000, 1000),
+                format="image/png",
+                transparent=True
+            )
+            data = img.read()
+            call["bytes"] = len(data)
+            return data
     except Exception as e:
         raise Exception(f"Error descargando urbanismo: {e}")
 
 
-def descargar_leyenda_urbanismo(
-    wms_url="https://mapas-gis-inter.carm.es/geoserver/SIT_USU_PLA_URB_CARM/wms?"
-):
+def descargar_leyenda_urbanismo(wms_url=None):
     """Descarga leyenda oficial de la capa de urbanismo."""
+    wms_url = wms_url or f"{settings.CARM_GEOSERVER_URL}/wms?"
     try:
         url = (
             f"{wms_url}service=WMS&version=1.1.0&request=GetLegendGraphic&"
             f"layer=SIT_USU_PLA_URB_CARM:clases_plu_ze_37mun&format=image/png"
         )
-        r = requests.get(url, timeout=30)
+        r = upstream_get(url, timeout=30)
         if r.status_code == 200:
             return r.content
         return None
@@ -200,20 +214,20 @@ def bbox_4326_a_3857(bbox_4326):
     bbox: (minx, miny, maxx, maxy)
     """
     from pyproj import Transformer
-    transformer = Transformer.from_epsg(4326, 3857)
+    transformer = Transformer.from_crs(4326, 3857, always_xy=True)
     minx, miny, maxx, maxy = bbox_4326
-    minx_3857, miny_3857 = transformer.transform(miny, minx)
-    maxx_3857, maxy_3857 = transformer.transform(maxy, maxx)
+    minx_3857, miny_3857 = transformer.transform(minx, miny)
+    maxx_3857, maxy_3857 = transformer.transform(maxx, maxy)
     return (minx_3857, miny_3857, maxx_3857, maxy_3857)
 
 
 def bbox_3857_a_4326(bbox_3857):
     """Convierte bbox EPSG:3857 a EPSG:4326."""
     from pyproj import Transformer
-    transformer = Transformer.from_epsg(3857, 4326)
+    transformer = Transformer.from_crs(3857, 4326, always_xy=True)
     minx, miny, maxx, maxy = bbox_3857
-    miny_4326, minx_4326 = transformer.transform(miny, minx)
-    maxy_4326, maxx_4326 = transformer.transform(maxy, maxx)
+    minx_4326, miny_4326 = transformer.transform(minx, miny)
+    maxx_4326, maxy_4326 = transformer.transform(maxx, maxy)
     return (minx_4326, miny_4326, maxx_4326, maxy_4326)
 
 
@@ -282,27 +296,39 @@ def generar_mapa_urbanismo(
 def procesar_consulta_urbanismo(
     geojson_content,
     referencia_catastral,
-    base_url_wfs="https://mapas-gis-inter.carm.es/geoserver/SIT_USU_PLA_URB_CARM/wfs?",
-    typename="SIT_USU_PLA_URB_CARM:clases_plu_ze_37mun",
-    encuadre_factor=4
+    base_url_wfs=None,
+    typename=WFS_PLANEAMIENTO_TYPENAME,
+    encuadre_factor=4,
+    progress=None,
+    geometry=None
 ):
     """
     Procesa consulta de urbanismo: parsea GeoJSON, descarga WFS, calcula intersecciones,
     genera mapa con ortofoto y urbanismo.
     
     Retorna diccionario con resultados e imágenes.
+    progress: ProgressTracker opcional que recibe un evento por etapa.
+    geometry: geometría almacenada de la consulta (EPSG:25830, ver geometry_service);
+    si se pasa, se usa en lugar de parsear el GeoJSON.
     """
+    base_url_wfs = base_url_wfs or f"{settings.CARM_GEOSERVER_URL}/wfs?"
+    progress = progress or ProgressTracker()
+    progress.pipeline = "urbanismo"
     try:
-        # Cargar parcela desde GeoJSON
-        gdf_parcela = geojson_a_gdf(geojson_content)
+        # Cargar parcela desde GeoJSON (o desde la geometría ya parseada)
+        with progress.stage("parse") as ev:
+            if geometry is not None:
+                gdf_parcela = gpd.GeoDataFrame(geometry=[geometry], crs="EPSG:25830")
+            else:
+                gdf_parcela = geojson_a_gdf(geojson_content)
+            ev["features"] = len(gdf_parcela)
         
         # Calcular BBOX con encuadre
         bounds = gdf_parcela.total_bounds  # minx, miny, maxx, maxy en 25830
         
         # Convertir a 4326 para calcular encuadre
         from pyproj import Transformer
-        transformer_to_4326 = Transformer.from_epsg(25830, 4326)
-        transformer_to_3857 = Transformer.from_epsg(25830, 3857)
+        transformer_to_4326 = Transformer.from_crs(25830, 4326, always_xy=True)
         
         # Aplicar factor de encuadre en 25830
         minx, miny, maxx, maxy = bounds
@@ -314,8 +340,8 @@ def procesar_consulta_urbanismo(
         maxy += (encuadre_factor - 1) * alto / 2
         
         # Convertir a 3857 para WMS
-        lat_min, lon_min = transformer_to_4326.transform(miny, minx)
-        lat_max, lon_max = transformer_to_4326.transform(maxy, maxx)
+        lon_min, lat_min = transformer_to_4326.transform(minx, miny)
+        lon_max, lat_max = transformer_to_4326.transform(maxx, maxy)
         bbox_3857 = bbox_4326_a_3857((lon_min, lat_min, lon_max, lat_max))
         
         resultados = {
@@ -327,29 +353,45 @@ def procesar_consulta_urbanismo(
         
         # Descargar capa WFS de planeamiento
         try:
-            gdf_planeamiento = descargar_capa_wfs(base_url_wfs, typename)
-            resumen, total_area = calcular_porcentajes_planeamiento(gdf_parcela, gdf_planeamiento)
+            with progress.stage("fetch_layer", layer="planeamiento_wfs") as ev:
+                gdf_planeamiento = descargar_capa_wfs(base_url_wfs, typename)
+                ev["features"] = len(gdf_planeamiento)
+            with progress.stage("affection", layer="planeamiento_wfs"):
+                resumen, total_area = calcular_porcentajes_planeamiento(gdf_parcela, gdf_planeamiento)
             
             resultados["porcentajes"] = resumen
             resultados["area_total_m2"] = total_area
+            # Resultado parcial: disponible antes de descargar los mapas
+            progress.emit(
+                "layer_done",
+                layer="planeamiento_wfs",
+                result={"area_total_m2": total_area, "porcentajes": resumen}
+            )
         except Exception as e:
             resultados["porcentajes_error"] = str(e)
+            progress.emit("layer_done", layer="planeamiento_wfs", result={"error": str(e)})
         
         # Descargar mapas WMS
         try:
-            ortofoto_bytes = descargar_ortofoto_wms(bbox_3857)
+            with progress.stage("fetch_layer", layer="ortofoto") as ev:
+                ortofoto_bytes = descargar_ortofoto_wms(bbox_3857)
+                ev["bytes"] = len(ortofoto_bytes)
             resultados["imagenes"]["ortofoto"] = ortofoto_bytes
         except Exception as e:
             resultados["ortofoto_error"] = str(e)
         
         try:
-            urbanismo_bytes = descargar_urbanismo_wms(bbox_3857)
+            with progress.stage("fetch_layer", layer="urbanismo") as ev:
+                urbanismo_bytes = descargar_urbanismo_wms(bbox_3857)
+                ev["bytes"] = len(urbanismo_bytes)
             resultados["imagenes"]["urbanismo"] = urbanismo_bytes
         except Exception as e:
             resultados["urbanismo_error"] = str(e)
         
         try:
-            leyenda_bytes = descargar_leyenda_urbanismo()
+            with progress.stage("fetch_layer", layer="leyenda") as ev:
+                leyenda_bytes = descargar_leyenda_urbanismo()
+                ev["bytes"] = len(leyenda_bytes) if leyenda_bytes else 0
             resultados["imagenes"]["leyenda"] = leyenda_bytes
         except Exception as e:
             resultados["leyenda_error"] = str(e)
@@ -361,14 +403,16 @@ def procesar_consulta_urbanismo(
             leyenda = resultados["imagenes"].get("leyenda")
             
             if ortofoto:
-                mapa_bytes = generar_mapa_urbanismo(
-                    gdf_parcela,
-                    bbox_3857,
-                    ortofoto,
-                    urbanismo,
-                    leyenda,
-                    titulo=f"Planeamiento Urbano - {referencia_catastral}"
-                )
+                with progress.stage("map_rendered", layer="mapa_compuesto") as ev:
+                    mapa_bytes = generar_mapa_urbanismo(
+                        gdf_parcela,
+                        bbox_3857,
+                        ortofoto,
+                        urbanismo,
+                        leyenda,
+                        titulo=f"Planeamiento Urbano - {referencia_catastral}"
+                    )
+                    ev["bytes"] = len(mapa_bytes)
                 resultados["imagenes"]["mapa_compuesto"] = mapa_bytes
         except Exception as e:
             resultados["mapa_error"] = str(e)
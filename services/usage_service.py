@@ -0,0 +1,144 @@
+"""
+Servicio de contadores de uso
+Contadores por usuario mantenidos en la misma transacción que crea o procesa
+consultas, y reconciliación contra la tabla queries para corregir desvíos.
+
+Los incrementos no conocen el histórico: un usuario con consultas anteriores a
+usage_counters empieza su fila desde cero. La reconciliación corre al arrancar
+la aplicación y cada USAGE_RECONCILE_INTERVAL_SECONDS (con PostgreSQL, un solo
+worker por pasada gracias a un advisory lock).
+
+Reconciliar manualmente:
+    python -m services.usage_service
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import Integer, case, cast, func, literal, select, text, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
+from database import AsyncSessionLocal, dialect_insert
+import models
+
+
+logger = logging.getLogger(__name__)
+
+# Clave del advisory lock de PostgreSQL (constante arbitraria de la aplicación)
+USAGE_RECONCILE_LOCK_KEY = 0x05_A6_E0_C7
+
+
+def current_month() -> str:
+    """Clave del contador mensual (YYYY-MM, UTC)"""
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+
+async def record_usage(
+    db: AsyncSession,
+    user_id: str,
+    queries: int = 0,
+    wms: int = 0,
+    urbanismo: int = 0
+):
+    """
+    Incrementa los contadores del usuario con un único upsert.
+    No hace commit: el cambio va en la transacción del endpoint.
+    """
+    month = current_month()
+    stmt = dialect_insert(db, models.UsageCounter).values(
+        user_id=user_id,
+        total_queries=queries,
+        month=month,
+        queries_this_month=queries,
+        wms_processed=wms,
+        urbanismo_processed=urbanismo
+    )
+    counter = models.UsageCounter
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[counter.user_id],
+        set_={
+            "total_queries": counter.total_queries + stmt.excluded.total_queries,
+            "queries_this_month": case(
+                (counter.month == stmt.excluded.month,
+                 counter.queries_this_month + stmt.excluded.queries_this_month),
+                else_=stmt.excluded.queries_this_month
+            ),
+            "month": stmt.excluded.month,
+            "wms_processed": counter.wms_processed + stmt.excluded.wms_processed,
+            "urbanismo_processed": counter.urbanismo_processed + stmt.excluded.urbanismo_processed,
+            "updated_at": func.now()
+        }
+    )
+    await db.execute(stmt)
+
+
+async def get_usage(db: AsyncSession, user_id: str) -> Optional[models.UsageCounter]:
+    """Lectura por clave primaria de los contadores del usuario"""
+    return await db.get(models.UsageCounter, user_id)
+
+
+async def reconcile_usage_counters(db: AsyncSession, user_id: Optional[str] = None) -> int:
+    """
+    Recalcula los contadores desde la tabla queries (todos los usuarios o uno)
+    con un único INSERT ... SELECT ... ON CONFLICT. Devuelve las filas escritas.
+    """
+    month = current_month()
+    month_start = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    q = models.Query
+
+    source = select(
+        q.user_id,
+        func.count(),
+        literal(month),
+        func.sum(case((q.created_at >= month_start, 1), else_=0)),
+        func.coalesce(func.sum(cast(q.has_wms_maps, Integer)), 0),
+        func.coalesce(func.sum(cast(q.has_urbanismo, Integer)), 0)
+    ).where(q.user_id == user_id if user_id else true()).group_by(q.user_id)
+
+    stmt = dialect_insert(db, models.UsageCounter).from_select(
+        ["user_id", "total_queries", "month", "queries_this_month", "wms_processed", "urbanismo_processed"],
+        source
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.UsageCounter.user_id],
+        set_={
+            "total_queries": stmt.excluded.total_queries,
+            "queries_this_month": stmt.excluded.queries_this_month,
+            "month": stmt.excluded.month,
+            "wms_processed": stmt.excluded.wms_processed,
+            "urbanismo_processed": stmt.excluded.urbanismo_processed,
+            "updated_at": func.now()
+        }
+    )
+    result = await db.execute(stmt)
+    await db.commit()
+    return result.rowcount
+
+
+async def run_reconcile_scheduler():
+    """Bucle de reconciliación: una pasada al arrancar y cada USAGE_RECONCILE_INTERVAL_SECONDS."""
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                # Lock de transacción: se libera con el commit de la reconciliación
+                if db.bind.dialect.name != "postgresql" or await db.scalar(
+                    text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": USAGE_RECONCILE_LOCK_KEY}
+                ):
+                    rows = await reconcile_usage_counters(db)
+                    logger.info("Contadores de uso reconciliados: %s", rows)
+        except Exception:
+            logger.exception("Error reconciliando contadores de uso")
+        await asyncio.sleep(settings.USAGE_RECONCILE_INTERVAL_SECONDS)
+
+
+async def _main():
+    from database import async_engine
+
+    async with AsyncSessionLocal() as db:
+        rows = await reconcile_usage_counters(db)
+    await async_engine.dispose()
+    print(f"Contadores de uso reconciliados: {rows}")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
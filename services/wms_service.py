@@ -3,7 +3,6 @@ Servicio WMS - Descarga de mapas, procesamiento de KML y cálculo de afecciones
 Integración de lógica del script 15.py para análisis geoespacial completo
 """
 import xml.etree.ElementTree as ET
-import requests
 import numpy as np
 from io import BytesIO
 from PIL import Image
@@ -16,6 +15,33 @@ import json
 import tempfile
 import os
 
+from config import settings
+from services.geometry_service import to_wgs84
+from metrics import upstream_get
+from services.progress import ProgressTracker
+
+
+# Capas de afección y umbrales de píxel evaluados en cada consulta
+CAPAS_AFECCION = ["MontesPublicos", "RedNatura2000", "ViasPecuarias"]
+UMBRALES_AFECCION = [250, 200, 150]
+
+# Identificador del conjunto de capas (clave de la caché de resultados compartidos)
+WMS_LAYER_SET = ",".join(CAPAS_AFECCION) + "|umbrales=" + ",".join(map(str, UMBRALES_AFECCION))
+
+# Capas de MAPAMA: ruta bajo MAPAMA_WMS_BASE_URL, capa, estilo y título del mapa
+CAPAS_WMS = {
+    "MontesPublicos": ("/IEPF_CMUP?", "AM.ForestManagementArea", "", "Parcela sobre Montes Públicos"),
+    "RedNatura2000": ("/RedNatura/wms.aspx?", "PS.ProtectedSite", "", "Parcela sobre Red Natura 2000"),
+    "ViasPecuarias": ("/ViasPecuarias/wms.aspx?", "Red General de Vías Pecuarias", "default", "Parcela sobre Vías Pecuarias")
+}
+ORTOFOTO_LAYER = "OI.OrthoimageCoverage"
+
+
+def capa_wms(capa):
+    """(url base, capa, estilo, título) de una capa de afección"""
+    path, layer, style, titulo = CAPAS_WMS[capa]
+    return f"{settings.MAPAMA_WMS_BASE_URL}{path}", layer, style, titulo
+
 
 # ============================================
 # PARSEO DE KML
@@ -67,6 +93,16 @@ def polygons_to_shapely(polygons):
     return MultiPolygon(geoms) if geoms else None
 
 
+def shapely_to_polygons(geom):
+    """Inversa de polygons_to_shapely: lista de anillos (lon, lat) por polígono."""
+    parts = geom.geoms if hasattr(geom, "geoms") else [geom]
+    return [
+        [list(part.exterior.coords)] + [list(ring.coords) for ring in part.interiors]
+        for part in parts
+        if isinstance(part, Polygon)
+    ]
+
+
 # ============================================
 # BBOX Y ZOOM
 # ============================================
@@ -113,7 +149,7 @@ def download_wms_image(base_url, layer, style, bbox, format_type="image/png", wi
         f"BBOX={lat_min},{lon_min},{lat_max},{lon_max}&WIDTH={width}&HEIGHT={height}&FORMAT={format_type}"
     )
     try:
-        r = requests.get(url, timeout=30)
+        r = upstream_get(url, timeout=30)
         if r.status_code == 200:
             return Image.open(BytesIO(r.content))
         else:
@@ -129,7 +165,7 @@ def download_wms_legend(base_url, layer, format_type="image/png"):
         f"FORMAT={format_type}&LAYER={layer}"
     )
     try:
-        r = requests.get(url, timeout=30)
+        r = upstream_get(url, timeout=30)
         if r.status_code == 200:
             return Image.open(BytesIO(r.content))
     except Exception:
@@ -161,38 +197,16 @@ def compose_image_with_legend(layer_key, bbox, polygons):
     Compone ortofoto + capa temática + polígono con leyenda.
     Retorna imagen PNG como bytes.
     """
-    capas_config = {
-        "MontesPublicos": {
-            "base_url": "https://wms.mapama.gob.es/sig/Biodiversidad/IEPF_CMUP?",
-            "layer": "AM.ForestManagementArea",
-            "style": "",
-            "titulo": "Parcela sobre Montes Públicos"
-        },
-        "RedNatura2000": {
-            "base_url": "https://wms.mapama.gob.es/sig/Biodiversidad/RedNatura/wms.aspx?",
-            "layer": "PS.ProtectedSite",
-            "style": "",
-            "titulo": "Parcela sobre Red Natura 2000"
-        },
-        "ViasPecuarias": {
-            "base_url": "https://wms.mapama.gob.es/sig/Biodiversidad/ViasPecuarias/wms.aspx?",
-            "layer": "Red General de Vías Pecuarias",
-            "style": "default",
-            "titulo": "Parcela sobre Vías Pecuarias"
-        }
-    }
-
-    if layer_key not in capas_config:
+    if layer_key not in CAPAS_WMS:
         raise ValueError(f"Capa desconocida: {layer_key}")
 
-    config = capas_config[layer_key]
-    fondo_url = "https://www.ign.es/wms-inspire/pnoa-ma?"
-    fondo_layer = "OI.OrthoimageCoverage"
+    base_url, layer, style, titulo = capa_wms(layer_key)
+    fondo_url = f"{settings.IGN_PNOA_WMS_URL}?"
 
     # Descargar fondo (ortofoto)
-    fondo_img = download_wms_image(fondo_url, fondo_layer, "", bbox, format_type="image/jpeg")
+    fondo_img = download_wms_image(fondo_url, ORTOFOTO_LAYER, "", bbox, format_type="image/jpeg")
     # Descargar capa temática
-    capa_img = download_wms_image(config["base_url"], config["layer"], config["style"], bbox, format_type="image/png")
+    capa_img = download_wms_image(base_url, layer, style, bbox, format_type="image/png")
 
     # Crear figura
     fig, ax = plt.subplots(figsize=(10, 8), dpi=100)
@@ -201,11 +215,11 @@ def compose_image_with_legend(layer_key, bbox, polygons):
     draw_kml_polygons(ax, polygons)
 
     fecha = date.today().strftime("%d-%m-%Y")
-    ax.set_title(f"{config['titulo']} ({fecha})", fontsize=13, fontweight='bold')
+    ax.set_title(f"{titulo} ({fecha})", fontsize=13, fontweight='bold')
     ax.axis("off")
 
     # Intentar descargar leyenda oficial
-    legend_img = download_wms_legend(config["base_url"], config["layer"])
+    legend_img = download_wms_legend(base_url, layer)
     if legend_img:
         legend_ax = fig.add_axes([0.75, 0.05, 0.2, 0.2])
         legend_ax.imshow(legend_img)
@@ -260,22 +274,32 @@ def calcular_porcentaje_pixeles(parcela_polygons, capa_img, bbox, umbral=250):
 # ============================================
 # PROCESAMIENTO COMPLETO (POR REFERENCIA KML)
 # ============================================
-def procesar_consulta_catastral(kml_content, referencia_catastral):
+def procesar_consulta_catastral(kml_content, referencia_catastral, progress=None, geometry=None):
     """
     Procesa una consulta catastral: parsea KML, descarga mapas WMS, calcula afecciones.
     Retorna diccionario con resultados e imágenes.
+    progress: ProgressTracker opcional que recibe un evento por etapa y por capa.
+    geometry: geometría almacenada de la consulta (EPSG:25830, ver geometry_service);
+    si se pasa, se usa en lugar de parsear el KML.
     """
+    progress = progress or ProgressTracker()
+    progress.pipeline = "wms"
     try:
-        # Parsear KML
-        polygons = parse_kml_polygons(kml_content)
-        if not polygons:
-            raise ValueError("No se encontraron polígonos en el KML")
-
-        bbox = get_bbox_from_polygons(polygons)
+        # Parsear KML (o usar la geometría ya parseada)
+        with progress.stage("parse") as ev:
+            if geometry is not None:
+                polygons = shapely_to_polygons(to_wgs84(geometry))
+            else:
+                polygons = parse_kml_polygons(kml_content)
+            if not polygons:
+                raise ValueError("No se encontraron polígonos en el KML")
+
+            bbox = get_bbox_from_polygons(polygons)
+            ev["polygons"] = len(polygons)
 
         # Capas a procesar
-        capas = ["MontesPublicos", "RedNatura2000", "ViasPecuarias"]
-        umbrales = [250, 200, 150]
+        capas = CAPAS_AFECCION
+        umbrales = UMBRALES_AFECCION
         
         resultados = {
             "referencia": referencia_catastral,
@@ -286,26 +310,28 @@ def procesar_consulta_catastral(kml_content, referencia_catastral):
         for capa in capas:
             try:
                 # Descargar imágenes y calcular porcentajes
-                imagen_bytes = compose_image_with_legend(capa, bbox, polygons)
+                with progress.stage("map_rendered", layer=capa) as ev:
+                    imagen_bytes = compose_image_with_legend(capa, bbox, polygons)
+                    ev["bytes"] = len(imagen_bytes)
                 resultados["imagenes"][capa] = imagen_bytes
 
                 # Descargar capa para calcular afecciones
-                config_urls = {
-                    "MontesPublicos": ("https://wms.mapama.gob.es/sig/Biodiversidad/IEPF_CMUP?", "AM.ForestManagementArea", ""),
-                    "RedNatura2000": ("https://wms.mapama.gob.es/sig/Biodiversidad/RedNatura/wms.aspx?", "PS.ProtectedSite", ""),
-                    "ViasPecuarias": ("https://wms.mapama.gob.es/sig/Biodiversidad/ViasPecuarias/wms.aspx?", "Red General de Vías Pecuarias", "default")
-                }
-                base_url, layer, style = config_urls[capa]
-                capa_img = download_wms_image(base_url, layer, style, bbox, format_type="image/png")
-
-                resultados["capas"][capa] = {}
-                for umbral in umbrales:
-                    porcentaje = calcular_porcentaje_pixeles(polygons, capa_img, bbox, umbral=umbral)
-                    resultados["capas"][capa][f"umbral_{umbral}"] = round(porcentaje, 2)
+                base_url, layer, style, _ = capa_wms(capa)
+                with progress.stage("fetch_layer", layer=capa):
+                    capa_img = download_wms_image(base_url, layer, style, bbox, format_type="image/png")
+
+                with progress.stage("affection", layer=capa):
+                    resultados["capas"][capa] = {}
+                    for umbral in umbrales:
+                        porcentaje = calcular_porcentaje_pixeles(polygons, capa_img, bbox, umbral=umbral)
+                        resultados["capas"][capa][f"umbral_{umbral}"] = round(porcentaje, 2)
 
             except Exception as e:
                 resultados["capas"][capa] = {"error": str(e)}
 
+            # Resultado parcial de la capa (éxito o error)
+            progress.emit("layer_done", layer=capa, result=resultados["capas"][capa])
+
         return resultados
 
     except Exception as e:
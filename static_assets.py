@@ -0,0 +1,191 @@
+"""
+Ficheros estáticos precomprimidos
+Al arrancar se lee /static a memoria y, por cada fichero de texto, se
+precalculan sus variantes gzip y brotli (si está instalado el paquete Brotli):
+
+- css/js/imágenes se publican además con nombre con hash de contenido
+  (css/main.3f2a1b9c.css) y Cache-Control immutable de un año.
+- Los HTML se sirven con sus referencias /static/... reescritas a esos
+  nombres, y con no-cache + ETag (revalidación con 304).
+- La variante se elige por Accept-Encoding (br > gzip > sin comprimir), con
+  Vary: Accept-Encoding y un ETag por variante.
+
+Los ficheros que no estaban al arrancar se sirven como con StaticFiles.
+
+Informe de bytes transferidos por variante:
+    python -m static_assets
+"""
+import gzip
+import hashlib
+import mimetypes
+import re
+from pathlib import Path
+from typing import Dict, Optional
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:  # Opcional: sin Brotli solo se sirven gzip e identidad
+    brotli = None
+
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Tipos que se comprimen y extensiones que reciben nombre con hash
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+HASHED_SUFFIXES = (".css", ".js", ".svg", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".ico", ".woff", ".woff2")
+
+# Por debajo de este tamaño la compresión no compensa
+MIN_COMPRESS_BYTES = 512
+
+_STATIC_REF = re.compile(r'((?:href|src)=["\'])/static/([^"\'?#]+)')
+
+
+class StaticAsset:
+    """Un fichero en memoria con sus variantes por codificación"""
+    __slots__ = ("media_type", "variants", "etags", "immutable")
+
+    def __init__(self, body: bytes, media_type: str, immutable: bool):
+        self.media_type = media_type
+        self.immutable = immutable
+        self.variants = {"identity": body}
+
+        if len(body) >= MIN_COMPRESS_BYTES and media_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(body, quality=11)
+            for encoding, data in compressed.items():
+                if len(data) < len(body):
+                    self.variants[encoding] = data
+
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        self.etags = {
+            encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            for encoding in self.variants
+        }
+
+
+def accepted_encodings(header: Optional[str]) -> Dict[str, float]:
+    """Accept-Encoding → {codificación: q}"""
+    accepted = {}
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+def _negotiate(asset: StaticAsset, header: Optional[str]) -> str:
+    accepted = accepted_encodings(header)
+    for encoding in ("br", "gzip"):
+        if encoding in asset.variants and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return "identity"
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles con ficheros precomprimidos en memoria y URLs con hash"""
+
+    def __init__(self, *, directory, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.root = Path(directory)
+        self.assets: Dict[str, StaticAsset] = {}
+        self.manifest: Dict[str, str] = {}  # ruta original → ruta con hash
+        self.build()
+
+    def build(self):
+        """(Re)lee el directorio y precalcula variantes, hashes y HTML reescritos"""
+        assets, manifest, pages = {}, {}, []
+
+        for file in sorted(p for p in self.root.rglob("*") if p.is_file()):
+            rel = file.relative_to(self.root).as_posix()
+            media_type = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+            if file.suffix == ".html":
+                pages.append((rel, file, media_type))
+                continue
+
+            body = file.read_bytes()
+            assets[rel] = StaticAsset(body, media_type, immutable=False)
+            if file.suffix.lower() in HASHED_SUFFIXES:
+                hashed = f"{rel[:-len(file.suffix)]}.{hashlib.sha256(body).hexdigest()[:8]}{file.suffix}"
+                manifest[rel] = hashed
+                assets[hashed] = StaticAsset(body, media_type, immutable=True)
+
+        self.manifest = manifest
+        for rel, file, media_type in pages:
+            html = self.rewrite_html(file.read_text(encoding="utf-8"))
+            assets[rel] = StaticAsset(html.encode("utf-8"), f"{media_type}; charset=utf-8", immutable=False)
+        self.assets = assets
+
+    def asset_url(self, path: str) -> str:
+        """URL pública (con hash si lo tiene) de un fichero de /static"""
+        return "/static/" + self.manifest.get(path, path)
+
+    def rewrite_html(self, html: str) -> str:
+        """Sustituye las referencias /static/... por sus URLs con hash"""
+        return _STATIC_REF.sub(lambda m: m.group(1) + self.asset_url(m.group(2)), html)
+
+    async def get_response(self, path: str, scope) -> Response:
+        asset = self.assets.get(Path(path).as_posix())
+        if asset is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        request_headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        encoding = _negotiate(asset, request_headers.get("accept-encoding"))
+        body = asset.variants[encoding]
+        headers = {
+            "ETag": asset.etags[encoding],
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if asset.immutable else REVALIDATE_CACHE_CONTROL,
+            "Vary": "Accept-Encoding"
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and asset.etags[encoding] in (t.strip().removeprefix("W/") for t in if_none_match.split(",")):
+            return Response(status_code=304, headers=headers)
+
+        if scope["method"] == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return Response(content=b"", media_type=asset.media_type, headers=headers)
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+
+def transfer_report(static_files: PrecompressedStaticFiles) -> str:
+    """
+    Bytes enviados por fichero (sin los alias con hash) a un cliente sin
+    compresión, con gzip y con br + gzip.
+    """
+    clients = {"identity": "identity", "gzip": "gzip", "br": "br, gzip"}
+    rows = []
+    totals = dict.fromkeys(clients, 0)
+    hashed = set(static_files.manifest.values())
+    for path, asset in sorted(static_files.assets.items()):
+        if path in hashed:
+            continue
+        sizes = {
+            client: len(asset.variants[_negotiate(asset, accept)])
+            for client, accept in clients.items()
+        }
+        for enc, size in sizes.items():
+            totals[enc] += size
+        rows.append(f"{path:40} {sizes['identity']:>9} {sizes['gzip']:>9} {sizes['br']:>9}")
+
+    header = f"{'fichero':40} {'identity':>9} {'gzip':>9} {'br':>9}"
+    total = f"{'TOTAL':40} {totals['identity']:>9} {totals['gzip']:>9} {totals['br']:>9}"
+    note = "" if brotli is not None else "\n(Brotli no instalado: la columna br recibe gzip)"
+    return "\n".join([header, *rows, total]) + note
+
+
+if __name__ == "__main__":
+    print(transfer_report(PrecompressedStaticFiles(directory=Path(__file__).parent / "static")))
@@ -0,0 +1,149 @@
+"""
+Configuración común de las pruebas
+
+Fija las variables de entorno mínimas de config.Settings antes de importar la
+app y usa una base de datos SQLite temporal con el esquema de models (nunca la
+DATABASE_URL del entorno: las pruebas crean y borran datos). Las pruebas
+asíncronas se ejecutan con el fixture run, sobre un único event loop para
+toda la sesión (el pool del engine asíncrono es de ese loop).
+
+Uso:
+    pytest -q
+    pytest tests/test_quota_service.py -q
+"""
+import asyncio
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager
+import httpx
+import pytest
+from sqlalchemy import event
+
+_DB_DIR = tempfile.mkdtemp(prefix="catastro-tests-")
+
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_DIR}/tests.db"
+for name, value in {
+    "SECRET_KEY": "tests-secret-key",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+    "STRIPE_SECRET_KEY": "sk_test_tests",
+    "STRIPE_PUBLISHABLE_KEY": "pk_test_tests",
+    "STRIPE_WEBHOOK_SECRET": "whsec_tests",
+    "APP_NAME": "Catastro tests",
+    "APP_URL": "http://tests",
+    "FRONTEND_URL": "http://tests",
+    "AEMET_API_KEY": "tests",
+    "PLAN_FREE_QUERIES": "3",
+    "PLAN_PRO_QUERIES": "100",
+    "PLAN_PRO_PRICE": "29",
+    "PLAN_ENTERPRISE_PRICE": "99",
+    "RATE_LIMIT_ENABLED": "false"
+}.items():
+    os.environ.setdefault(name, value)
+
+import models  # noqa: E402
+from database import AsyncSessionLocal, Base, async_engine, engine  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    Base.metadata.create_all(engine)
+    yield
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def run():
+    """Ejecuta una corrutina en el event loop de la sesión: run(coro)"""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.run_until_complete(async_engine.dispose())
+    loop.close()
+
+
+@pytest.fixture
+def create_user(run):
+    """create_user(**subscription) → usuario nuevo (User, ya guardado) con su suscripción"""
+    def create(**subscription):
+        async def insert():
+            user = models.User(
+                email=f"test-{uuid.uuid4().hex[:12]}@example.com",
+                hashed_password="x",
+                full_name="Test"
+            )
+            user.subscription = models.Subscription(**{
+                "plan_type": models.PlanType.FREE,
+                "status": models.SubscriptionStatus.ACTIVE,
+                "queries_used": 0,
+                "queries_limit": 3,
+                **subscription
+            })
+            async with AsyncSessionLocal() as db:
+                db.add(user)
+                await db.commit()
+            return user
+        return run(insert())
+    return create
+
+
+@pytest.fixture
+def create_queries(run):
+    """create_queries(user, n, **columnas) → ids de n consultas nuevas del usuario"""
+    from sqlalchemy import insert
+
+    def create(user, n, **values):
+        rows = [
+            {"id": str(uuid.uuid4()), "user_id": user.id, "referencia_catastral": f"{i:07d}TS0001N0001XX", **values}
+            for i in range(n)
+        ]
+
+        async def insert_rows():
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(models.Query), rows)
+                await db.commit()
+        run(insert_rows())
+        return [row["id"] for row in rows]
+    return create
+
+
+@pytest.fixture
+def auth_headers():
+    """auth_headers(user) → cabeceras con un JWT del usuario"""
+    from auth.jwt import create_access_token
+
+    def headers(user):
+        return {"Authorization": f"Bearer {create_access_token({'sub': user.email})}"}
+    return headers
+
+
+@pytest.fixture
+def api(run):
+    """api(method, url, **kwargs) → respuesta de la app en proceso (httpx + ASGITransport)"""
+    from app import app
+
+    def request(method, url, **kwargs):
+        async def send():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://tests") as client:
+                return await client.request(method, url, **kwargs)
+        return run(send())
+    return request
+
+
+@pytest.fixture
+def record_statements():
+    """with record_statements() as statements: SQL enviado por el engine asíncrono"""
+    @contextmanager
+    def record():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    return record
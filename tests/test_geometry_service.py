@@ -0,0 +1,52 @@
+"""
+Geometría almacenada de una consulta con KML, GeoJSON o ambos
+"""
+from benchmarks import fixtures
+from services.geometry_service import content_geometry_fields, load_geometry
+
+
+def _parcel(seed=1, shift=0.0):
+    polygons = fixtures.make_parcel(40, holes=1, seed=seed)
+    if shift:
+        polygons = [[[(lon + shift, lat) for lon, lat in ring] for ring in rings] for rings in polygons]
+    return polygons
+
+
+def test_matching_kml_and_geojson_store_the_geometry():
+    polygons = _parcel()
+
+    kml, geojson = fixtures.parcel_kml(polygons), fixtures.parcel_geojson(polygons)
+
+    fields = content_geometry_fields(kml, geojson)
+
+    # El KML redondea las coordenadas: misma parcela aunque la huella difiera
+    assert fields == content_geometry_fields(kml_content=kml)
+    stored = load_geometry(fields["geometry_wkb"])
+    from_geojson = load_geometry(content_geometry_fields(geojson_content=geojson)["geometry_wkb"])
+    assert stored.hausdorff_distance(from_geojson) < 0.01
+
+
+def test_different_kml_and_geojson_store_no_geometry():
+    # ~90 m al este: urbanismo no debe procesar la parcela del KML
+    kml = fixtures.parcel_kml(_parcel())
+    geojson = fixtures.parcel_geojson(_parcel(shift=0.001))
+
+    assert content_geometry_fields(kml, geojson) == {}
+
+
+def test_single_format_is_stored():
+    polygons = _parcel()
+
+    for fields in (
+        content_geometry_fields(kml_content=fixtures.parcel_kml(polygons)),
+        content_geometry_fields(geojson_content=fixtures.parcel_geojson(polygons))
+    ):
+        stored = load_geometry(fields["geometry_wkb"])
+        assert stored.geom_type == "MultiPolygon"
+        assert abs(stored.area - fields["area_m2"]) < 1e-6
+
+
+def test_unreadable_content_stores_no_geometry():
+    assert content_geometry_fields("<kml>", None) == {}
+    assert content_geometry_fields(None, "{not json") == {}
+    assert content_geometry_fields() == {}
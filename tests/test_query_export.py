@@ -0,0 +1,66 @@
+"""
+La exportación no hace un SELECT por consulta
+
+_stream_user_queries (POST /api/catastro/queries/export) carga el usuario de
+cada consulta con joinedload en la misma sentencia: el número de sentencias
+depende de los trozos de ids (EXPORT_ID_CHUNK), no de las filas.
+"""
+import pytest
+from database import AsyncSessionLocal
+from routers import catastro
+
+
+def _export(run, record_statements, user, ids):
+    """Recorre la exportación como export_queries; (filas, sentencias enviadas)"""
+    async def walk():
+        rows = []
+        async with AsyncSessionLocal() as db:
+            async for partition in catastro._stream_user_queries(db, user.id, ids):
+                # Lo que lee _create_zip_for_queries de cada consulta
+                rows += [(q.user.email, q.kml_content, q.wms_affection_data) for q in partition]
+                for q in partition:
+                    db.expunge(q)
+        return rows
+
+    with record_statements() as statements:
+        rows = run(walk())
+    return rows, statements
+
+
+@pytest.fixture
+def user(create_user):
+    return create_user(queries_limit=1000)
+
+
+def test_export_statement_count_does_not_grow_with_rows(run, record_statements, create_queries, user, monkeypatch):
+    # Un solo trozo de ids para ambos tamaños: solo cambian las filas
+    monkeypatch.setattr(catastro, "EXPORT_ID_CHUNK", 1000)
+    small = create_queries(user, 10, kml_content="<kml/>")
+    large = create_queries(user, 600, kml_content="<kml/>")
+
+    small_rows, small_statements = _export(run, record_statements, user, small)
+    large_rows, large_statements = _export(run, record_statements, user, large)
+
+    assert len(small_rows) == 10
+    assert len(large_rows) == 600
+    assert all(email == user.email and kml == "<kml/>" for email, kml, _ in large_rows)
+    assert len(large_statements) == len(small_statements) == 1
+
+
+def test_export_statement_count_follows_id_chunks(run, record_statements, create_queries, user):
+    ids = create_queries(user, 600)
+
+    rows, statements = _export(run, record_statements, user, ids)
+
+    chunks = -(-len(ids) // catastro.EXPORT_ID_CHUNK)
+    assert len(rows) == 600
+    assert len(statements) == chunks
+
+
+def test_export_skips_other_users_queries(run, record_statements, create_user, create_queries, user):
+    own = create_queries(user, 3)
+    other = create_queries(create_user(), 3)
+
+    rows, _ = _export(run, record_statements, user, own + other)
+
+    assert len(rows) == 3
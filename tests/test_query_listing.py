@@ -0,0 +1,64 @@
+"""
+Los listados no leen las columnas pesadas de queries
+
+GET /api/catastro/queries y /stats solo necesitan los metadatos de cada
+consulta: el SQL que envían no debe incluir KML, GeoJSON ni resultados.
+"""
+import pytest
+
+PAYLOAD_COLUMNS = ("kml_content", "geojson_content", "wms_affection_data", "urbanismo_data", "geometry_wkb")
+
+PAYLOAD = {
+    "kml_content": "<kml>" + "x" * 10_000 + "</kml>",
+    "geojson_content": '{"type": "FeatureCollection", "features": []}',
+    "wms_affection_data": '{"capas": {}}',
+    "urbanismo_data": '{"planeamiento": {}}',
+    "has_wms_maps": True,
+    "has_urbanismo": True
+}
+
+
+@pytest.fixture
+def user(create_user, create_queries):
+    user = create_user(queries_limit=100)
+    create_queries(user, 5, **PAYLOAD)
+    return user
+
+
+def _payload_columns(statements):
+    return sorted({
+        column for statement in statements for column in PAYLOAD_COLUMNS if column in statement
+    })
+
+
+@pytest.mark.parametrize("params", [{}, {"skip": 2, "limit": 2}, {"limit": 2}])
+def test_query_list_select_excludes_payload(api, auth_headers, record_statements, user, params):
+    with record_statements() as statements:
+        r = api("GET", "/api/catastro/queries", params=params, headers=auth_headers(user))
+
+    assert r.status_code == 200
+    assert len(r.json()) == params.get("limit", 5)
+    assert any("FROM queries" in s for s in statements)
+    assert _payload_columns(statements) == []
+
+
+def test_query_list_cursor_page_excludes_payload(api, auth_headers, record_statements, user):
+    headers = auth_headers(user)
+    first = api("GET", "/api/catastro/queries", params={"limit": 2}, headers=headers)
+
+    with record_statements() as statements:
+        r = api("GET", "/api/catastro/queries", params={"limit": 2, "cursor": first.headers["x-next-cursor"]}, headers=headers)
+
+    assert r.status_code == 200
+    assert len(r.json()) == 2
+    assert _payload_columns(statements) == []
+
+
+def test_stats_select_excludes_payload(api, auth_headers, record_statements, user):
+    with record_statements() as statements:
+        r = api("GET", "/api/catastro/stats", headers=auth_headers(user))
+
+    assert r.status_code == 200
+    assert r.json()["queries_limit"] == 100
+    assert statements
+    assert _payload_columns(statements) == []
@@ -0,0 +1,77 @@
+"""
+Renovación mensual de cuota (services.quota_reset_service)
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import select
+import models
+from database import AsyncSessionLocal, async_engine
+from services import quota_reset_service
+from services.quota_reset_service import add_month, reset_expired_periods
+
+
+def _subscription(run, user):
+    async def load():
+        async with AsyncSessionLocal() as db:
+            return await db.scalar(select(models.Subscription).where(models.Subscription.user_id == user.id))
+    return run(load())
+
+
+def test_expired_period_is_renewed(run, create_user):
+    end = (datetime.utcnow() - timedelta(days=3)).replace(microsecond=0)
+    user = create_user(queries_used=3, current_period_start=end - timedelta(days=30), current_period_end=end)
+
+    assert run(reset_expired_periods(async_engine)) is True
+
+    subscription = _subscription(run, user)
+    assert subscription.queries_used == 0
+    assert subscription.current_period_start == end
+    assert subscription.current_period_end == add_month(end)
+
+
+class _RecordingConnection:
+    """Conexión PostgreSQL simulada que anota qué se ejecuta y en qué orden"""
+
+    def __init__(self):
+        self.dialect = SimpleNamespace(name="postgresql")
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def scalar(self, statement, params=None):
+        self.calls.append(str(statement))
+        return True
+
+    async def execute(self, statement, params=None):
+        self.calls.append(str(statement))
+
+    async def commit(self):
+        self.calls.append("commit")
+
+    async def rollback(self):
+        self.calls.append("rollback")
+
+    async def invalidate(self):
+        self.calls.append("invalidate")
+
+
+def test_failed_run_rolls_back_before_releasing_the_lock(run, monkeypatch):
+    conn = _RecordingConnection()
+    engine = SimpleNamespace(connect=lambda: conn)
+
+    async def failing_reset(conn):
+        raise RuntimeError("UPDATE fallido")
+
+    monkeypatch.setattr(quota_reset_service, "_reset", failing_reset)
+    with pytest.raises(RuntimeError):
+        run(reset_expired_periods(engine))
+
+    unlock = next(i for i, call in enumerate(conn.calls) if "pg_advisory_unlock" in call)
+    assert conn.calls[unlock - 1] == "rollback"
+    assert conn.calls[unlock + 1] == "commit"
+    assert "invalidate" not in conn.calls
@@ -0,0 +1,59 @@
+"""
+Consumo concurrente de la cuota (services.quota_service.consume_queries)
+"""
+import asyncio
+import pytest
+from sqlalchemy import select
+import models
+from database import AsyncSessionLocal
+from services.quota_service import consume_queries
+
+
+async def _consume(user_id, n):
+    """Una petición: su propia sesión y transacción, como un endpoint"""
+    async with AsyncSessionLocal() as db:
+        result = await consume_queries(db, user_id, n)
+        await db.commit()
+        return result
+
+
+async def _queries_used(user_id):
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(
+            select(models.Subscription.queries_used).where(models.Subscription.user_id == user_id)
+        )
+
+
+@pytest.mark.parametrize("limit, calls", [(1, 10), (5, 40), (20, 60)])
+def test_concurrent_consumption_never_exceeds_limit(run, create_user, limit, calls):
+    user_id = create_user(queries_limit=limit).id
+
+    async def scenario():
+        return await asyncio.gather(*(_consume(user_id, 1) for _ in range(calls)))
+
+    results = run(scenario())
+
+    successes = [r for r in results if r is not None]
+    assert len(successes) == limit
+    assert sorted(used for used, _ in successes) == list(range(1, limit + 1))
+    assert run(_queries_used(user_id)) == limit
+
+
+def test_concurrent_bulk_consumption_is_all_or_nothing(run, create_user):
+    # Cuota 5 con altas de 2: solo caben dos; la tercera no consume la que queda
+    user_id = create_user(queries_limit=5).id
+
+    async def scenario():
+        return await asyncio.gather(*(_consume(user_id, 2) for _ in range(10)))
+
+    results = run(scenario())
+
+    assert sum(r is not None for r in results) == 2
+    assert run(_queries_used(user_id)) == 4
+
+
+def test_inactive_subscription_consumes_nothing(run, create_user):
+    user_id = create_user(queries_limit=5, status=models.SubscriptionStatus.PAST_DUE).id
+
+    assert run(_consume(user_id, 1)) is None
+    assert run(_queries_used(user_id)) == 0
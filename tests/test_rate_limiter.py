@@ -0,0 +1,35 @@
+"""
+Backends de limitación de tasa (services.rate_limiter)
+"""
+import pytest
+from services.rate_limiter import InMemoryRateLimitBackend, RateLimitBackend
+
+
+def test_backend_interface_requires_take():
+    with pytest.raises(TypeError):
+        RateLimitBackend()
+
+    class Incomplete(RateLimitBackend):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_in_memory_bucket_allows_capacity_then_waits(run):
+    backend = InMemoryRateLimitBackend(max_keys=10)
+
+    waits = [run(backend.take("user", capacity=3, refill_per_second=1)) for _ in range(4)]
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert 0 < waits[3] <= 1
+
+
+def test_in_memory_backend_evicts_least_recently_used(run):
+    backend = InMemoryRateLimitBackend(max_keys=2)
+    for key in ("a", "b", "c"):
+        run(backend.take(key, capacity=1, refill_per_second=0.001))
+
+    # "a" se descartó: vuelve con el bucket lleno
+    assert run(backend.take("a", capacity=1, refill_per_second=0.001)) == 0.0
+    assert run(backend.take("c", capacity=1, refill_per_second=0.001)) > 0
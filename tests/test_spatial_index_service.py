@@ -0,0 +1,88 @@
+"""
+Búsqueda espacial sin PostGIS (STRtree en memoria + refinado por trozos)
+"""
+from datetime import timedelta
+import pytest
+from sqlalchemy import select
+import models
+from benchmarks import fixtures
+from database import AsyncSessionLocal
+from services import spatial_index_service
+from services.geometry_service import backfill_query_geometries, content_geometry_fields
+from services.spatial_index_service import search_area, search_user_queries
+
+PARCEL = content_geometry_fields(geojson_content=fixtures.parcel_geojson(fixtures.make_parcel(20, seed=7)))
+AREA = search_area(
+    fixtures.CENTER_LON - 0.01, fixtures.CENTER_LAT - 0.01, fixtures.CENTER_LON + 0.01, fixtures.CENTER_LAT + 0.01
+)
+
+
+@pytest.fixture
+def user(create_user):
+    return create_user(queries_limit=1000)
+
+
+def _search(run, user, limit=100):
+    async def search():
+        async with AsyncSessionLocal() as db:
+            return [q.id for q in await search_user_queries(db, user.id, AREA, limit)]
+    return run(search())
+
+
+def _create_at(create_queries, user, created_at, **values):
+    return create_queries(user, 1, created_at=created_at, **values)[0]
+
+
+def test_search_returns_newest_first_up_to_limit(run, user, create_queries):
+    base = models.utc_now() - timedelta(days=1)
+    ids = [_create_at(create_queries, user, base + timedelta(minutes=i), **PARCEL) for i in range(12)]
+    # Sin geometría: no aparece
+    create_queries(user, 1)
+
+    assert _search(run, user) == ids[::-1]
+    assert _search(run, user, limit=5) == ids[::-1][:5]
+
+
+def test_refine_stops_once_the_page_is_full(run, user, create_queries, record_statements, monkeypatch):
+    monkeypatch.setattr(spatial_index_service, "REFINE_ID_CHUNK", 4)
+    base = models.utc_now() - timedelta(days=1)
+    ids = [_create_at(create_queries, user, base + timedelta(minutes=i), **PARCEL) for i in range(40)]
+    _search(run, user)  # Índice ya sincronizado
+
+    with record_statements() as statements:
+        page = _search(run, user, limit=6)
+
+    assert page == ids[::-1][:6]
+    # Dos trozos de 4 geometrías (no 10) y la página
+    assert sum("geometry_wkb" in s for s in statements) == 2
+
+
+def test_rows_committed_behind_the_window_appear_after_resync(run, user, create_queries, monkeypatch):
+    now = models.utc_now()
+    newest = _create_at(create_queries, user, now, **PARCEL)
+    assert _search(run, user) == [newest]
+
+    # Confirmada tarde: created_at anterior a la ventana de la sincronización incremental
+    late = _create_at(create_queries, user, now - timedelta(minutes=5), **PARCEL)
+    assert _search(run, user) == [newest]
+
+    monkeypatch.setattr(spatial_index_service.settings, "SPATIAL_INDEX_RESYNC_SECONDS", 0)
+    assert _search(run, user) == [newest, late]
+
+
+def test_backfill_invalidates_the_user_index(run, user, create_queries):
+    first = _create_at(create_queries, user, models.utc_now() - timedelta(hours=1), **PARCEL)
+    assert _search(run, user) == [first]
+
+    old = _create_at(
+        create_queries, user, models.utc_now() - timedelta(days=30),
+        geojson_content=fixtures.parcel_geojson(fixtures.make_parcel(20, seed=8))
+    )
+
+    async def backfill():
+        async with AsyncSessionLocal() as db:
+            await backfill_query_geometries(db)
+            return await db.scalar(select(models.Query.geometry_hash).where(models.Query.id == old))
+
+    assert run(backfill()) is not None
+    assert _search(run, user) == [first, old]
@@ -0,0 +1,160 @@
+"""
+Webhook de Stripe y consumidor de la bandeja (services.stripe_event_service)
+
+Los eventos se firman en local con STRIPE_WEBHOOK_SECRET, como los envía
+Stripe (cabecera Stripe-Signature t=...,v1=HMAC-SHA256).
+"""
+import hashlib
+import hmac
+import json
+import time
+import uuid
+import pytest
+from sqlalchemy import select
+import models
+from config import settings
+from database import AsyncSessionLocal
+from services.stripe_event_service import SUBSCRIPTION_DELETED, SUBSCRIPTION_UPDATED, drain_events
+
+WEBHOOK = "/api/subscriptions/webhook"
+PERIOD_END = 1_900_000_000
+
+
+def _event(subscription_id, created, status="active", type_=SUBSCRIPTION_UPDATED, **fields):
+    data = {"id": subscription_id, "object": "subscription", "status": status, "current_period_end": PERIOD_END, **fields}
+    return {"id": f"evt_{uuid.uuid4().hex}", "object": "event", "type": type_, "created": created, "data": {"object": data}}
+
+
+def _post(api, event, secret=None):
+    payload = json.dumps(event).encode("utf-8")
+    timestamp = int(time.time())
+    signature = hmac.new(
+        (secret or settings.STRIPE_WEBHOOK_SECRET).encode("utf-8"),
+        f"{timestamp}.".encode("utf-8") + payload,
+        hashlib.sha256
+    ).hexdigest()
+    return api("POST", WEBHOOK, content=payload, headers={
+        "Stripe-Signature": f"t={timestamp},v1={signature}",
+        "Content-Type": "application/json"
+    })
+
+
+def _subscription(run, user):
+    async def load():
+        async with AsyncSessionLocal() as db:
+            return await db.scalar(select(models.Subscription).where(models.Subscription.user_id == user.id))
+    return run(load())
+
+
+def _stored_events(run, *ids):
+    async def load():
+        async with AsyncSessionLocal() as db:
+            rows = (await db.scalars(select(models.StripeEvent).where(models.StripeEvent.id.in_(ids)))).all()
+            return {row.id: row for row in rows}
+    return run(load())
+
+
+@pytest.fixture
+def subscribed(create_user):
+    """Usuario con una suscripción de Stripe: (usuario, id de la suscripción en Stripe)"""
+    subscription_id = f"sub_{uuid.uuid4().hex[:14]}"
+    user = create_user(
+        plan_type=models.PlanType.PRO,
+        queries_limit=100,
+        stripe_customer_id=f"cus_{uuid.uuid4().hex[:14]}",
+        stripe_subscription_id=subscription_id
+    )
+    return user, subscription_id
+
+
+def test_invalid_signature_is_rejected(api, run, subscribed):
+    _, subscription_id = subscribed
+    event = _event(subscription_id, created=100)
+
+    r = _post(api, event, secret="whsec_other")
+
+    assert r.status_code == 400
+    assert _stored_events(run, event["id"]) == {}
+
+
+def test_retried_event_is_stored_and_applied_once(api, run, subscribed):
+    user, subscription_id = subscribed
+    event = _event(subscription_id, created=100, status="past_due")
+
+    assert _post(api, event).status_code == 200
+    assert _post(api, event).status_code == 200
+    run(drain_events())
+
+    stored = _stored_events(run, event["id"])
+    assert len(stored) == 1
+    assert stored[event["id"]].processed_at is not None
+    assert stored[event["id"]].attempts == 0
+    assert _subscription(run, user).status == models.SubscriptionStatus.PAST_DUE
+
+
+def test_out_of_order_events_keep_the_newest_state(api, run, subscribed):
+    user, subscription_id = subscribed
+    newer = _event(subscription_id, created=200, type_=SUBSCRIPTION_DELETED, status="canceled")
+    older = _event(subscription_id, created=100, status="active")
+
+    # El más reciente llega y se aplica antes que el antiguo
+    _post(api, newer)
+    run(drain_events())
+    _post(api, older)
+    run(drain_events())
+
+    subscription = _subscription(run, user)
+    assert subscription.status == models.SubscriptionStatus.CANCELLED
+    assert subscription.stripe_event_created == 200
+    assert all(e.processed_at is not None for e in _stored_events(run, newer["id"], older["id"]).values())
+
+
+@pytest.mark.parametrize("stripe_status, status", [
+    ("active", models.SubscriptionStatus.ACTIVE),
+    ("trialing", models.SubscriptionStatus.ACTIVE),
+    ("past_due", models.SubscriptionStatus.PAST_DUE),
+    ("unpaid", models.SubscriptionStatus.PAST_DUE),
+    ("incomplete", models.SubscriptionStatus.PAST_DUE),
+    ("incomplete_expired", models.SubscriptionStatus.EXPIRED),
+    ("paused", models.SubscriptionStatus.EXPIRED),
+    ("canceled", models.SubscriptionStatus.CANCELLED)
+])
+def test_stripe_statuses_are_mapped(api, run, subscribed, stripe_status, status):
+    user, subscription_id = subscribed
+    event = _event(subscription_id, created=100, status=stripe_status)
+
+    _post(api, event)
+    run(drain_events())
+
+    assert _stored_events(run, event["id"])[event["id"]].last_error is None
+    subscription = _subscription(run, user)
+    assert subscription.status == status
+    assert subscription.current_period_end.timestamp() == PERIOD_END
+
+
+def test_unknown_stripe_status_keeps_the_current_one(api, run, subscribed):
+    user, subscription_id = subscribed
+    event = _event(subscription_id, created=100, status="some_future_status")
+
+    _post(api, event)
+    run(drain_events())
+
+    stored = _stored_events(run, event["id"])[event["id"]]
+    assert stored.processed_at is not None and stored.last_error is None
+    assert _subscription(run, user).status == models.SubscriptionStatus.ACTIVE
+
+
+def test_failing_event_records_the_error_and_is_retried(api, run, subscribed):
+    user, subscription_id = subscribed
+    event = _event(subscription_id, created=100, status="past_due")
+    del event["data"]["object"]["current_period_end"]
+
+    _post(api, event)
+    run(drain_events())
+    run(drain_events())
+
+    stored = _stored_events(run, event["id"])[event["id"]]
+    assert stored.processed_at is None
+    assert stored.attempts == 2
+    assert "current_period_end" in stored.last_error
+    assert _subscription(run, user).status == models.SubscriptionStatus.ACTIVE